@@ -0,0 +1,29 @@
+import sys
+import time
+import argparse
+import subprocess
+
+if __name__ == "__main__":
+    # اجرای محلی: یک ingress و چند worker، هر کدام یک process جدا
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=2, help="number of worker processes")
+    args = ap.parse_args()
+
+    procs = [subprocess.Popen([sys.executable, "-m", "bot.ingress"])]
+    for _ in range(args.workers):
+        procs.append(subprocess.Popen([sys.executable, "-m", "bot.worker"]))
+
+    try:
+        while all(p.poll() is None for p in procs):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in procs:
+            if p.poll() is None:
+                p.terminate()
+        for p in procs:
+            try:
+                p.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                p.kill()
@@ -0,0 +1,75 @@
+"""Per-call `psycopg2.connect` vs. the pooled data-access layer.
+
+    DATABASE_URL=postgresql://... python -m bench.bench_db_pool --calls 200 --concurrency 10
+
+Runs `get_setting` the old way (connect, query, close) and through
+`bot.database_async` on top of the pool, sequentially and concurrently.
+"""
+import os
+import time
+import asyncio
+import argparse
+import psycopg2
+from psycopg2.extras import DictCursor
+
+from bot import database as db
+from bot import database_async as adb
+
+
+def per_call_get_setting(key: str):
+    conn = psycopg2.connect(db.DATABASE_URL, cursor_factory=DictCursor)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT value FROM settings WHERE key = %s", (key,))
+            return cur.fetchone()
+    finally:
+        conn.close()
+
+
+async def run_per_call(calls: int, concurrency: int) -> float:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with sem:
+            await asyncio.to_thread(per_call_get_setting, "max_words")
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(calls)))
+    return time.perf_counter() - t0
+
+
+async def run_pooled(calls: int, concurrency: int) -> float:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with sem:
+            await adb.get_setting("max_words")
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(calls)))
+    return time.perf_counter() - t0
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--calls", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=10)
+    args = ap.parse_args()
+    if not db.DATABASE_URL:
+        raise SystemExit("DATABASE_URL not set")
+
+    adb.open_pool()
+    db.init_db()
+    try:
+        print(f"calls={args.calls} pool_max={db.DB_POOL_MAX}")
+        print(f"{'mode':>10} {'conc':>5} {'elapsed(s)':>11} {'ms/call':>8}")
+        for conc in sorted({1, args.concurrency}):
+            for name, fn in (("per-call", run_per_call), ("pooled", run_pooled)):
+                elapsed = await fn(args.calls, conc)
+                print(f"{name:>10} {conc:>5} {elapsed:>11.2f} {1000 * elapsed / args.calls:>8.2f}")
+    finally:
+        adb.close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+"""Job status writes: one `update_job` per transition vs. the write-behind JobWriter.
+
+    python -m bench.bench_job_writer --jobs 2000 --concurrency 20
+    DATABASE_URL=postgresql://... python -m bench.bench_job_writer --db postgres
+
+Inserts `--jobs` pending jobs, then marks each one done with the same fields
+QueueManager writes (status, provider, tokens, stage timestamps), from
+`--concurrency` simulated workers, through `database_async` like the bot.
+SQLite runs on a temporary file.
+"""
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+
+os.environ.setdefault("ADMIN_IDs", "")
+
+
+def open_db(kind: str):
+    os.environ["DB_TYPE"] = kind
+    # خالی و نه حذف: load_dotenv مقدار .env را رویش نمی‌نویسد و با DB_TYPE تناقض پیدا نمی‌کند
+    if kind == "sqlite":
+        os.environ["DB_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="bench_jobs_"), "jobs.db")
+        os.environ["DATABASE_URL"] = ""
+    elif not os.getenv("DATABASE_URL"):
+        raise SystemExit("DATABASE_URL not set")
+    else:
+        os.environ["DB_URL"] = ""
+    from bot.storage import db
+    from bot import database_async as adb
+    adb.open_pool()
+    db.init_db()
+    return db, adb
+
+
+def fields_for(job_id: int) -> dict:
+    now = time.time()
+    return dict(status="done", provider="openai", retry_count=0, tokens_in=120, tokens_out=130,
+                model="gpt-4o-mini", t_dequeue=now - 2, t_provider_start=now - 1.9,
+                t_first_byte=now - 0.4, t_provider_end=now - 0.1, t_delivered=now, key_index=job_id % 4)
+
+
+async def run(update, ids, concurrency: int) -> float:
+    queue = asyncio.Queue()
+    for job_id in ids:
+        queue.put_nowait(job_id)
+
+    async def worker():
+        while not queue.empty():
+            job_id = queue.get_nowait()
+            await update(job_id, **fields_for(job_id))
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - t0
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", choices=("sqlite", "postgres"), default="sqlite")
+    ap.add_argument("--jobs", type=int, default=2000)
+    ap.add_argument("--concurrency", type=int, default=20)
+    ap.add_argument("--interval", type=float, default=0.25)
+    ap.add_argument("--batch", type=int, default=200)
+    args = ap.parse_args()
+
+    from bot.utils.job_writer import JobWriter
+    db, store = open_db(args.db)
+    ids = [db.enqueue_job(None, "openai", 1, "متن", "ویرایش") for _ in range(2 * args.jobs)]
+    direct_ids, batched_ids = ids[:args.jobs], ids[args.jobs:]
+
+    print(f"db={args.db} jobs={args.jobs} concurrency={args.concurrency}")
+    print(f"{'mode':>13} {'elapsed(s)':>11} {'updates/s':>10} {'transactions':>13}")
+    elapsed = await run(store.update_job, direct_ids, args.concurrency)
+    print(f"{'update_job':>13} {elapsed:>11.2f} {args.jobs / elapsed:>10.0f} {args.jobs:>13}")
+
+    writer = JobWriter(store, interval=args.interval, batch=args.batch)
+    writer.start()
+    t0 = time.perf_counter()
+    await run(writer.update, batched_ids, args.concurrency)
+    queued = time.perf_counter() - t0
+    await writer.stop()
+    elapsed = time.perf_counter() - t0
+    print(f"{'JobWriter':>13} {elapsed:>11.2f} {args.jobs / elapsed:>10.0f} {writer.flushes:>13}"
+          f"   (workers done after {queued * 1000:.1f} ms)")
+    store.close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,422 @@
+"""End-to-end load test: real routers and QueueManager against local fakes.
+
+    DB_TYPE=sqlite DB_URL=sqlite:///runs/load.db python -m bench.bench_load --scenario steady
+    DATABASE_URL=postgresql://.../bench python -m bench.bench_load --scenario steady
+    python -m bench.bench_load --scenario burst --json runs/burst.json --baseline runs/burst-main.json
+    python -m bench.bench_load --list
+
+Synthetic users send /start and then text messages, which go through the
+real `Dispatcher` from `bot.app.create_dispatcher`, the real handlers and
+`QueueManager`, and the real OpenAI / Gemini / aiogram clients. The other
+ends are the fakes in `bench/fake_services.py`: a Bot API server, an
+OpenAI-compatible HTTP server and a Gemini gRPC server, with the latency,
+error and 429 profile of the scenario.
+
+Reported: job throughput, handler and end-to-end latency percentiles, the
+per-stage breakdown from the jobs table (same query as /latency), event-loop
+lag, memory, and request counts on each fake. A run is repeatable: message
+texts, LLM latencies and failures are all derived from `--seed`.
+
+The run writes users, jobs and settings (rate_limit_seconds, max_words,
+default_provider) to the configured database: use a throwaway one.
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+from collections import deque
+from dataclasses import dataclass, field, asdict, replace
+
+try:
+    import resource
+except ImportError:
+    # ویندوز
+    resource = None
+
+from bench.fake_services import Profile, FakeOpenAI, FakeGemini, FakeTelegram
+
+
+@dataclass
+class Scenario:
+    users: int = 100
+    messages: int = 500
+    rate: float = 20            # پیام در ثانیه؛ 0 یعنی همه با هم
+    words: int = 60
+    provider: str = "openai"
+    keys: int = 4
+    stream: bool = False
+    rate_limit_seconds: int = 0
+    tg_latency: float = 0.02
+    openai: Profile = field(default_factory=Profile)
+    gemini: Profile = field(default_factory=Profile)
+    env: dict = field(default_factory=dict)
+
+
+# سقف RPM کلیدها بالا تا محدودیت KeyScheduler نتیجه را تعیین نکند، مگر سناریو بخواهد
+_FAST_KEYS = {"OPENAI_KEY_RPM": "5000", "GEMINI_KEY_RPM": "5000"}
+
+SCENARIOS = {
+    "smoke": Scenario(users=10, messages=40, rate=20, words=30,
+                      openai=Profile(latency=0.1, jitter=0.1), env=_FAST_KEYS),
+    "steady": Scenario(users=200, messages=1000, rate=40, env=_FAST_KEYS),
+    "burst": Scenario(users=500, messages=1500, rate=0, env=_FAST_KEYS),
+    "long": Scenario(users=50, messages=100, rate=5, words=2500, env=_FAST_KEYS),
+    "stream": Scenario(users=100, messages=300, rate=15, stream=True, env=_FAST_KEYS),
+    # 429 و خطای OpenAI: retry، circuit breaker و failover به Gemini
+    "throttled": Scenario(users=200, messages=600, rate=30,
+                          openai=Profile(latency=1.0, throttle_rate=0.25, error_rate=0.05),
+                          gemini=Profile(latency=1.5), env=_FAST_KEYS),
+    "gemini": Scenario(users=200, messages=600, rate=30, provider="gemini",
+                       gemini=Profile(latency=1.2, throttle_rate=0.05), env=_FAST_KEYS),
+    # سقف واقعی کلیدهای رایگان Gemini (۱۵ درخواست در دقیقه)
+    "gemini_free": Scenario(users=50, messages=120, rate=2, provider="gemini", keys=2),
+}
+
+_VOCAB = ("متن", "نمونه", "ویراستاری", "فارسی", "نگارش", "جمله", "کتاب", "نویسنده", "خواننده",
+          "امروز", "دیروز", "شهر", "زبان", "درست", "است", "بود", "کرد", "می‌شود", "را", "با", "از",
+          "به", "در", "که", "این", "آن", "خیلی", "خوب", "بزرگ", "کوچک", "،", ".")
+
+MARKER = re.compile(r"\bLT(\d+)\b")
+
+
+def make_text(rng: random.Random, words: int, i: int) -> str:
+    out, paragraph = [], []
+    for n in range(words):
+        paragraph.append(rng.choice(_VOCAB))
+        if len(paragraph) >= 80 and n < words - 1:
+            out.append(" ".join(paragraph))
+            paragraph = []
+    # نشانه‌ی پیام در انتهای متن؛ با پژواک موتور جعلی در پاسخ نهایی برمی‌گردد
+    paragraph.append(f"LT{i}")
+    out.append(" ".join(paragraph))
+    return "\n\n".join(out)
+
+
+def make_update(update_id: int, user_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": text,
+        },
+    }
+
+
+class Tracker:
+    """Matches what the fake Telegram receives to the synthetic messages."""
+    def __init__(self, expected: int):
+        self.expected = expected
+        self.sent = {}
+        self.handler = []
+        self.outcome = {}
+        self.open = {}
+        self.done = asyncio.Event()
+        self.recording = False
+
+    def submit(self, i: int, chat_id: int):
+        self.sent[i] = time.perf_counter()
+        self.open.setdefault(chat_id, deque()).append(i)
+
+    def _finish(self, i: int, kind: str, when: float, chat_id: int):
+        if i in self.outcome:
+            return
+        self.outcome[i] = (kind, when)
+        try:
+            self.open[chat_id].remove(i)
+        except (KeyError, ValueError):
+            pass
+        if len(self.outcome) >= self.expected:
+            self.done.set()
+
+    def on_text(self, chat_id: int, text: str, when: float):
+        if not self.recording:
+            return
+        m = MARKER.search(text)
+        if m:
+            return self._finish(int(m.group(1)), "done", when, chat_id)
+        waiting = self.open.get(chat_id)
+        if not waiting:
+            return
+        if "❌" in text:
+            self._finish(waiting[0], "error", when, chat_id)
+        elif text.startswith(("⏳", "⛔", "🚫")):
+            self._finish(waiting[0], "rejected", when, chat_id)
+
+
+async def loop_lag(samples: list, interval: float = 0.01):
+    while True:
+        t0 = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - t0 - interval)
+
+
+def memory_mb():
+    """(current RSS, peak RSS) in MB; None where the platform does not say."""
+    current = peak = None
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) / 1024
+                elif line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if peak is None and resource is not None:
+        # macOS بایت، لینوکس کیلوبایت
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+    return current, peak
+
+
+def pcts(values, scale: float = 1000.0) -> dict:
+    from bot.utils.job_timing import percentile
+    values = sorted(values)
+    out = {f"p{int(p * 100)}": (percentile(values, p) or 0.0) * scale for p in (0.5, 0.95, 0.99)}
+    out["max"] = (values[-1] if values else 0.0) * scale
+    return out
+
+
+def _configure_env(scenario: Scenario, tg, openai, gemini, seed: int, cache_dir: str):
+    env = {
+        "BOT_TOKEN": "42:LOAD",
+        "TELEGRAM_API_URL": tg.url,
+        "OPENAI_BASE_URL": openai.url,
+        "GEMINI_API_ENDPOINT": gemini.url,
+        "OPENAI_API_KEYS": ",".join(f"load-openai-{seed}-{i}" for i in range(scenario.keys)),
+        "GEMINI_API_KEYS": ",".join(f"load-gemini-{seed}-{i}" for i in range(scenario.keys)),
+        "STREAM_RESPONSES": "1" if scenario.stream else "0",
+        # کش نتایج خالی در هر اجرا تا اجرای دوم همان seed از کش جواب نگیرد
+        "RESULT_CACHE_PATH": os.path.join(cache_dir, "result_cache.db"),
+        "METRICS_PORT": "0",
+    }
+    env.update(scenario.env)
+    os.environ.update(env)
+    os.environ.setdefault("ADMIN_IDs", "")
+
+
+async def run(scenario: Scenario, seed: int, timeout: float, verbose: bool = False) -> dict:
+    tracker = Tracker(scenario.messages)
+    tg = FakeTelegram(scenario.tg_latency, on_text=tracker.on_text)
+    openai = FakeOpenAI(scenario.openai, seed)
+    gemini = FakeGemini(scenario.gemini, seed)
+    for fake in (tg, openai, gemini):
+        await fake.start()
+    cache_dir = tempfile.mkdtemp(prefix="bench_load_")
+    _configure_env(scenario, tg, openai, gemini, seed, cache_dir)
+
+    # import بعد از env: تنظیمات ماژول‌ها در زمان import خوانده می‌شود
+    from aiogram.types import Update
+    from bot import database_async
+    from bot.app import create_bot, create_dispatcher, open_resources, close_resources
+    from bot.handlers import process as h_process
+    from bot.utils.settings_manager import SETTINGS
+
+    logger = logging.getLogger("bench_load")
+    # خطاهای مورد انتظار سناریو (429، 500) در خروجی نیایند مگر با --verbose
+    logger.setLevel(logging.INFO if verbose else logging.CRITICAL)
+    await open_resources(logger)
+    await SETTINGS.set("rate_limit_seconds", str(scenario.rate_limit_seconds))
+    await SETTINGS.set("max_words", str(max(5000, scenario.words * 2)))
+    await SETTINGS.set("default_provider", scenario.provider)
+
+    bot = create_bot()
+    dp = create_dispatcher(logger)
+    qm = h_process.queue_manager
+    await qm.start(bot)
+
+    rng = random.Random(seed)
+    users = [700_000_000 + seed * 100_000 + u for u in range(scenario.users)]
+    texts = [make_text(rng, scenario.words, i) for i in range(scenario.messages)]
+
+    async def feed(raw: dict):
+        await dp.feed_update(bot, Update.model_validate(raw, context={"bot": bot}))
+
+    # /start برای همه (اندازه‌گیری نمی‌شود)
+    update_id = 0
+    for batch in range(0, len(users), 50):
+        starts = []
+        for uid in users[batch:batch + 50]:
+            update_id += 1
+            starts.append(feed(make_update(update_id, uid, "/start")))
+        await asyncio.gather(*starts)
+    tg_before = dict(tg.counts)
+
+    lag = []
+    monitor = asyncio.create_task(loop_lag(lag))
+    tracker.recording = True
+    wall_start = time.time()
+
+    async def send(i: int, uid: int, raw: dict):
+        tracker.submit(i, uid)
+        t0 = time.perf_counter()
+        try:
+            await feed(raw)
+        except Exception as e:
+            logger.error(f"update {i} failed: {e}")
+            tracker._finish(i, "error", time.perf_counter(), uid)
+        tracker.handler.append(time.perf_counter() - t0)
+
+    t_start = time.perf_counter()
+    tasks = []
+    for i, text in enumerate(texts):
+        uid = users[i % len(users)]
+        update_id += 1
+        tasks.append(asyncio.create_task(send(i, uid, make_update(update_id, uid, text))))
+        if scenario.rate > 0:
+            # زمان‌بندی ثابت (نه نسبت به پایان sleep قبلی) تا تأخیر loop روی نرخ ورودی اثر نگذارد
+            await asyncio.sleep(max(0.0, t_start + (i + 1) / scenario.rate - time.perf_counter()))
+    await asyncio.gather(*tasks)
+    timed_out = False
+    try:
+        await asyncio.wait_for(tracker.done.wait(), timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+    monitor.cancel()
+    # تحویل در تلگرام کمی قبل از update نهایی job است؛ تا آخرین ردیف هم نوشته شود
+    while qm.in_flight and not timed_out:
+        await asyncio.sleep(0.05)
+    await qm.writer.flush()
+
+    finished = [t for kind, t in tracker.outcome.values()]
+    elapsed = (max(finished) if finished else time.perf_counter()) - t_start
+    kinds = [kind for kind, _ in tracker.outcome.values()]
+    e2e = [t - tracker.sent[i] for i, (kind, t) in tracker.outcome.items() if kind == "done"]
+    try:
+        stages = await database_async.job_latency(wall_start)
+    except Exception as e:
+        logger.error(f"job_latency failed: {e}")
+        stages = {}
+    current, peak = memory_mb()
+
+    await qm.stop()
+    await close_resources()
+    await bot.session.close()
+    for fake in (tg, openai, gemini):
+        await fake.stop()
+
+    done = kinds.count("done")
+    return {
+        "messages": scenario.messages,
+        "done": done,
+        "errors": kinds.count("error"),
+        "rejected": kinds.count("rejected"),
+        "unfinished": scenario.messages - len(kinds),
+        "timed_out": timed_out,
+        "elapsed_s": round(elapsed, 3),
+        "throughput": round(done / elapsed, 2) if elapsed > 0 else 0.0,
+        "handler_ms": pcts(tracker.handler),
+        "e2e_ms": pcts(e2e),
+        "loop_lag_ms": pcts(lag),
+        "rss_mb": current,
+        "peak_rss_mb": peak,
+        "stages_s": {name: dict(zip(("n", "p50", "p95", "p99"), v)) for name, v in stages.items()},
+        "openai": openai.counts,
+        "gemini": gemini.counts,
+        "telegram": {k: v - tg_before.get(k, 0) for k, v in tg.counts.items() if v - tg_before.get(k, 0)},
+    }
+
+
+def _fmt(d: dict) -> str:
+    return "  ".join(f"{k} {v:.1f}" for k, v in d.items())
+
+
+def print_report(name: str, seed: int, r: dict):
+    print(f"scenario={name} seed={seed}")
+    print(f"  jobs: {r['done']}/{r['messages']} done, {r['errors']} errors, {r['rejected']} rejected, "
+          f"{r['unfinished']} unfinished" + (" (timed out)" if r["timed_out"] else ""))
+    print(f"  throughput: {r['throughput']:.2f} jobs/s over {r['elapsed_s']:.1f}s")
+    print(f"  handler ms:   {_fmt(r['handler_ms'])}")
+    print(f"  end-to-end ms: {_fmt(r['e2e_ms'])}")
+    print(f"  loop lag ms:  {_fmt(r['loop_lag_ms'])}")
+    if r["peak_rss_mb"] is not None:
+        print(f"  memory: rss {r['rss_mb'] or 0:.0f} MB, peak {r['peak_rss_mb']:.0f} MB")
+    for stage, s in r["stages_s"].items():
+        if s["n"]:
+            print(f"  stage {stage:<10} n={s['n']:<5} p50 {s['p50']:.3f}s  p95 {s['p95']:.3f}s  p99 {s['p99']:.3f}s")
+    print(f"  openai: {r['openai']}")
+    print(f"  gemini: {r['gemini']}")
+    print(f"  telegram: {r['telegram']}")
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions against a previous --json result of the same scenario and seed."""
+    problems = []
+    base = baseline["result"]
+    if result["throughput"] < base["throughput"] * (1 - tolerance):
+        problems.append(f"throughput {result['throughput']:.2f} < {base['throughput']:.2f} jobs/s")
+    for key in ("e2e_ms", "handler_ms"):
+        # چند ده میلی‌ثانیه نوسان بین دو اجرا عادی است
+        if result[key]["p95"] > base[key]["p95"] * (1 + tolerance) + 50:
+            problems.append(f"{key} p95 {result[key]['p95']:.1f} > {base[key]['p95']:.1f}")
+    if result["done"] < base["done"]:
+        problems.append(f"done {result['done']} < {base['done']}")
+    return problems
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--scenario", default="smoke", choices=sorted(SCENARIOS))
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--messages", type=int, help="override the scenario's message count")
+    ap.add_argument("--rate", type=float, help="override the arrival rate (messages/s, 0 = burst)")
+    ap.add_argument("--users", type=int)
+    ap.add_argument("--set", action="append", default=[], metavar="ENV=VALUE",
+                    help="extra env for the bot, e.g. --set QUEUE_MAX_WORKERS=40")
+    ap.add_argument("--timeout", type=float, default=600, help="max wait for the last job (s)")
+    ap.add_argument("--json", help="write the result to this file")
+    ap.add_argument("--baseline", help="fail (exit 1) on regression against this --json file")
+    ap.add_argument("--tolerance", type=float, default=0.15)
+    ap.add_argument("--list", action="store_true", help="print the scenarios and exit")
+    ap.add_argument("--verbose", action="store_true", help="show the bot's job log")
+    args = ap.parse_args()
+
+    if args.list:
+        for name, s in SCENARIOS.items():
+            print(f"{name}: {asdict(s)}")
+        return
+
+    scenario = SCENARIOS[args.scenario]
+    overrides = {k: v for k, v in (("messages", args.messages), ("rate", args.rate), ("users", args.users))
+                 if v is not None}
+    env = dict(scenario.env)
+    for item in args.set:
+        k, _, v = item.partition("=")
+        env[k] = v
+    scenario = replace(scenario, env=env, **overrides)
+
+    from bot.storage import DB_TYPE
+    if DB_TYPE != "sqlite" and not os.getenv("DATABASE_URL"):
+        raise SystemExit("DATABASE_URL not set (use a throwaway database, or DB_TYPE=sqlite)")
+
+    result = asyncio.run(run(scenario, args.seed, args.timeout, args.verbose))
+    print_report(args.scenario, args.seed, result)
+
+    record = {"scenario": args.scenario, "seed": args.seed, "config": asdict(scenario), "result": result}
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if (baseline["scenario"], baseline["seed"]) != (args.scenario, args.seed):
+            raise SystemExit("baseline is from a different scenario/seed")
+        problems = compare(result, baseline, args.tolerance)
+        for p in problems:
+            print(f"REGRESSION: {p}")
+        if problems:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Throughput of QueueManager vs. worker count, using a fake slow provider.
+
+    python -m bench.bench_queue_workers --jobs 30 --latency 0.5 --workers 1,3,6
+
+No network or DB is touched: the provider is an `asyncio.sleep`, jobs live in
+an in-memory store and the bot only counts the messages it is asked to send.
+"""
+import os
+import time
+import asyncio
+import argparse
+
+os.environ.setdefault("ADMIN_IDs", "")
+# کلیدهای ساختگی تا سقف همزمانی هر موتور مانع بنچمارک نشود
+os.environ.setdefault("OPENAI_API_KEYS", ",".join(f"bench-{i}" for i in range(32)))
+
+from bot.utils.queue_manager import QueueManager
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent += 1
+
+
+def fake_provider(latency: float):
+    async def run(provider: str, instruction: str, text: str) -> str:
+        await asyncio.sleep(latency)
+        return text
+    return run
+
+
+class MemoryStore:
+    """The subset of `bot.database_async` that QueueManager uses."""
+    def __init__(self):
+        self.jobs = {}
+        self.pending = []
+        self.done = asyncio.Event()
+        self.expected = 0
+
+    async def enqueue_job(self, user_id, provider, chat_id=None, text=None, instruction=None, lane=0, cost=1,
+                          est_tokens_in=None, est_tokens_out=None, chunk_tokens=None, t_enqueue=None):
+        # همان sched_key که database.enqueue_job می‌سازد
+        head = min((self.jobs[i]["sched_key"] for i in self.pending if self.jobs[i]["lane"] == lane), default=0)
+        last = max((self.jobs[i]["sched_key"] for i in self.pending
+                    if self.jobs[i]["lane"] == lane and self.jobs[i]["user_id"] == user_id), default=0)
+        job_id = len(self.jobs) + 1
+        self.jobs[job_id] = {"id": job_id, "user_id": user_id, "chat_id": chat_id, "text": text,
+                             "instruction": instruction, "provider": provider, "status": "pending",
+                             "lane": lane, "sched_key": max(head, last) + cost, "chunk_tokens": chunk_tokens,
+                             "created": time.monotonic(), "t_enqueue": t_enqueue}
+        self.pending.append(job_id)
+        return job_id
+
+    async def claim_job(self, worker_id, lease_seconds, providers=None):
+        ids = [i for i in self.pending if providers is None or self.jobs[i]["provider"] in providers]
+        if not ids:
+            return None
+        first = min(ids, key=lambda i: (-self.jobs[i]["lane"], self.jobs[i]["sched_key"], i))
+        self.pending.remove(first)
+        job = self.jobs[first]
+        job["waited"] = time.monotonic() - job["created"]
+        job["status"] = "processing"
+        return job
+
+    async def heartbeat_jobs(self, worker_id, lease_seconds, job_ids):
+        return 0
+
+    async def reclaim_expired_jobs(self, max_attempts):
+        return 0
+
+    async def update_job(self, job_id, **fields):
+        await self.update_jobs([(job_id, fields)])
+
+    async def update_jobs(self, updates):
+        for job_id, fields in updates:
+            self.jobs[job_id].update(fields)
+        if sum(j["status"] in ("done", "error") for j in self.jobs.values()) >= self.expected:
+            self.done.set()
+
+
+async def run_once(workers: int, jobs: int, latency: float) -> float:
+    bot = FakeBot()
+    store = MemoryStore()
+    store.expected = jobs
+    qm = QueueManager(workers=workers, runner=fake_provider(latency), cache=None, store=store)
+    await qm.start(bot)
+    t0 = time.perf_counter()
+    for i in range(jobs):
+        await qm.enqueue(i, i, f"متن نمونه {i}", "ویرایش", "openai")
+    await store.done.wait()
+    elapsed = time.perf_counter() - t0
+    await qm.stop()
+    assert bot.sent == jobs, (bot.sent, jobs)
+    return elapsed
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--jobs", type=int, default=30)
+    ap.add_argument("--latency", type=float, default=0.5, help="fake provider latency (s)")
+    ap.add_argument("--workers", default="1,2,3,6,10")
+    args = ap.parse_args()
+
+    print(f"jobs={args.jobs} latency={args.latency}s")
+    print(f"{'workers':>8} {'elapsed(s)':>11} {'jobs/s':>8}")
+    for w in [int(x) for x in args.workers.split(",")]:
+        elapsed = await run_once(w, args.jobs, args.latency)
+        print(f"{w:>8} {elapsed:>11.2f} {args.jobs / elapsed:>8.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+"""SQLite backend: the tuned engine vs. the previous connect-per-call one.
+
+    python -m bench.bench_sqlite --jobs 2000 --concurrency 20
+
+Each simulated request does what a text message costs the database: a rate
+limit check, a profile read, enqueue, queue position, claim and the final
+status update. `legacy` reproduces the old `get_conn()` (new connection and
+`PRAGMA journal_mode=WAL` on every call, default synchronous=FULL, writes
+from any pool thread); `tuned` is `bot/database_sqlite.py` as it is, through
+`database_async`. Each mode gets a fresh database file.
+"""
+import os
+import time
+import asyncio
+import sqlite3
+import argparse
+import tempfile
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("ADMIN_IDs", "")
+os.environ["DB_TYPE"] = "sqlite"
+os.environ["DATABASE_URL"] = ""
+
+
+def legacy_conn(db):
+    conn = sqlite3.connect(db.DB_PATH, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL;")
+    return conn
+
+
+def fresh_db(db):
+    db.close_pool()
+    db.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="bench_sqlite_"), "bench.db")
+    db.init_db()
+
+
+async def request(call, db, i: int, users: int):
+    tid = 1000 + i % users
+    await call(db.rate_limit_hit, f"user:{tid}", 0.001, 1000)
+    await call(db.get_user_by_tid, tid)
+    job_id = await call(db.enqueue_job, tid, "openai", tid, "متن " * 50, None, 0, 1, None, None, None, time.time())
+    await call(db.queue_position, job_id)
+    job = await call(db.claim_job, "bench", 60, None)
+    await call(db.update_job, job["id"], status="done", provider="openai", tokens_in=120, tokens_out=130,
+               t_delivered=time.time())
+
+
+async def run(call, db, jobs: int, concurrency: int, users: int):
+    queue = asyncio.Queue()
+    for i in range(jobs):
+        queue.put_nowait(i)
+    latencies = []
+
+    async def client():
+        while not queue.empty():
+            i = queue.get_nowait()
+            t0 = time.perf_counter()
+            await request(call, db, i, users)
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    latencies.sort()
+    return time.perf_counter() - t0, latencies
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--jobs", type=int, default=2000)
+    ap.add_argument("--concurrency", type=int, default=20)
+    ap.add_argument("--users", type=int, default=200)
+    args = ap.parse_args()
+
+    from bot import database_sqlite as db
+    from bot import database_async as adb
+    from bot.utils.job_timing import percentile
+
+    def prepare():
+        fresh_db(db)
+        for i in range(args.users):
+            db.upsert_user(1000 + i, f"user {i}", None, None)
+
+    async def tuned(fn, *a, **kw):
+        return await adb._run(fn, *a, **kw)
+
+    # مثل قبل: هر thread از pool هر تابعی (خواندن یا نوشتن) را با اتصال تازه اجرا می‌کند
+    pool = ThreadPoolExecutor(max_workers=db.DB_POOL_MAX, thread_name_prefix="legacy")
+
+    async def legacy(fn, *a, **kw):
+        fn = getattr(fn, "__wrapped__", fn)
+        return await asyncio.get_running_loop().run_in_executor(pool, functools.partial(fn, *a, **kw))
+
+    print(f"jobs={args.jobs} concurrency={args.concurrency} threads={db.DB_POOL_MAX}")
+    print(f"{'mode':>7} {'elapsed(s)':>11} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, call in (("legacy", legacy), ("tuned", tuned)):
+        prepare()
+        get_conn = db.get_conn
+        if name == "legacy":
+            db.get_conn = functools.partial(legacy_conn, db)
+        try:
+            elapsed, lat = await run(call, db, args.jobs, args.concurrency, args.users)
+        finally:
+            db.get_conn = get_conn
+        p = [percentile(lat, q) * 1000 for q in (0.5, 0.95, 0.99)]
+        print(f"{name:>7} {elapsed:>11.2f} {args.jobs / elapsed:>8.0f} {p[0]:>8.2f} {p[1]:>8.2f} {p[2]:>8.2f}")
+    pool.shutdown()
+    adb.close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
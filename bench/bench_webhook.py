@@ -0,0 +1,210 @@
+"""Update throughput and delivery latency: long polling vs. the webhook server.
+
+    python -m bench.bench_webhook --updates 2000 --rtt 0.08 --rate 0
+    python -m bench.bench_webhook --updates 500 --rtt 0.08 --rate 200
+
+Both modes run the real aiogram Dispatcher; the webhook mode also runs the
+real `create_webhook_app` on a local port. Telegram is simulated: in polling
+mode a fake session answers getUpdates (long poll, `--rtt` per round trip,
+up to 100 updates per call); in webhook mode a client POSTs each update with
+up to `--connections` requests in flight, like Telegram's max_connections.
+
+`--rate 0` queues every update up front (throughput); a positive rate makes
+them arrive over time (latency from arrival to handler).
+"""
+import os
+import time
+import asyncio
+import argparse
+
+os.environ.setdefault("ADMIN_IDs", "")
+
+import aiohttp
+from aiohttp import web
+from aiogram import Bot, Dispatcher, Router, F
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import GetUpdates, GetMe
+from aiogram.types import Update, User, Message
+
+from bot.app import create_webhook_app
+
+SECRET = "bench-secret"
+PATH = "/telegram/webhook"
+
+
+def make_update(i: int) -> dict:
+    uid = 1000 + i % 50
+    return {
+        "update_id": i,
+        "message": {
+            "message_id": i,
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"},
+            "from": {"id": uid, "is_bot": False, "first_name": "bench"},
+            "text": "سلام",
+        },
+    }
+
+
+class FakeTelegram:
+    """Updates as they 'arrive' at Telegram, with their arrival time."""
+    def __init__(self):
+        self.pending = []
+        self.arrived = {}
+        self.cond = asyncio.Condition()
+
+    async def add(self, raw: dict):
+        async with self.cond:
+            self.arrived[raw["update_id"]] = time.perf_counter()
+            self.pending.append(raw)
+            self.cond.notify_all()
+
+    async def produce(self, n: int, rate: float, on_update=None):
+        for i in range(1, n + 1):
+            raw = make_update(i)
+            await self.add(raw)
+            if on_update:
+                on_update(raw)
+            if rate > 0:
+                await asyncio.sleep(1 / rate)
+
+
+class PollingSession(BaseSession):
+    """Answers getUpdates from FakeTelegram like a long poll; everything else succeeds."""
+    def __init__(self, tg: FakeTelegram, rtt: float):
+        super().__init__()
+        self.tg = tg
+        self.rtt = rtt
+        self.calls = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        if isinstance(method, GetMe):
+            return User(id=42, is_bot=True, first_name="bench", username="bench_bot")
+        if not isinstance(method, GetUpdates):
+            return True
+        self.calls += 1
+        await asyncio.sleep(self.rtt / 2)
+        offset = method.offset or 0
+        async with self.tg.cond:
+            self.tg.pending = [u for u in self.tg.pending if u["update_id"] >= offset]
+            try:
+                await asyncio.wait_for(self.tg.cond.wait_for(lambda: self.tg.pending), method.timeout or 10)
+            except asyncio.TimeoutError:
+                pass
+            batch = self.tg.pending[:method.limit or 100]
+        await asyncio.sleep(self.rtt / 2)
+        return [Update.model_validate(u, context={"bot": bot}) for u in batch]
+
+    async def stream_content(self, *args, **kwargs):
+        # abstract در BaseSession؛ این bench فایلی دانلود نمی‌کند
+        for chunk in ():
+            yield chunk
+
+    async def close(self):
+        pass
+
+
+class Counter:
+    def __init__(self, tg: FakeTelegram, expected: int, handler_latency: float):
+        self.tg = tg
+        self.expected = expected
+        self.handler_latency = handler_latency
+        self.latencies = []
+        self.done = asyncio.Event()
+
+    def router(self) -> Router:
+        router = Router()
+
+        @router.message(F.text)
+        async def on_text(message: Message, event_update: Update):
+            self.latencies.append(time.perf_counter() - self.tg.arrived[event_update.update_id])
+            if self.handler_latency:
+                await asyncio.sleep(self.handler_latency)
+            if len(self.latencies) >= self.expected:
+                self.done.set()
+
+        return router
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000 if values else 0.0
+
+
+async def run_polling(n: int, rate: float, rtt: float, handler_latency: float):
+    tg = FakeTelegram()
+    counter = Counter(tg, n, handler_latency)
+    session = PollingSession(tg, rtt)
+    bot = Bot("42:BENCH", session=session)
+    dp = Dispatcher()
+    dp.include_router(counter.router())
+
+    t0 = time.perf_counter()
+    producer = asyncio.create_task(tg.produce(n, rate))
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False,
+                                                   polling_timeout=1))
+    await counter.done.wait()
+    elapsed = time.perf_counter() - t0
+    await dp.stop_polling()
+    await asyncio.gather(producer, polling)
+    return elapsed, counter.latencies, f"getUpdates calls: {session.calls}"
+
+
+async def run_webhook(n: int, rate: float, rtt: float, handler_latency: float, connections: int):
+    tg = FakeTelegram()
+    counter = Counter(tg, n, handler_latency)
+    bot = Bot("42:BENCH", session=PollingSession(tg, rtt))
+    dp = Dispatcher()
+    dp.include_router(counter.router())
+    runner = web.AppRunner(create_webhook_app(dp, bot, SECRET, PATH))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}{PATH}"
+
+    sem = asyncio.Semaphore(connections)
+    statuses = {}
+    async with aiohttp.ClientSession() as http:
+        async def deliver(raw):
+            async with sem:
+                await asyncio.sleep(rtt / 2)
+                async with http.post(url, json=raw, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}) as resp:
+                    statuses[resp.status] = statuses.get(resp.status, 0) + 1
+
+        posts = []
+        t0 = time.perf_counter()
+        await tg.produce(n, rate, on_update=lambda raw: posts.append(asyncio.create_task(deliver(raw))))
+        await counter.done.wait()
+        elapsed = time.perf_counter() - t0
+        await asyncio.gather(*posts)
+
+        # update بدون secret باید رد شود
+        async with http.post(url, json=make_update(n + 1)) as resp:
+            rejected = resp.status
+    await runner.cleanup()
+    return elapsed, counter.latencies, f"HTTP statuses: {statuses}, without secret: {rejected}"
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--updates", type=int, default=2000)
+    ap.add_argument("--rate", type=float, default=0, help="updates/s arriving at Telegram; 0 = all at once")
+    ap.add_argument("--rtt", type=float, default=0.08, help="simulated Telegram round trip (s)")
+    ap.add_argument("--handler-latency", type=float, default=0.0)
+    ap.add_argument("--connections", type=int, default=40, help="webhook max_connections")
+    args = ap.parse_args()
+
+    print(f"updates={args.updates} rate={args.rate or 'burst'} rtt={args.rtt}s handler={args.handler_latency}s")
+    print(f"{'mode':>8} {'elapsed(s)':>11} {'updates/s':>10} {'p50(ms)':>8} {'p95(ms)':>8} {'p99(ms)':>8}")
+    for name, coro in (
+        ("polling", run_polling(args.updates, args.rate, args.rtt, args.handler_latency)),
+        ("webhook", run_webhook(args.updates, args.rate, args.rtt, args.handler_latency, args.connections)),
+    ):
+        elapsed, lat, extra = await coro
+        print(f"{name:>8} {elapsed:>11.2f} {len(lat) / elapsed:>10.1f} "
+              f"{pct(lat, 0.5):>8.1f} {pct(lat, 0.95):>8.1f} {pct(lat, 0.99):>8.1f}   {extra}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,264 @@
+"""Local stand-ins for the Telegram Bot API, OpenAI and Gemini, for bench_load.
+
+The bot talks to them over real sockets with its normal clients:
+`TELEGRAM_API_URL`, `OPENAI_BASE_URL` and `GEMINI_API_ENDPOINT` point there.
+The LLM fakes echo the input text back after a latency drawn from a
+`Profile`, and fail with 429 / 5xx at the profile's rates. Every draw comes
+from an RNG seeded by (seed, provider, prompt, attempt), so the same scenario
+gets the same latencies and failures no matter how requests interleave.
+"""
+import json
+import time
+import random
+import asyncio
+import hashlib
+from dataclasses import dataclass
+
+import grpc
+from aiohttp import web
+from google.ai import generativelanguage as glm
+
+GEMINI_SERVICE = "google.ai.generativelanguage.v1beta.GenerativeService"
+
+
+@dataclass
+class Profile:
+    latency: float = 1.0        # میانه‌ی زمان تا اولین توکن (s)
+    jitter: float = 0.3         # sigma لگ‌نرمال
+    tokens_per_second: float = 200
+    error_rate: float = 0.0     # 500 / INTERNAL
+    throttle_rate: float = 0.0  # 429 / RESOURCE_EXHAUSTED
+    retry_after: float = 1.0
+
+
+def input_text(prompt: str) -> str:
+    """The user text inside the prompt built by openai_api / gemini_api."""
+    if "متن ورودی:\n" not in prompt:
+        return prompt
+    return prompt.split("متن ورودی:\n", 1)[1].rsplit("\n\n", 1)[0]
+
+
+def approx_tokens(text: str) -> int:
+    return max(1, len(text) // 3)
+
+
+class FakeLLM:
+    """Shared behaviour of both LLM fakes: deterministic outcome and timing per request."""
+    def __init__(self, name: str, profile: Profile, seed: int):
+        self.name = name
+        self.profile = profile
+        self.seed = seed
+        self.attempts = {}
+        self.counts = {"requests": 0, "ok": 0, "throttled": 0, "error": 0}
+
+    def draw(self, prompt: str):
+        """-> (outcome, seconds to first token, seconds per output token)."""
+        digest = hashlib.sha1(prompt.encode()).hexdigest()[:16]
+        attempt = self.attempts.get(digest, 0)
+        self.attempts[digest] = attempt + 1
+        rng = random.Random(f"{self.seed}:{self.name}:{digest}:{attempt}")
+        p = self.profile
+        self.counts["requests"] += 1
+        roll = rng.random()
+        if roll < p.throttle_rate:
+            outcome = "throttled"
+        elif roll < p.throttle_rate + p.error_rate:
+            outcome = "error"
+        else:
+            outcome = "ok"
+        self.counts[outcome] += 1
+        ttft = p.latency * rng.lognormvariate(0, p.jitter) if p.jitter else p.latency
+        per_token = 1 / p.tokens_per_second if p.tokens_per_second else 0.0
+        return outcome, ttft, per_token
+
+
+class FakeOpenAI(FakeLLM):
+    """`/v1/chat/completions`, plain and SSE streaming."""
+    def __init__(self, profile: Profile, seed: int):
+        super().__init__("openai", profile, seed)
+        self.runner = None
+        self.url = None
+
+    async def start(self, host: str = "127.0.0.1"):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.completions)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, 0)
+        await site.start()
+        self.url = f"http://{host}:{site._server.sockets[0].getsockname()[1]}/v1"
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    async def completions(self, request):
+        body = await request.json()
+        prompt = body["messages"][-1]["content"]
+        outcome, ttft, per_token = self.draw(prompt)
+        await asyncio.sleep(ttft)
+        if outcome == "throttled":
+            return web.json_response(
+                {"error": {"message": "Rate limit reached for requests", "type": "requests",
+                           "code": "rate_limit_exceeded"}},
+                status=429, headers={"retry-after": str(self.profile.retry_after)})
+        if outcome == "error":
+            return web.json_response({"error": {"message": "The server had an error", "type": "server_error"}},
+                                     status=500)
+
+        out = input_text(prompt)
+        usage = {"prompt_tokens": approx_tokens(prompt), "completion_tokens": approx_tokens(out)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": body.get("model", "fake")}
+        if not body.get("stream"):
+            await asyncio.sleep(per_token * usage["completion_tokens"])
+            return web.json_response({
+                **base, "object": "chat.completion", "usage": usage,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": out}}],
+            })
+
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+
+        async def send(chunk):
+            await resp.write(f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', **chunk})}\n\n".encode())
+
+        for word in _words(out):
+            await send({"choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]})
+            await asyncio.sleep(per_token * approx_tokens(word))
+        await send({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send({"choices": [], "usage": usage})
+        await resp.write(b"data: [DONE]\n\n")
+        await resp.write_eof()
+        return resp
+
+
+class FakeGemini(FakeLLM):
+    """GenerateContent / StreamGenerateContent over plaintext gRPC."""
+    def __init__(self, profile: Profile, seed: int):
+        super().__init__("gemini", profile, seed)
+        self.server = None
+        self.url = None
+
+    async def start(self, host: str = "127.0.0.1"):
+        self.server = grpc.aio.server()
+        handlers = {
+            "GenerateContent": grpc.unary_unary_rpc_method_handler(
+                self.generate, request_deserializer=glm.GenerateContentRequest.deserialize,
+                response_serializer=glm.GenerateContentResponse.serialize),
+            "StreamGenerateContent": grpc.unary_stream_rpc_method_handler(
+                self.stream, request_deserializer=glm.GenerateContentRequest.deserialize,
+                response_serializer=glm.GenerateContentResponse.serialize),
+        }
+        self.server.add_generic_rpc_handlers((grpc.method_handlers_generic_handler(GEMINI_SERVICE, handlers),))
+        port = self.server.add_insecure_port(f"{host}:0")
+        await self.server.start()
+        self.url = f"http://{host}:{port}"
+
+    async def stop(self):
+        if self.server:
+            await self.server.stop(0)
+
+    async def _begin(self, request, context):
+        prompt = "".join(p.text for c in request.contents for p in c.parts)
+        outcome, ttft, per_token = self.draw(prompt)
+        await asyncio.sleep(ttft)
+        if outcome == "throttled":
+            await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED,
+                                f"Resource has been exhausted. Please retry in {self.profile.retry_after:g}s")
+        if outcome == "error":
+            await context.abort(grpc.StatusCode.INTERNAL, "An internal error has occurred")
+        return prompt, per_token
+
+    @staticmethod
+    def _response(text: str, prompt: str = None):
+        resp = glm.GenerateContentResponse(candidates=[glm.Candidate(
+            content=glm.Content(parts=[glm.Part(text=text)], role="model"), index=0)])
+        if prompt is not None:
+            out = input_text(prompt)
+            resp.usage_metadata = glm.GenerateContentResponse.UsageMetadata(
+                prompt_token_count=approx_tokens(prompt), candidates_token_count=approx_tokens(out),
+                total_token_count=approx_tokens(prompt) + approx_tokens(out))
+        return resp
+
+    async def generate(self, request, context):
+        prompt, per_token = await self._begin(request, context)
+        out = input_text(prompt)
+        await asyncio.sleep(per_token * approx_tokens(out))
+        return self._response(out, prompt)
+
+    async def stream(self, request, context):
+        prompt, per_token = await self._begin(request, context)
+        words = _words(input_text(prompt))
+        for i, word in enumerate(words):
+            # usage فقط روی آخرین تکه، مثل API واقعی
+            yield self._response(word, prompt if i == len(words) - 1 else None)
+            await asyncio.sleep(per_token * approx_tokens(word))
+
+
+def _words(text: str, per_chunk: int = 8):
+    """Split into stream deltas of a few words, keeping the whitespace."""
+    parts = text.split(" ")
+    return [" ".join(parts[i:i + per_chunk]) + (" " if i + per_chunk < len(parts) else "")
+            for i in range(0, len(parts), per_chunk)] or [""]
+
+
+class FakeTelegram:
+    """Bot API at `/bot<token>/<method>`; records every message the bot sends or edits.
+
+    `on_text(chat_id, text, when)` is called for sendMessage and editMessageText.
+    """
+    def __init__(self, latency: float = 0.0, on_text=None):
+        self.latency = latency
+        self.on_text = on_text
+        self.counts = {}
+        self.runner = None
+        self.url = None
+        self._message_id = 0
+
+    async def start(self, host: str = "127.0.0.1"):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, 0)
+        await site.start()
+        self.url = f"http://{host}:{site._server.sockets[0].getsockname()[1]}"
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    def _message(self, chat_id, text, message_id=None):
+        if message_id is None:
+            self._message_id += 1
+            message_id = self._message_id
+        return {"message_id": message_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": text,
+                "from": {"id": 42, "is_bot": True, "first_name": "load"}}
+
+    async def handle(self, request):
+        method = request.match_info["method"].lower()
+        self.counts[method] = self.counts.get(method, 0) + 1
+        data = await request.post()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method == "getme":
+            result = {"id": 42, "is_bot": True, "first_name": "load", "username": "load_bot"}
+        elif method in ("sendmessage", "editmessagetext"):
+            chat_id = int(data["chat_id"])
+            if self.on_text:
+                self.on_text(chat_id, data.get("text", ""), time.perf_counter())
+            mid = int(data["message_id"]) if data.get("message_id") else None
+            result = self._message(chat_id, data.get("text", ""), mid)
+        elif method == "getchatmember":
+            result = {"status": "member",
+                      "user": {"id": int(data["user_id"]), "is_bot": False, "first_name": "user"}}
+        elif method == "getuserprofilephotos":
+            result = {"total_count": 0, "photos": []}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
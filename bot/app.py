@@ -0,0 +1,162 @@
+"""Setup shared by the entry points: `bot.main` (all in one process),
+`bot.ingress` (Telegram only) and `bot.worker` (queue consumers only)."""
+import os
+import time
+import signal
+import asyncio
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.enums import ParseMode
+from aiogram.types import BotCommand
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from .storage import db, describe as describe_storage
+from .database_async import open_pool, close_pool
+from .utils.client_registry import close_clients
+from .utils.settings_manager import SETTINGS
+from .utils.result_cache import RESULT_CACHE
+from .utils.profile_photos import PROFILE_PHOTOS
+from .utils.metrics import TELEGRAM_REQUEST, start_metrics_server, stop_metrics_server
+
+# polling (پیش‌فرض) یا webhook؛ در حالت webhook چند instance پشت load balancer می‌توانند update بگیرند
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")   # https://my-bot.onrender.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+# سرور Bot API محلی (یا سرور جعلی bench/bench_load.py)؛ خالی یعنی api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+TELEGRAM_API_LOCAL = os.getenv("TELEGRAM_API_LOCAL", "0").lower() in {"1", "true", "yes"}
+
+def create_bot() -> Bot:
+    token = os.getenv("BOT_TOKEN")
+    if not token:
+        raise RuntimeError("BOT_TOKEN not set")
+    session = None
+    if TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL, is_local=TELEGRAM_API_LOCAL))
+    bot = Bot(
+        token=token,
+        session=session,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    )
+    bot.session.middleware(_time_telegram_request)
+    return bot
+
+async def _time_telegram_request(make_request, bot, method):
+    # زمان هر فراخوانی Bot API برای /metrics (getUpdates همان long poll است)
+    t0 = time.perf_counter()
+    outcome = "cancelled"
+    try:
+        result = await make_request(bot, method)
+        outcome = "ok"
+        return result
+    except Exception as e:
+        outcome = type(e).__name__
+        raise
+    finally:
+        TELEGRAM_REQUEST.observe(time.perf_counter() - t0, type(method).__name__, outcome)
+
+def create_dispatcher(logger) -> Dispatcher:
+    # import اینجا تا worker بدون بارگذاری handlerها بالا بیاید
+    from .handlers import start as h_start
+    from .handlers import commands as h_commands
+    from .handlers import process as h_process
+    from .handlers import admin as h_admin
+    from .handlers import membership as h_membership
+
+    dp = Dispatcher(storage=MemoryStorage())
+
+    # Register routers instead of handlers
+    dp.include_router(h_start.router)     # changed: these must now be routers
+    dp.include_router(h_commands.router)
+    dp.include_router(h_admin.router)
+    dp.include_router(h_membership.router)
+    h_process.set_logger(logger)
+    dp.include_router(h_process.router)
+    return dp
+
+async def set_commands(bot: Bot):
+    commands = [
+        BotCommand(command="instructions", description="تنظیم دستورالعمل ویراستاری"),
+        BotCommand(command="openai", description="فقط از هوش مصنوعی OpenAI (Chat GPT) استفاده کن"),
+        BotCommand(command="gemini", description="فقط از هوش مصنوعی گوگل (Gemini) استفاده کن"),
+        BotCommand(command="help", description="توضیحات کار با بات"),
+    ]
+    await bot.set_my_commands(commands)
+
+def create_webhook_app(dp: Dispatcher, bot: Bot, secret: str = None, path: str = WEBHOOK_PATH) -> web.Application:
+    """aiohttp app that feeds POSTed updates to `dp`.
+
+    Telegram gets its 200 as soon as the secret is checked; the update is
+    handled in a background task.
+    """
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp, bot=bot, secret_token=secret, handle_in_background=True,
+    ).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+async def wait_for_signal():
+    """Return on SIGINT / SIGTERM; the one shutdown trigger of every entry point."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # ویندوز: Ctrl+C به صورت KeyboardInterrupt می‌رسد
+            pass
+    await stop.wait()
+
+async def run_webhook(dp: Dispatcher, bot: Bot, logger):
+    if not WEBHOOK_BASE_URL or not WEBHOOK_SECRET:
+        raise RuntimeError("BOT_MODE=webhook needs WEBHOOK_BASE_URL and WEBHOOK_SECRET")
+    runner = web.AppRunner(create_webhook_app(dp, bot, WEBHOOK_SECRET))
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    await bot.set_webhook(
+        WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+    )
+    logger.info(f"Webhook server on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        await wait_for_signal()
+    finally:
+        # webhook پاک نمی‌شود تا instanceهای دیگر همچنان update بگیرند
+        await runner.cleanup()
+
+async def run_updates(dp: Dispatcher, bot: Bot, logger):
+    """Receive updates until stopped, by polling or webhook depending on BOT_MODE."""
+    if BOT_MODE == "webhook":
+        await run_webhook(dp, bot, logger)
+    else:
+        await bot.delete_webhook(drop_pending_updates=True)
+        await dp.start_polling(bot)
+
+async def open_resources(logger):
+    logger.info(f"Storage: {describe_storage()}")
+    open_pool()
+    db.init_db()
+    await SETTINGS.load()
+    SETTINGS.start(logger)
+    PROFILE_PHOTOS.logger = logger
+    await start_metrics_server()
+
+async def close_resources():
+    await stop_metrics_server()
+    await SETTINGS.stop()
+    await PROFILE_PHOTOS.stop()
+    await close_clients()
+    close_pool()
+    RESULT_CACHE.close()
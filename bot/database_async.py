@@ -0,0 +1,124 @@
+"""Awaitable versions of the functions of the storage backend (`bot/storage.py`).
+
+Each call runs on a dedicated thread pool sized like the connection pool,
+so handlers and QueueManager never block the event loop on the database.
+SQLite writes go straight to that backend's single writer thread instead.
+User profiles are served from `USER_CACHE` and kept in sync by the setters.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from .storage import db
+from .utils.user_cache import USER_CACHE, UserProfile
+from .utils.metrics import DB_QUERY
+
+_executor = None
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=db.DB_POOL_MAX, thread_name_prefix="db")
+    return _executor
+
+async def _run(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # زمان کل: انتظار برای thread و connection + خود query
+    executor = getattr(fn, "executor", None) or _get_executor()
+    with DB_QUERY.time(fn.__name__):
+        return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+def open_pool():
+    db.init_pool()
+
+def close_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    db.close_pool()
+
+
+async def upsert_user(telegram_id: int, full_name: str, username: str, profile_pic_path: str):
+    created = await _run(db.upsert_user, telegram_id, full_name, username, profile_pic_path)
+    if created:
+        USER_CACHE.put(UserProfile(telegram_id, full_name, username, "fa", None, None))
+    return created
+
+async def get_user_by_tid(telegram_id: int):
+    profile = USER_CACHE.get(telegram_id)
+    if profile is None:
+        row = await _run(db.get_user_by_tid, telegram_id)
+        if row is None:
+            return None
+        profile = UserProfile.from_row(row)
+        USER_CACHE.put(profile)
+    return profile
+
+async def get_profile_pic_uid(telegram_id: int):
+    return await _run(db.get_profile_pic_uid, telegram_id)
+
+async def set_profile_pic_uid(telegram_id: int, uid: str):
+    return await _run(db.set_profile_pic_uid, telegram_id, uid)
+
+async def set_user_instruction(telegram_id: int, instructions: str):
+    await _run(db.set_user_instruction, telegram_id, instructions)
+    USER_CACHE.patch(telegram_id, instructions=instructions)
+
+async def set_user_language(telegram_id: int, lang: str):
+    await _run(db.set_user_language, telegram_id, lang)
+    USER_CACHE.patch(telegram_id, preferred_language=lang)
+
+async def set_user_provider(telegram_id: int, provider: str):
+    await _run(db.set_user_provider, telegram_id, provider)
+    USER_CACHE.patch(telegram_id, preferred_provider=provider)
+
+async def get_user_provider(telegram_id: int):
+    return await _run(db.get_user_provider, telegram_id)
+
+async def get_setting(key: str, default: str = None):
+    return await _run(db.get_setting, key, default)
+
+async def get_all_settings():
+    return await _run(db.get_all_settings)
+
+async def set_setting(key: str, value: str):
+    return await _run(db.set_setting, key, value)
+
+async def enqueue_job(telegram_id: int, provider: str, chat_id: int = None, text: str = None, instruction: str = None,
+                      lane: int = 0, cost: float = 1, est_tokens_in: int = None, est_tokens_out: int = None,
+                      chunk_tokens: int = None, t_enqueue: float = None):
+    return await _run(db.enqueue_job, telegram_id, provider, chat_id, text, instruction, lane, cost,
+                      est_tokens_in, est_tokens_out, chunk_tokens, t_enqueue)
+
+async def claim_job(worker_id: str, lease_seconds: int, providers=None):
+    return await _run(db.claim_job, worker_id, lease_seconds, providers)
+
+async def heartbeat_jobs(worker_id: str, lease_seconds: int, job_ids):
+    return await _run(db.heartbeat_jobs, worker_id, lease_seconds, list(job_ids))
+
+async def reclaim_expired_jobs(max_attempts: int):
+    return await _run(db.reclaim_expired_jobs, max_attempts)
+
+async def queue_position(job_id: int):
+    return await _run(db.queue_position, job_id)
+
+async def update_job(job_id: int, **fields):
+    return await _run(db.update_job, job_id, **fields)
+
+async def update_jobs(updates):
+    return await _run(db.update_jobs, updates)
+
+async def rate_limit_hit(key: str, interval: float, burst: int):
+    return await _run(db.rate_limit_hit, key, interval, burst)
+
+async def prune_rate_limits():
+    return await _run(db.prune_rate_limits)
+
+async def queue_depth():
+    return await _run(db.queue_depth)
+
+async def job_latency(since: float, model: str = None):
+    return await _run(db.job_latency, since, model)
+
+async def stats_counts():
+    return await _run(db.stats_counts)
@@ -1,4 +1,7 @@
-import sqlite3, os
+import sqlite3, os, time, threading, functools
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from .utils.job_timing import TIMESTAMP_COLUMNS, summarize
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 
@@ -17,13 +20,87 @@ def _resolve_sqlite_path(db_url: str) -> str:
 
 DB_URL = os.getenv("DB_URL", "sqlite:///data/users.db")
 DB_PATH = _resolve_sqlite_path(DB_URL)
+# threadهای خواندن در database_async، هر کدام با یک اتصال ماندگار؛ نوشتن‌ها روی یک thread جدا
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "4"))
+SQLITE_MMAP_MB = int(os.getenv("SQLITE_MMAP_MB", "256"))
+SQLITE_CACHE_MB = int(os.getenv("SQLITE_CACHE_MB", "16"))
+# ingress و workerها در processهای جدا روی همین فایل می‌نویسند
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "5"))
 
-def get_conn():
-    conn = sqlite3.connect(DB_PATH, isolation_level=None)
+_local = threading.local()
+_conns = []
+_conns_lock = threading.Lock()
+_generation = 0
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH, isolation_level=None, timeout=SQLITE_BUSY_TIMEOUT,
+                           check_same_thread=False, cached_statements=256)
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA journal_mode=WAL")
+    # در WAL، NORMAL فقط موقع checkpoint fsync می‌کند: قطع برق شاید آخرین commitها را ببرد، اما فایل سالم می‌ماند
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_MB * 1024 * 1024}")
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_MB * 1024}")
+    conn.execute("PRAGMA temp_store=MEMORY")
     return conn
 
+def get_conn():
+    """This thread's connection, opened once and kept.
+
+    sqlite3 caches compiled statements per connection (`cached_statements`),
+    so every query below is prepared once per thread, not once per call.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.generation != _generation:
+        conn = _connect()
+        _local.conn, _local.generation = conn, _generation
+        with _conns_lock:
+            _conns.append(conn)
+    return conn
+
+def _mark_writer():
+    _local.writer = True
+
+# همه‌ی نوشتن‌ها از یک thread و یک اتصال: بین threadهای خود bot هیچوقت SQLITE_BUSY نمی‌گیریم
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer", initializer=_mark_writer)
+
+def _writes(fn):
+    """Run `fn` on the writer thread; database_async submits it there directly via `.executor`."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if getattr(_local, "writer", False):
+            return fn(*args, **kwargs)
+        return _writer.submit(fn, *args, **kwargs).result()
+    wrapper.executor = _writer
+    return wrapper
+
+@contextmanager
+def _immediate(conn):
+    # قفل نوشتن از اول تراکنش (برای processهای دیگر روی همین فایل)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+def init_pool(minconn: int = 1, maxconn: int = DB_POOL_MAX):
+    """Open the writer's connection up front; readers open theirs on first use."""
+    _writer.submit(get_conn).result()
+
+def close_pool():
+    def close_all():
+        global _generation
+        with _conns_lock:
+            for conn in _conns:
+                conn.close()
+            _conns.clear()
+            _generation += 1
+    # روی thread نویسنده، پس نوشتن در حال اجرا اول تمام می‌شود
+    _writer.submit(close_all).result()
+
 # def init_db():
 #     conn = get_conn()
 #     cur = conn.cursor()
@@ -67,20 +144,31 @@ def get_conn():
 #     conn.commit()
 #     conn.close()
 
+@_writes
 def init_db():
     conn = get_conn()
     cur = conn.cursor()
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='users_editorial'")
+    had_editorial = cur.fetchone() is not None
 
-    # --- tables ---
+    # --- tables (same shape as the Postgres schema) ---
     cur.execute("""
     CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         telegram_id INTEGER UNIQUE,
         full_name TEXT,
         username TEXT,
+        profile_pic TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        updated_at TEXT
+    )""")
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS users_editorial (
+        telegram_id INTEGER PRIMARY KEY REFERENCES users(telegram_id) ON DELETE CASCADE,
         preferred_language TEXT DEFAULT 'fa',
         instructions TEXT,
-        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        preferred_provider TEXT,
         updated_at TEXT
     )""")
 
@@ -101,22 +189,73 @@ def init_db():
         error_message TEXT,
         created_at TEXT DEFAULT CURRENT_TIMESTAMP,
         completed_at TEXT,
-        FOREIGN KEY(user_id) REFERENCES users(id)
+        FOREIGN KEY(user_id) REFERENCES users(telegram_id)
     )""")
 
-    # --- migration: add per-user provider if missing ---
+    # --- migration: per-user settings used to live on users; move them to users_editorial ---
+    user_cols = {row["name"] for row in cur.execute("PRAGMA table_info(users)").fetchall()}
+    if not had_editorial and "preferred_language" in user_cols:
+        cols = ", ".join(c if c in user_cols else "NULL"
+                         for c in ("preferred_language", "instructions", "preferred_provider", "updated_at"))
+        cur.execute(f"""
+            INSERT OR IGNORE INTO users_editorial(telegram_id, preferred_language, instructions,
+                                                  preferred_provider, updated_at)
+            SELECT telegram_id, {cols} FROM users WHERE telegram_id IS NOT NULL""")
+    if "profile_pic" not in user_cols:
+        cur.execute("ALTER TABLE users ADD COLUMN profile_pic TEXT")
+
+    # --- migration: jobs is the real queue (payload + lease) ---
+    for col in ("chat_id INTEGER", "text TEXT", "instruction TEXT", "attempts INTEGER DEFAULT 0",
+                "lease_owner TEXT", "lease_until TEXT"):
+        try:
+            cur.execute(f"ALTER TABLE jobs ADD COLUMN {col}")
+        except Exception:
+            pass
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_id ON jobs(status, id)")
+
+    # --- migration: fair scheduling (see utils/scheduler.py) ---
+    for col in ("lane INTEGER DEFAULT 0", "sched_key REAL DEFAULT 0"):
+        try:
+            cur.execute(f"ALTER TABLE jobs ADD COLUMN {col}")
+        except Exception:
+            pass
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_sched ON jobs(status, lane DESC, sched_key, id)")
+
+    # حالت rate limiter مشترک (utils/rate_limiter.py)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS rate_limits (
+        key TEXT PRIMARY KEY,
+        tat REAL NOT NULL
+    )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_rate_limits_tat ON rate_limits(tat)")
+
+    # file_unique_id آخرین عکس پروفایل آپلودشده (utils/profile_photos.py)
     try:
-        cur.execute("ALTER TABLE users ADD COLUMN preferred_provider TEXT")
+        cur.execute("ALTER TABLE users ADD COLUMN profile_pic_uid TEXT")
     except Exception:
-        # ستون از قبل وجود دارد؛ ایرادی نیست
         pass
 
+    # --- migration: token estimate vs. actual usage (utils/token_estimator.py) ---
+    for col in ("est_tokens_in INTEGER", "est_tokens_out INTEGER", "chunk_tokens INTEGER",
+                "tokens_in INTEGER", "tokens_out INTEGER"):
+        try:
+            cur.execute(f"ALTER TABLE jobs ADD COLUMN {col}")
+        except Exception:
+            pass
+
+    # --- migration: per-stage timestamps (utils/job_timing.py) ---
+    for col in [f"{c} REAL" for c in TIMESTAMP_COLUMNS] + ["model TEXT", "key_index INTEGER"]:
+        try:
+            cur.execute(f"ALTER TABLE jobs ADD COLUMN {col}")
+        except Exception:
+            pass
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_t_enqueue ON jobs(t_enqueue)")
+
     # --- seed settings from env (only if not already present) ---
-    import os as _os
     def seed(k, envk, default):
         cur.execute(
             "INSERT OR IGNORE INTO settings(key, value) VALUES(?, ?)",
-            (k, _os.getenv(envk, default)),
+            (k, os.getenv(envk, default)),
         )
 
     seed("rate_limit_seconds", "RATE_LIMIT_SECONDS", "30")
@@ -124,115 +263,207 @@ def init_db():
     seed("allowed_languages", "ALLOWED_LANGUAGES", "fa,en,ar")
     seed("default_provider", "DEFAULT_PROVIDER", "openai")
 
-    conn.commit()
-    conn.close()
 
-
-def upsert_user(telegram_id: int, full_name: str, username: str):
+@_writes
+def upsert_user(telegram_id: int, full_name: str, username: str, profile_pic_path: str) -> bool:
+    """Returns True when a new user row was created."""
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM users WHERE telegram_id=?", (telegram_id,))
-    row = cur.fetchone()
-    if row:
-        cur.execute("UPDATE users SET full_name=?, username=?, updated_at=CURRENT_TIMESTAMP WHERE telegram_id=?",
-                    (full_name, username, telegram_id))
-    else:
-        cur.execute("INSERT INTO users(telegram_id, full_name, username) VALUES(?,?,?)",
-                    (telegram_id, full_name, username))
-    conn.commit()
-    conn.close()
+    with _immediate(conn):
+        cur = conn.execute("INSERT OR IGNORE INTO users(telegram_id, full_name, username, profile_pic) "
+                           "VALUES(?, ?, ?, ?)", (telegram_id, full_name, username, profile_pic_path))
+        created = cur.rowcount == 1
+        conn.execute("INSERT OR IGNORE INTO users_editorial(telegram_id) VALUES(?)", (telegram_id,))
+    return created
+
+def get_profile_pic_uid(telegram_id: int):
+    row = get_conn().execute("SELECT profile_pic_uid FROM users WHERE telegram_id=?", (telegram_id,)).fetchone()
+    return row["profile_pic_uid"] if row else None
+
+@_writes
+def set_profile_pic_uid(telegram_id: int, uid: str):
+    get_conn().execute("UPDATE users SET profile_pic_uid=? WHERE telegram_id=?", (uid, telegram_id))
 
 def get_user_by_tid(telegram_id: int):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE telegram_id=?", (telegram_id,))
-    row = cur.fetchone()
-    conn.close()
-    return row
+    # ستون‌ها صریح: در دیتابیس‌های قدیمی users هم ستون preferred_language و ... دارد
+    return get_conn().execute("""
+        SELECT u.id, u.telegram_id, u.full_name, u.username, u.profile_pic, u.profile_pic_uid,
+               u.created_at, u.updated_at, ue.preferred_language, ue.instructions, ue.preferred_provider
+        FROM users u
+        LEFT JOIN users_editorial ue ON u.telegram_id = ue.telegram_id
+        WHERE u.telegram_id=?""", (telegram_id,)).fetchone()
 
+def _set_editorial(telegram_id: int, column: str, value):
+    get_conn().execute(f"""
+        INSERT INTO users_editorial(telegram_id, {column}, updated_at) VALUES(?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(telegram_id) DO UPDATE SET {column}=excluded.{column}, updated_at=CURRENT_TIMESTAMP
+    """, (telegram_id, value))
+
+@_writes
 def set_user_instruction(telegram_id: int, instructions: str):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("UPDATE users SET instructions=?, updated_at=CURRENT_TIMESTAMP WHERE telegram_id=?",
-                (instructions, telegram_id))
-    conn.commit()
-    conn.close()
+    _set_editorial(telegram_id, "instructions", instructions)
 
+@_writes
 def set_user_language(telegram_id: int, lang: str):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("UPDATE users SET preferred_language=?, updated_at=CURRENT_TIMESTAMP WHERE telegram_id=?",
-                (lang, telegram_id))
-    conn.commit()
-    conn.close()
+    _set_editorial(telegram_id, "preferred_language", lang)
+
+@_writes
+def set_user_provider(telegram_id: int, provider: str):
+    _set_editorial(telegram_id, "preferred_provider", provider)
+
+def get_user_provider(telegram_id: int):
+    row = get_conn().execute("SELECT preferred_provider FROM users_editorial WHERE telegram_id=?",
+                             (telegram_id,)).fetchone()
+    return row["preferred_provider"] if row and row["preferred_provider"] else None
 
 def get_setting(key: str, default: str = None):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT value FROM settings WHERE key=?", (key,))
-    row = cur.fetchone()
-    conn.close()
+    row = get_conn().execute("SELECT value FROM settings WHERE key=?", (key,)).fetchone()
     if row and row["value"] is not None:
         return row["value"]
     return default
 
+def get_all_settings() -> dict:
+    return {row["key"]: row["value"] for row in get_conn().execute("SELECT key, value FROM settings")}
+
+@_writes
 def set_setting(key: str, value: str):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
+    get_conn().execute("""
         INSERT INTO settings(key, value) VALUES(?, ?)
         ON CONFLICT(key) DO UPDATE SET value=excluded.value
     """, (key, value))
-    conn.commit()
-    conn.close()
 
-def enqueue_job(user_id: int, provider: str):
+@_writes
+def enqueue_job(telegram_id: int, provider: str, chat_id: int = None, text: str = None, instruction: str = None,
+                lane: int = 0, cost: float = 1, est_tokens_in: int = None, est_tokens_out: int = None,
+                chunk_tokens: int = None, t_enqueue: float = None):
+    cur = get_conn().execute("""
+        INSERT INTO jobs(user_id, status, provider, chat_id, text, instruction,
+                         est_tokens_in, est_tokens_out, chunk_tokens, t_enqueue, lane, sched_key)
+        VALUES(?, 'pending', ?, ?, ?, ?, ?, ?, ?, ?, ?, MAX(
+            COALESCE((SELECT MIN(sched_key) FROM jobs WHERE status='pending' AND lane=?), 0),
+            COALESCE((SELECT MAX(sched_key) FROM jobs WHERE status='pending' AND lane=? AND user_id=?), 0)
+        ) + ?)""", (telegram_id, provider, chat_id, text, instruction, est_tokens_in, est_tokens_out, chunk_tokens,
+                   t_enqueue, lane, lane, lane, telegram_id, cost))
+    return cur.lastrowid
+
+@_writes
+def claim_job(worker_id: str, lease_seconds: int, providers=None):
+    # معادل FOR UPDATE SKIP LOCKED: قفل نوشتن با BEGIN IMMEDIATE، پس فقط یک worker برنده می‌شود
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("INSERT INTO jobs(user_id, status, provider) VALUES(?, 'pending', ?)", (user_id, provider))
-    job_id = cur.lastrowid
-    conn.commit()
-    conn.close()
-    return job_id
+    with _immediate(conn):
+        if providers:
+            marks = ",".join("?" * len(providers))
+            row = conn.execute(f"SELECT id FROM jobs WHERE status='pending' AND provider IN ({marks}) "
+                               "ORDER BY lane DESC, sched_key, id LIMIT 1", tuple(providers)).fetchone()
+        else:
+            row = conn.execute("SELECT id FROM jobs WHERE status='pending' "
+                               "ORDER BY lane DESC, sched_key, id LIMIT 1").fetchone()
+        if row is None:
+            return None
+        return conn.execute("""
+            UPDATE jobs SET status='processing', lease_owner=?, lease_until=datetime('now', ?),
+                            attempts=COALESCE(attempts, 0) + 1
+            WHERE id=?
+            RETURNING id, user_id, chat_id, text, instruction, provider, attempts, chunk_tokens,
+                      (julianday('now') - julianday(created_at)) * 86400 AS waited""",
+            (worker_id, f"+{int(lease_seconds)} seconds", row["id"])).fetchone()
 
-def update_job(job_id: int, **fields):
+@_writes
+def heartbeat_jobs(worker_id: str, lease_seconds: int, job_ids) -> int:
+    job_ids = list(job_ids)
+    if not job_ids:
+        return 0
+    cur = get_conn().execute("UPDATE jobs SET lease_until=datetime('now', ?) "
+                             f"WHERE status='processing' AND lease_owner=? AND id IN ({','.join('?' * len(job_ids))})",
+                             (f"+{int(lease_seconds)} seconds", worker_id, *job_ids))
+    return cur.rowcount
+
+@_writes
+def reclaim_expired_jobs(max_attempts: int) -> int:
     conn = get_conn()
-    cur = conn.cursor()
+    with _immediate(conn):
+        conn.execute("""
+            UPDATE jobs SET status='error', error_message='lost: no payload', lease_owner=NULL, lease_until=NULL
+            WHERE status IN ('pending', 'processing') AND text IS NULL""")
+        conn.execute("""
+            UPDATE jobs SET status='error', error_message='lease expired too many times', lease_owner=NULL, lease_until=NULL
+            WHERE status='processing' AND lease_until < datetime('now') AND attempts >= ?""", (max_attempts,))
+        cur = conn.execute("""
+            UPDATE jobs SET status='pending', lease_owner=NULL, lease_until=NULL
+            WHERE status='processing' AND (lease_until IS NULL OR lease_until < datetime('now'))""")
+    return cur.rowcount
+
+def queue_position(job_id: int) -> int:
+    return get_conn().execute("""
+        SELECT COUNT(*) AS c FROM jobs j, jobs me
+        WHERE me.id=? AND me.status='pending' AND j.status='pending'
+          AND (j.lane > me.lane OR (j.lane = me.lane AND (j.sched_key < me.sched_key
+               OR (j.sched_key = me.sched_key AND j.id <= me.id))))""", (job_id,)).fetchone()["c"]
+
+def _job_update(job_id: int, fields: dict):
     sets, vals = [], []
     for k, v in fields.items():
         sets.append(f"{k}=?"); vals.append(v)
     if "status" in fields and fields["status"] == "done":
         sets.append("completed_at=CURRENT_TIMESTAMP")
-    query = f"UPDATE jobs SET {', '.join(sets)} WHERE id=?"
+        sets.append("text=NULL")
+    if "status" in fields and fields["status"] in ("done", "error"):
+        sets.append("lease_owner=NULL")
+        sets.append("lease_until=NULL")
     vals.append(job_id)
-    cur.execute(query, tuple(vals))
-    conn.commit()
-    conn.close()
+    return f"UPDATE jobs SET {', '.join(sets)} WHERE id=?", tuple(vals)
 
-def stats_counts():
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) AS c FROM users"); users = cur.fetchone()["c"]
-    cur.execute("SELECT COUNT(*) AS c FROM jobs"); jobs = cur.fetchone()["c"]
-    cur.execute("SELECT COUNT(*) AS c FROM jobs WHERE status='pending'"); pend = cur.fetchone()["c"]
-    cur.execute("SELECT COUNT(*) AS c FROM jobs WHERE status='processing'"); proc = cur.fetchone()["c"]
-    cur.execute("SELECT COUNT(*) AS c FROM jobs WHERE status='done'"); done = cur.fetchone()["c"]
-    cur.execute("SELECT COUNT(*) AS c FROM jobs WHERE status='error'"); err = cur.fetchone()["c"]
-    conn.close()
-    return {"users": users, "jobs": jobs, "pending": pend, "processing": proc, "done": done, "error": err}
+@_writes
+def update_job(job_id: int, **fields):
+    get_conn().execute(*_job_update(job_id, fields))
 
-def set_user_provider(telegram_id: int, provider: str):
+@_writes
+def update_jobs(updates):
+    """Apply [(job_id, fields), ...] in one transaction."""
+    groups = {}
+    for job_id, fields in updates:
+        query, params = _job_update(job_id, fields)
+        groups.setdefault(query, []).append(params)
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("UPDATE users SET preferred_provider=?, updated_at=CURRENT_TIMESTAMP WHERE telegram_id=?",
-                (provider, telegram_id))
-    conn.commit()
-    conn.close()
+    with _immediate(conn):
+        for query, rows in groups.items():
+            conn.executemany(query, rows)
 
-def get_user_provider(telegram_id: int):
+@_writes
+def rate_limit_hit(key: str, interval: float, burst: int) -> float:
+    now = time.time()
+    tolerance = interval * (burst - 1)
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT preferred_provider FROM users WHERE telegram_id=?", (telegram_id,))
-    row = cur.fetchone()
-    conn.close()
-    return row["preferred_provider"] if row and row["preferred_provider"] else None
+    with _immediate(conn):
+        row = conn.execute("SELECT tat FROM rate_limits WHERE key=?", (key,)).fetchone()
+        tat = max(row["tat"], now) if row else now
+        wait = tat - tolerance - now
+        if wait <= 0:
+            conn.execute("INSERT OR REPLACE INTO rate_limits(key, tat) VALUES(?, ?)", (key, tat + interval))
+    return max(0.0, wait)
+
+@_writes
+def prune_rate_limits() -> int:
+    return get_conn().execute("DELETE FROM rate_limits WHERE tat < ?", (time.time(),)).rowcount
+
+def queue_depth() -> dict:
+    rows = get_conn().execute("SELECT status, COUNT(*) AS c FROM jobs "
+                              "WHERE status IN ('pending', 'processing') GROUP BY status").fetchall()
+    return {row["status"]: row["c"] for row in rows}
+
+def job_latency(since: float, model: str = None) -> dict:
+    # SQLite تابع percentile ندارد: فقط ستون‌های زمان از روی idx_jobs_t_enqueue خوانده و در پایتون حساب می‌شود
+    cols = ", ".join(TIMESTAMP_COLUMNS)
+    if model:
+        rows = get_conn().execute(f"SELECT {cols} FROM jobs WHERE t_enqueue >= ? AND model = ?",
+                                  (since, model)).fetchall()
+    else:
+        rows = get_conn().execute(f"SELECT {cols} FROM jobs WHERE t_enqueue >= ?", (since,)).fetchall()
+    return summarize(rows)
+
+def stats_counts():
+    row = get_conn().execute("""
+        SELECT (SELECT COUNT(*) FROM users) AS users, COUNT(*) AS jobs,
+               COALESCE(SUM(status='pending'), 0) AS pending, COALESCE(SUM(status='processing'), 0) AS processing,
+               COALESCE(SUM(status='done'), 0) AS done, COALESCE(SUM(status='error'), 0) AS error
+        FROM jobs""").fetchone()
+    return dict(row)
@@ -1,8 +1,15 @@
 import os
+import time
 from aiogram import Router
 from aiogram.types import Message
-from ..database import get_setting, set_setting, stats_counts
+from ..database_async import stats_counts, job_latency
 from ..utils.key_manager import OPENAI_KEYS, GEMINI_KEYS
+from ..utils.client_registry import reload_clients
+from ..utils.settings_manager import SETTINGS, get_max_tokens
+from ..utils.user_cache import USER_CACHE
+from ..utils.channel_membership import MEMBERSHIP_CACHE
+from ..utils.result_cache import RESULT_CACHE
+from .process import queue_manager
 from aiogram.filters import Command
 
 router = Router()
@@ -16,11 +23,15 @@ def is_admin(user_id: int) -> bool:
 async def settings_cmd(message: Message):
     if not is_admin(message.from_user.id):
         return await message.answer("⛔ دسترسی مجاز نیست.")
+    # ادمین مقدار واقعی DB را می‌بیند و cache هم همزمان تازه می‌شود
+    await SETTINGS.load()
     info = [
-        f"rate_limit_seconds = {get_setting('rate_limit_seconds', '30')}",
-        f"max_words = {get_setting('max_words', '5000')}",
-        f"allowed_languages = {get_setting('allowed_languages', 'fa,en,ar')}",
-        f"default_provider = {get_setting('default_provider', 'openai')}",
+        f"rate_limit_seconds = {SETTINGS.get('rate_limit_seconds', '30')}",
+        f"max_words = {SETTINGS.get('max_words', '5000')}",
+        # سقف واقعی پذیرش متن؛ اگر تنظیم نشده از max_words حساب می‌شود
+        f"max_tokens = {SETTINGS.get('max_tokens') or f'{get_max_tokens()} (از max_words)'}",
+        f"allowed_languages = {SETTINGS.get('allowed_languages', 'fa,en,ar')}",
+        f"default_provider = {SETTINGS.get('default_provider', 'openai')}",
     ]
     await message.answer("⚙️ تنظیمات:\n" + "\n".join(info))
 
@@ -33,39 +44,82 @@ async def set_setting_cmd(message: Message):
         value = " ".join(val)
     except:
         return await message.answer("فرمت صحیح: /set_setting key value")
-    if key not in {"rate_limit_seconds", "max_words", "allowed_languages", "default_provider"}:
+    if key not in {"rate_limit_seconds", "max_words", "max_tokens", "allowed_languages", "default_provider"}:
         return await message.answer("⛔ این کلید قابل تغییر از بات نیست.")
-    set_setting(key, value)
+    await SETTINGS.set(key, value)
     await message.answer(f"✅ تنظیم «{key}» روی «{value}» ذخیره شد.")
 
 @router.message(Command("stats"))
 async def stats_cmd(message: Message):
     if not is_admin(message.from_user.id):
         return await message.answer("⛔ دسترسی مجاز نیست.")
-    s = stats_counts()
+    s = await stats_counts()
+    rc = await RESULT_CACHE.stats()
     await message.answer("📊 آمار:\n" +
                          f"• کاربران: {s['users']}\n" +
-                         f"• کل jobها: {s['jobs']} (pending: {s['pending']}, processing: {s['processing']}, done: {s['done']}, error: {s['error']})")
+                         f"• کل jobها: {s['jobs']} (pending: {s['pending']}, processing: {s['processing']}, done: {s['done']}, error: {s['error']})\n" +
+                         f"• کش نتایج: hit: {rc['hits']}, miss: {rc['misses']} ({rc['hit_rate']:.0%})")
 
 @router.message(Command("queue"))
 async def queue_cmd(message: Message):
     if not is_admin(message.from_user.id):
         return await message.answer("⛔ دسترسی مجاز نیست.")
-    s = stats_counts()
-    await message.answer(f"🧾 وضعیت صف (تقریبی بر اساس DB): pending = {s['pending']}, processing = {s['processing']}")
+    s = await stats_counts()
+    q = queue_manager.describe()
+    lanes = ", ".join(f"{p}: {used}/{limit}" + ("" if q["circuits"][p] == "closed" else f" ({q['circuits'][p]})")
+                      for p, (used, limit) in q["providers"].items())
+    await message.answer(f"🧾 وضعیت صف: pending = {s['pending']}, processing = {s['processing']}\n" +
+                         f"👷 ورکرها: {q['workers']} (هدف {q['target']}، بازه {q['min']}–{q['max']})، در حال اجرا: {q['in_flight']}\n" +
+                         f"⚙️ ظرفیت موتورها: {lanes}")
+
+def _fmt_seconds(v) -> str:
+    return "—" if v is None else (f"{v * 1000:.0f}ms" if v < 1 else f"{v:.1f}s")
+
+@router.message(Command("latency"))
+async def latency_cmd(message: Message):
+    if not is_admin(message.from_user.id):
+        return await message.answer("⛔ دسترسی مجاز نیست.")
+    parts = message.text.split()
+    try:
+        hours = float(parts[1]) if len(parts) > 1 else 24
+    except ValueError:
+        return await message.answer("فرمت: /latency [ساعت] [مدل]")
+    model = parts[2] if len(parts) > 2 else None
+    stages = await job_latency(time.time() - hours * 3600, model)
+    lines = [f"⏱ تأخیر مراحل در {hours:g} ساعت اخیر" + (f" ({model})" if model else "") + ":"]
+    for name, (n, p50, p95, p99) in stages.items():
+        lines.append(f"• {name}: n={n} — p50 {_fmt_seconds(p50)}، p95 {_fmt_seconds(p95)}، p99 {_fmt_seconds(p99)}")
+    await message.answer("\n".join(lines))
 
 @router.message(Command("force_provider"))
 async def force_provider_cmd(message: Message):
     parts = message.text.split()
     if len(parts) != 2 or parts[1] not in {"openai", "gemini"}:
         return await message.answer("فرمت: /force_provider openai|gemini")
-    set_setting("default_provider", parts[1])
+    await SETTINGS.set("default_provider", parts[1])
     await message.answer(f"✅ موتور پیش‌فرض روی «{parts[1]}» تنظیم شد.")
 
 @router.message(Command("reload_keys"))
 async def reload_keys_cmd(message: Message):
     if not is_admin(message.from_user.id):
         return await message.answer("⛔ دسترسی مجاز نیست.")
-    OPENAI_KEYS.refresh()
-    GEMINI_KEYS.refresh()
-    await message.answer(f"🔐 کلیدها — OpenAI: {OPENAI_KEYS.counts()} | Gemini: {GEMINI_KEYS.counts()}")
+    await reload_clients()
+    lines = [f"🔐 کلیدها — OpenAI: {OPENAI_KEYS.counts()} | Gemini: {GEMINI_KEYS.counts()}"]
+    for name, keys in (("OpenAI", OPENAI_KEYS), ("Gemini", GEMINI_KEYS)):
+        for k in keys.stats():
+            lines.append(
+                f"• {name} {k['key']}: در حال اجرا {k['in_flight']}، موفق {k['successes']}، "
+                f"429: {k['throttles']}، خطا {k['errors']}"
+                + (f"، استراحت {k['cooldown']:.0f}s" if k["cooldown"] > 0 else "")
+            )
+    await message.answer("\n".join(lines))
+
+@router.message(Command("cache_stats"))
+async def cache_stats_cmd(message: Message):
+    if not is_admin(message.from_user.id):
+        return await message.answer("⛔ دسترسی مجاز نیست.")
+    u = USER_CACHE.stats()
+    m = MEMBERSHIP_CACHE.stats()
+    await message.answer("🗂 کش:\n" +
+                         f"• پروفایل کاربران: {u['size']}/{u['max_size']} — hit: {u['hits']}, miss: {u['misses']} ({u['hit_rate']:.0%})\n" +
+                         f"• عضویت کانال: {m['size']}/{m['max_size']} — hit: {m['hits']}, miss: {m['misses']} ({m['hit_rate']:.0%})، رویداد chat_member: {m['updates']}")
@@ -3,7 +3,7 @@ from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, ReplyKey
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 
-from ..database import set_user_instruction, set_user_language, set_user_provider
+from ..database_async import set_user_instruction, set_user_language, set_user_provider
 from ..utils.settings_manager import get_allowed_languages
 from aiogram.filters import Command
 
@@ -21,7 +21,7 @@ async def instructions_cmd(message: Message, state: FSMContext):
 
 @router.message(Form.waiting_instruction, F.text)
 async def save_instruction(message: Message, state: FSMContext):
-    set_user_instruction(message.from_user.id, message.text.strip())
+    await set_user_instruction(message.from_user.id, message.text.strip())
     await message.answer("✅ دستورالعمل ذخیره شد.")
     await state.clear()
 
@@ -43,7 +43,7 @@ async def save_language(message: Message, state: FSMContext):
     if lang not in get_allowed_languages():
         await message.answer("⛔ زبان نامعتبر است. از دکمه‌ها انتخاب کن.")
         return
-    set_user_language(message.from_user.id, lang)
+    await set_user_language(message.from_user.id, lang)
     await message.answer(f"✅ زبان شما روی «{lang}» تنظیم شد.", reply_markup=ReplyKeyboardRemove())
     await state.clear()
 
@@ -51,10 +51,10 @@ async def save_language(message: Message, state: FSMContext):
 
 @router.message(Command("openai"))
 async def set_openai(message: Message):
-    set_user_provider(message.from_user.id, "openai")
+    await set_user_provider(message.from_user.id, "openai")
     await message.answer("✅ موتور پردازش شما روی «OpenAI» تنظیم شد. (فقط برای حساب شما)")
 
 @router.message(Command("gemini"))
 async def set_gemini(message: Message):
-    set_user_provider(message.from_user.id, "gemini")
+    await set_user_provider(message.from_user.id, "gemini")
     await message.answer("✅ موتور پردازش شما روی «Gemini» تنظیم شد. (فقط برای حساب شما)")
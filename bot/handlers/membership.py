@@ -0,0 +1,11 @@
+from aiogram import Router, F
+from aiogram.types import ChatMemberUpdated
+from ..utils.channel_membership import CHANNEL_USERNAME, MEMBERSHIP_CACHE, MEMBER_STATUSES
+
+# برای دریافت chat_member بات باید ادمین کانال باشد؛
+# start_polling با ثبت این handler خودش chat_member را به allowed_updates اضافه می‌کند.
+router = Router()
+
+@router.chat_member(F.chat.username == CHANNEL_USERNAME.lstrip("@"))
+async def on_channel_member(event: ChatMemberUpdated):
+    MEMBERSHIP_CACHE.on_update(event.new_chat_member.user.id, event.new_chat_member.status in MEMBER_STATUSES)
@@ -1,67 +1,90 @@
-import io, time
 from aiogram import Router, F
 from aiogram.types import Message, ContentType
 from ..utils.channel_membership import is_user_member, display_membership_banner
-from ..database import get_user_by_tid, enqueue_job, update_job
-from ..utils.settings_manager import get_rate_limit_seconds, get_max_words, get_default_provider
+from ..database_async import get_user_by_tid, queue_position
+from ..utils.settings_manager import get_rate_limit_seconds, get_max_words, get_max_tokens, get_default_provider
 from ..utils.language_detect import detect_language
-from ..utils.queue_manager import QueueManager, Job
+from ..utils.queue_manager import QueueManager
+from ..utils.scheduler import lane_for
+from ..utils.rate_limiter import RATE_LIMITER, TIER_ADMIN, TIER_NORMAL
+from ..utils.notification import ADMINS
+from ..utils.doc_reader import read_text_document, max_doc_bytes, DocumentTooLarge
+from ..utils.token_estimator import TOKENS_PER_WORD
 
 router = Router()
-rate_guard = {}
-queue_manager = QueueManager(workers=3)
+queue_manager = QueueManager()
 
 def set_logger(logger):
     queue_manager.set_logger(logger)
 
-async def notify_queue_position(bot, chat_id: int):
-    pos = queue_manager.queue.qsize()
-    await bot.send_message(chat_id, f"🧾 درخواست شما در صف قرار گرفت. جایگاه: {pos}")
+async def notify_queue_position(bot, chat_id: int, job_id: int, eta: float = None):
+    # جایگاه به ترتیب واقعی برداشتن؛ 0 یعنی همین حالا یک worker آن را برداشته است
+    pos = await queue_position(job_id)
+    eta_text = f"\n⏱ زمان تقریبی پردازش: {max(1, round(eta))} ثانیه" if eta else ""
+    if pos:
+        await bot.send_message(chat_id, f"🧾 درخواست شما در صف قرار گرفت. جایگاه: {pos}{eta_text}")
+    else:
+        await bot.send_message(chat_id, f"🧾 درخواست شما در حال پردازش است.{eta_text}")
 
-async def _process_text(bot, message: Message, text: str, logger):
+async def _admit(message: Message) -> bool:
+    """Membership and rate limit; answers the user and returns False when refused."""
     if not await is_user_member(message.from_user.id, message.bot):
         await display_membership_banner(message)
-        return
-    
-    user = get_user_by_tid(message.from_user.id)
+        return False
 
     # Rate limit
-    now = time.time()
     rl = get_rate_limit_seconds()
-    last = rate_guard.get(message.from_user.id, 0)
-    if now - last < rl:
-        wait = int(rl - (now - last))
-        return await message.answer(f"⏳ بین دو درخواست حداقل {rl} ثانیه فاصله بگذارید. (باقی‌مانده: {wait}s)")
-    rate_guard[message.from_user.id] = now
+    tier = TIER_ADMIN if message.from_user.id in ADMINS else TIER_NORMAL
+    wait = await RATE_LIMITER.check(message.from_user.id, rl, tier)
+    if wait > 0:
+        await message.answer(f"⏳ بین دو درخواست حداقل {rl} ثانیه فاصله بگذارید. (باقی‌مانده: {int(wait)}s)")
+        return False
+    return True
+
+async def _process_text(bot, message: Message, text: str, logger):
+    if not await _admit(message):
+        return
+    await _submit(bot, message, text, logger)
 
+async def _submit(bot, message: Message, text: str, logger):
     # Validate
     if not text or not text.strip():
         return await message.answer("⛔ متن خالی است.")
-    if len(text.split()) > get_max_words():
-        return await message.answer(f"⛔ متن طولانی است. حداکثر {get_max_words()} کلمه مجاز است.")
+
+    user = await get_user_by_tid(message.from_user.id)
 
     # # Language hint
     # detected = detect_language(text)
-    # if user and user["preferred_language"] and user["preferred_language"] != detected:
+    # if user and user.preferred_language and user.preferred_language != detected:
     #     await message.answer(
-    #         f"⚠️ زبان متن ({detected}) با تنظیم شما ({user['preferred_language']}) متفاوت است. "
+    #         f"⚠️ زبان متن ({detected}) با تنظیم شما ({user.preferred_language}) متفاوت است. "
     #         f"در صورت نیاز از /language استفاده کنید."
     #     )
 
     instruction = (
-        user["instructions"] if user and user["instructions"]
+        user.instructions if user and user.instructions
         else "اصلاح نگارشی و علائم، بدون تغییر محتوا یا لحن."
     )
     provider = (
-        user["preferred_provider"]
-        if user and "preferred_provider" in user and user["preferred_provider"]
+        user.preferred_provider
+        if user and user.preferred_provider
         else get_default_provider()
     )
 
-    job_id = enqueue_job(user["telegram_id"] if user else None, provider)
-    job = Job(job_id, user, text, instruction, provider, bot, message.chat.id, logger, update_job)
-    await queue_manager.enqueue(job)
-    await notify_queue_position(bot, message.chat.id)
+    # یک بار تخمین توکن: پذیرش، اندازه‌ی تکه‌ها، ETA و ثبت روی job
+    est = queue_manager.estimate(text, instruction)
+    max_tokens = get_max_tokens()
+    if est.prompt_tokens > max_tokens:
+        return await message.answer(
+            f"⛔ متن طولانی است: حدود {est.prompt_tokens} توکن، حداکثر {max_tokens} توکن "
+            f"(تقریباً {int(max_tokens / TOKENS_PER_WORD)} کلمه) مجاز است."
+        )
+
+    job_id = await queue_manager.enqueue(
+        user.telegram_id if user else None, message.chat.id, text, instruction, provider,
+        lane=lane_for(message.from_user.id, ADMINS), est=est,
+    )
+    await notify_queue_position(bot, message.chat.id, job_id, est.eta_seconds)
 
 # راهنما
 @router.message(F.text == "/send_text")
@@ -71,14 +94,17 @@ async def send_text_cmd(message: Message):
 # فقط فایل‌های .txt
 @router.message(F.document.file_name.endswith(".txt"))
 async def handle_doc(message: Message):
-    buffer = io.BytesIO()
-    await message.bot.download(
-        message.document.file_id,
-        destination=buffer
-    )
-    buffer.seek(0)
-    text = buffer.read().decode("utf-8", errors="ignore")
-    await _process_text(message.bot, message, text, queue_manager.logger)
+    if not await _admit(message):
+        return
+    # قبل از دانلود: حجم فایل، و حین دانلود: تعداد کلمات
+    max_words = get_max_words()
+    if message.document.file_size and message.document.file_size > max_doc_bytes(max_words):
+        return await message.answer(f"⛔ فایل بزرگ است. حداکثر {max_words} کلمه مجاز است.")
+    try:
+        text, _ = await read_text_document(message.bot, message.document.file_id, max_words)
+    except DocumentTooLarge:
+        return await message.answer(f"⛔ متن طولانی است. حداکثر {max_words} کلمه مجاز است.")
+    await _submit(message.bot, message, text, queue_manager.logger)
 
 # فقط متن‌های معمولی
 @router.message(F.content_type == ContentType.TEXT, ~F.text.startswith("/"))
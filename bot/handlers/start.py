@@ -1,10 +1,9 @@
 # start.py
-import os
 from aiogram import Router
 from aiogram.filters import Command
 from aiogram.types import Message
-from bot.utils.upload_to_supabase_s3 import upload_file_to_s3
-from ..database import upsert_user
+from ..database_async import upsert_user
+from ..utils.profile_photos import PROFILE_PHOTOS
 from ..utils.settings_manager import (
     get_max_words,
     get_rate_limit_seconds,
@@ -13,9 +12,6 @@ from ..utils.settings_manager import (
 
 router = Router()
 
-ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
-PROFILE_PICS_PATH = os.path.join(ROOT_DIR, "static/profile_pics")
-
 
 def _langs_str():
     try:
@@ -31,29 +27,17 @@ def _langs_str():
 
 @router.message(Command("start"))
 async def cmd_start(message: Message):
-    # دریافت و آپلود عکس پروفایل (اختیاری)
-    try:
-        photos = await message.bot.get_user_profile_photos(message.from_user.id)
-        if photos.total_count > 0:
-            file = await message.bot.get_file(photos.photos[0][-1].file_id)
-            os.makedirs(PROFILE_PICS_PATH, exist_ok=True)
-            local_path = f"{PROFILE_PICS_PATH}/{message.from_user.id}.jpg"
-            remote_key = f"profile_pics/{message.from_user.id}.jpg"
-
-            await message.bot.download_file(file.file_path, local_path)
-            upload_file_to_s3(local_path, remote_key)
-            os.remove(local_path)
-    except Exception as e:
-        print(f"⚠️ Failed to fetch profile picture: {e}")
-
     # ثبت/به‌روزرسانی کاربر
-    upsert_user(
+    await upsert_user(
         message.from_user.id,
         message.from_user.full_name,
         message.from_user.username or "",
         f"{message.from_user.id}.jpg",
     )
 
+    # عکس پروفایل در پس‌زمینه به S3 می‌رود (اختیاری؛ اگر عوض نشده باشد کاری نمی‌کند)
+    PROFILE_PHOTOS.schedule(message.bot, message.from_user.id)
+
     # پیام خوش‌آمد (متن فعلیِ خودت حفظ شده)
     await message.answer(
         (
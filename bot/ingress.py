@@ -0,0 +1,29 @@
+"""Telegram ingress only: polling or webhook + handlers, jobs are written to the DB.
+
+Run one of these together with one or more `python -m bot.worker`.
+"""
+import asyncio
+from dotenv import load_dotenv
+
+from .app import create_bot, create_dispatcher, set_commands, open_resources, close_resources, run_updates
+from .utils.logger_util import setup_logger
+
+async def main():
+    load_dotenv()
+    logger = setup_logger()
+    await open_resources(logger)
+
+    bot = create_bot()
+    dp = create_dispatcher(logger)
+
+    await set_commands(bot)
+    logger.info("Ingress is up (no local workers).")
+
+    try:
+        await run_updates(dp, bot, logger)
+    finally:
+        await close_resources()
+        logger.info("Bye.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
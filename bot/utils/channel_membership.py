@@ -1,26 +1,98 @@
 from aiogram.enums import ChatMemberStatus
 from aiogram.types import Message
 from dotenv import load_dotenv
+from collections import OrderedDict
 import os
+import time
 
 load_dotenv()
 CHANNEL_USERNAME = "@majaleh20_30"  # Replace with your actual channel
 ADMIN_IDs = os.getenv("ADMIN_IDs")
 ADMINS = [int(item.strip()) for item in ADMIN_IDs.split(",") if item.strip()]
 
+# عضو بودن را بیشتر نگه می‌داریم؛ عضو نبودن کوتاه، تا بعد از join زود باز شود
+MEMBERSHIP_TTL = int(os.getenv("MEMBERSHIP_TTL", "900"))
+MEMBERSHIP_NEGATIVE_TTL = int(os.getenv("MEMBERSHIP_NEGATIVE_TTL", "30"))
+MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", "20000"))
+
+MEMBER_STATUSES = {
+    ChatMemberStatus.MEMBER,
+    ChatMemberStatus.ADMINISTRATOR
+}
+
+class MembershipCache:
+    """Bounded LRU of user_id -> is member, with separate TTLs for yes and no.
+
+    Entries are also overwritten by `chat_member` updates from the channel
+    (see handlers/membership.py), so a join or leave shows up right away.
+    """
+    def __init__(self, size: int, ttl: int, negative_ttl: int):
+        self.size = size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._data = OrderedDict()   # user_id -> (expires_at, is_member)
+        self.hits = 0
+        self.misses = 0
+        self.updates = 0
+
+    def get(self, user_id: int):
+        item = self._data.get(user_id)
+        if item is None or item[0] < time.time():
+            if item is not None:
+                del self._data[user_id]
+            self.misses += 1
+            return None
+        self._data.move_to_end(user_id)
+        self.hits += 1
+        return item[1]
+
+    def put(self, user_id: int, is_member: bool):
+        if self.size <= 0:
+            return
+        ttl = self.ttl if is_member else self.negative_ttl
+        self._data[user_id] = (time.time() + ttl, is_member)
+        self._data.move_to_end(user_id)
+        while len(self._data) > self.size:
+            self._data.popitem(last=False)
+
+    def on_update(self, user_id: int, is_member: bool):
+        # رویداد join/leave از خود کانال؛ از هر TTL معتبرتر است
+        self.updates += 1
+        self.put(user_id, is_member)
+
+    def invalidate(self, user_id: int):
+        self._data.pop(user_id, None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "updates": self.updates,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+MEMBERSHIP_CACHE = MembershipCache(MEMBERSHIP_CACHE_SIZE, MEMBERSHIP_TTL, MEMBERSHIP_NEGATIVE_TTL)
+
 async def is_user_member(user_id: int, bot) -> bool:
     if user_id in ADMINS:
         return True
 
+    cached = MEMBERSHIP_CACHE.get(user_id)
+    if cached is not None:
+        return cached
+
     try:
         member = await bot.get_chat_member(chat_id=CHANNEL_USERNAME, user_id=user_id)
-        return member.status in {
-            ChatMemberStatus.MEMBER,
-            ChatMemberStatus.ADMINISTRATOR
-        }
     except Exception as e:
+        # خطا cache نمی‌شود؛ دفعه‌ی بعد دوباره می‌پرسیم
         print(f"[ERROR] get_chat_member failed: {e}")
         return False
+    is_member = member.status in MEMBER_STATUSES
+    MEMBERSHIP_CACHE.put(user_id, is_member)
+    return is_member
     
 async def display_membership_banner(message: Message):
     join_link = f"https://t.me/{CHANNEL_USERNAME.lstrip('@')}"
@@ -0,0 +1,80 @@
+import os
+import re
+from .token_estimator import count_tokens
+
+# بودجه‌ی تقریبی توکن برای هر تکه از متن‌های بلند
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "1500"))
+# حداکثر طول هر پیام تلگرام (سقف واقعی 4096)
+TELEGRAM_MESSAGE_LIMIT = 4000
+
+_PARAGRAPH_SPLIT = re.compile(r"(\n\s*\n)")
+_SENTENCE_SPLIT = re.compile(r"((?<=[.!?؟…])\s+)")
+_WORD_SPLIT = re.compile(r"(\s+)")
+
+def estimate_tokens(text: str) -> int:
+    # tiktoken اگر نصب باشد، وگرنه نسبت کاراکتر به توکن جدا برای فارسی و لاتین
+    return max(1, count_tokens(text))
+
+def _pairs(parts):
+    # re.split با گروه → [متن، جداکننده، متن، ...] ⇒ [(متن، جداکننده‌ی بعدی)]
+    parts = parts + [""] if len(parts) % 2 else parts
+    return [(parts[i], parts[i + 1]) for i in range(0, len(parts), 2) if parts[i]]
+
+def _units(text: str, max_tokens: int):
+    """Paragraphs, falling back to sentences and then words for oversized ones."""
+    for para, psep in _pairs(_PARAGRAPH_SPLIT.split(text)):
+        if estimate_tokens(para) <= max_tokens:
+            yield para, psep
+            continue
+        sentences = _pairs(_SENTENCE_SPLIT.split(para))
+        for si, (sent, ssep) in enumerate(sentences):
+            last_sentence = si == len(sentences) - 1
+            if estimate_tokens(sent) <= max_tokens:
+                yield sent, (psep if last_sentence else ssep)
+                continue
+            words = _pairs(_WORD_SPLIT.split(sent))
+            for wi, (word, wsep) in enumerate(words):
+                if wi == len(words) - 1:
+                    wsep = psep if last_sentence else ssep
+                yield word, wsep
+
+def split_text(text: str, max_tokens: int = CHUNK_TOKENS):
+    """Split `text` into [(chunk, separator_after_chunk)] under `max_tokens`.
+
+    Splits on paragraph boundaries first, then sentences, then words, so
+    `join_chunks` can put the edited pieces back with the original spacing.
+    """
+    text = text.strip()
+    chunks = []
+    cur, cur_sep, cur_tokens = "", "", 0
+    for unit, sep in _units(text, max_tokens):
+        t = estimate_tokens(unit)
+        if cur and cur_tokens + t > max_tokens:
+            chunks.append((cur, cur_sep))
+            cur, cur_tokens = "", 0
+        if cur:
+            cur += cur_sep
+        cur += unit
+        cur_sep = sep
+        cur_tokens += t
+    if cur or not chunks:
+        chunks.append((cur, cur_sep))
+    return chunks
+
+def join_chunks(outputs, chunks) -> str:
+    return "".join(out.strip() + sep for out, (_, sep) in zip(outputs, chunks)).strip()
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT):
+    """Split a reply into Telegram-sized messages, preferring line breaks."""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut < limit // 2:
+            cut = text.rfind(" ", 0, limit)
+        if cut < limit // 2:
+            cut = limit
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text.strip() or not parts:
+        parts.append(text)
+    return parts
@@ -0,0 +1,102 @@
+import os
+import grpc
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from google.api_core.client_options import ClientOptions
+from google.ai import generativelanguage as glm
+from google.ai.generativelanguage_v1beta.services.generative_service.transports import GenerativeServiceGrpcAsyncIOTransport
+from .key_manager import OPENAI_KEYS, GEMINI_KEYS
+
+# اندازه‌ی pool اتصال‌های keep-alive برای هر کلید
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", "60"))
+# endpoint دیگر برای Gemini؛ «http://host:port» یعنی gRPC بدون TLS (سرور جعلی bench/bench_load.py)
+# OpenAI خودش OPENAI_BASE_URL را از env می‌خواند
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT", "")
+
+class ClientRegistry:
+    """One long-lived client per API key of a `KeyScheduler`.
+
+    Clients are built lazily on first use and kept until the key set changes.
+    Clients of removed keys are closed on the next `reload()` / `aclose()`.
+    """
+    def __init__(self, keys, factory, closer):
+        self.keys = keys
+        self.factory = factory
+        self.closer = closer
+        self._clients = {}
+        self._retired = []
+        self._version = keys.version
+
+    def _sync(self):
+        if self._version == self.keys.version:
+            return
+        live = set(self.keys.keys)
+        for k in [k for k in self._clients if k not in live]:
+            self._retired.append(self._clients.pop(k))
+        self._version = self.keys.version
+
+    def get(self, key: str):
+        self._sync()
+        client = self._clients.get(key)
+        if client is None:
+            client = self._clients[key] = self.factory(key)
+        return client
+
+    async def _close_retired(self):
+        retired, self._retired = self._retired, []
+        for client in retired:
+            try:
+                await self.closer(client)
+            except Exception:
+                pass
+
+    async def reload(self):
+        self.keys.refresh()
+        self._sync()
+        await self._close_retired()
+
+    async def aclose(self):
+        self._retired.extend(self._clients.values())
+        self._clients = {}
+        await self._close_retired()
+
+    def __len__(self):
+        return len(self._clients)
+
+
+def _make_openai(key: str) -> AsyncOpenAI:
+    http_client = DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_SECONDS,
+        ),
+    )
+    return AsyncOpenAI(api_key=key, max_retries=0, http_client=http_client)
+
+async def _close_openai(client: AsyncOpenAI):
+    await client.close()
+
+def _make_gemini(key: str) -> glm.GenerativeServiceAsyncClient:
+    # کلاینت مستقل برای هر کلید؛ دیگر genai.configure سراسری لازم نیست
+    if GEMINI_API_ENDPOINT.startswith("http://"):
+        channel = grpc.aio.insecure_channel(GEMINI_API_ENDPOINT[len("http://"):])
+        return glm.GenerativeServiceAsyncClient(transport=GenerativeServiceGrpcAsyncIOTransport(channel=channel))
+    return glm.GenerativeServiceAsyncClient(
+        client_options=ClientOptions(api_key=key, api_endpoint=GEMINI_API_ENDPOINT or None))
+
+async def _close_gemini(client: glm.GenerativeServiceAsyncClient):
+    await client.transport.close()
+
+
+OPENAI_CLIENTS = ClientRegistry(OPENAI_KEYS, _make_openai, _close_openai)
+GEMINI_CLIENTS = ClientRegistry(GEMINI_KEYS, _make_gemini, _close_gemini)
+
+async def reload_clients():
+    await OPENAI_CLIENTS.reload()
+    await GEMINI_CLIENTS.reload()
+
+async def close_clients():
+    await OPENAI_CLIENTS.aclose()
+    await GEMINI_CLIENTS.aclose()
@@ -0,0 +1,182 @@
+import os
+import time
+import asyncio
+from collections import deque
+
+# هر کلید چند درخواست همزمان را تحمل می‌کند
+PER_KEY_CONCURRENCY = int(os.getenv("PER_KEY_CONCURRENCY", "2"))
+# بالاتر از این نسبت 429، یا کندتر از این p95، ظرفیت موتور نصف می‌شود
+THROTTLE_RATE_HIGH = float(os.getenv("THROTTLE_RATE_HIGH", "0.1"))
+SLOW_LATENCY_SECONDS = float(os.getenv("SLOW_LATENCY_SECONDS", "45"))
+PROVIDER_STATS_WINDOW = int(os.getenv("PROVIDER_STATS_WINDOW", "300"))
+
+class ResizableLimiter:
+    """A semaphore whose limit can change while permits are held."""
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.in_use = 0
+        self._cond = asyncio.Condition()
+
+    @property
+    def available(self) -> int:
+        return max(0, self.limit - self.in_use)
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_use < self.limit)
+            self.in_use += 1
+
+    async def release(self):
+        async with self._cond:
+            self.in_use -= 1
+            self._cond.notify()
+
+    async def set_limit(self, limit: int):
+        async with self._cond:
+            self.limit = max(1, limit)
+            self._cond.notify_all()
+
+    async def wait_available(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_use < self.limit)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.release()
+
+class ProviderStats:
+    """Rolling window of (time, latency, throttled) per provider."""
+    def __init__(self, window: int = PROVIDER_STATS_WINDOW):
+        self.window = window
+        self._events = {}
+
+    def record(self, provider: str, latency: float, throttled: bool = False):
+        q = self._events.setdefault(provider, deque())
+        q.append((time.monotonic(), latency, throttled))
+        self._trim(q)
+
+    def record_censored(self, provider: str, latency: float):
+        """A call cut off after `latency` (hedge lost, timeout): the real latency was at least this.
+
+        Kept only when it is already above the current p95; otherwise it says
+        nothing about the tail and would only pull p95 down.
+        """
+        if latency > self.summary(provider)["p95"]:
+            self.record(provider, latency)
+
+    def _trim(self, q):
+        cutoff = time.monotonic() - self.window
+        while q and q[0][0] < cutoff:
+            q.popleft()
+
+    def summary(self, provider: str) -> dict:
+        q = self._events.get(provider) or deque()
+        self._trim(q)
+        lat = sorted(e[1] for e in q if not e[2])
+        throttled = sum(1 for e in q if e[2])
+        return {
+            "count": len(q),
+            "throttle_rate": (throttled / len(q)) if q else 0.0,
+            "p95": lat[min(len(lat) - 1, int(len(lat) * 0.95))] if lat else 0.0,
+        }
+
+def provider_capacity(keys: int, summary: dict) -> int:
+    """Concurrency limit for one provider from its key count and recent health."""
+    cap = max(1, keys * PER_KEY_CONCURRENCY)
+    if summary["count"] >= 5 and (summary["throttle_rate"] > THROTTLE_RATE_HIGH
+                                  or summary["p95"] > SLOW_LATENCY_SECONDS):
+        cap = max(1, cap // 2)
+    return cap
+
+# بالاتر از این نسبت خطا در CIRCUIT_WINDOW ثانیه‌ی اخیر، موتور برای مدتی کنار گذاشته می‌شود
+CIRCUIT_ERROR_RATE = float(os.getenv("CIRCUIT_ERROR_RATE", "0.5"))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "5"))
+CIRCUIT_WINDOW = int(os.getenv("CIRCUIT_WINDOW", "60"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+CIRCUIT_MAX_OPEN_SECONDS = float(os.getenv("CIRCUIT_MAX_OPEN_SECONDS", "600"))
+
+class CircuitBreaker:
+    """Per-provider circuit: closed -> open -> half-open (one probe) -> closed.
+
+    Opens when the failure rate over the last `window` seconds crosses
+    `error_rate`; a failed probe reopens it for twice as long.
+    """
+    def __init__(self, error_rate: float = CIRCUIT_ERROR_RATE, min_calls: int = CIRCUIT_MIN_CALLS,
+                 window: int = CIRCUIT_WINDOW, open_seconds: float = CIRCUIT_OPEN_SECONDS,
+                 max_open_seconds: float = CIRCUIT_MAX_OPEN_SECONDS):
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self._events = {}
+        self._open_until = {}
+        self._open_for = {}
+        self._probing = {}   # provider -> زمان شروع probe
+        self.trips = {}
+
+    def state(self, provider: str) -> str:
+        until = self._open_until.get(provider)
+        if until is None:
+            return "closed"
+        return "open" if time.monotonic() < until else "half_open"
+
+    def allow(self, provider: str) -> bool:
+        """False while open; in half-open only the first caller gets through as the probe.
+
+        The probe slot is freed by `record()`, or after `open_seconds` if that
+        never comes, so a lost probe can not shut the provider out for good.
+        """
+        state = self.state(provider)
+        if state == "closed":
+            return True
+        if state != "half_open":
+            return False
+        now = time.monotonic()
+        started = self._probing.get(provider)
+        if started is not None and now - started < self.open_seconds:
+            return False
+        self._probing[provider] = now
+        return True
+
+    def record(self, provider: str, ok):
+        """ok=None means the call was cancelled and says nothing about health."""
+        probing = self._probing.pop(provider, None) is not None
+        if ok is None:
+            return
+        if ok:
+            if probing or self.state(provider) == "half_open":
+                self._close(provider)
+            else:
+                self._push(provider, True)
+            return
+        if probing:
+            self._open(provider, min(self.max_open_seconds, self._open_for.get(provider, self.open_seconds) * 2))
+            return
+        if self.state(provider) != "closed":
+            return
+        q = self._push(provider, False)
+        failures = sum(1 for _, good in q if not good)
+        if len(q) >= self.min_calls and failures / len(q) >= self.error_rate:
+            self._open(provider, self.open_seconds)
+
+    def _push(self, provider: str, ok: bool):
+        q = self._events.setdefault(provider, deque())
+        now = time.monotonic()
+        q.append((now, ok))
+        while q and q[0][0] < now - self.window:
+            q.popleft()
+        return q
+
+    def _open(self, provider: str, seconds: float):
+        self._open_for[provider] = seconds
+        self._open_until[provider] = time.monotonic() + seconds
+        self.trips[provider] = self.trips.get(provider, 0) + 1
+
+    def _close(self, provider: str):
+        self._open_until.pop(provider, None)
+        self._open_for.pop(provider, None)
+        self._events.pop(provider, None)
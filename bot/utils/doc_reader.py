@@ -0,0 +1,103 @@
+import io
+import os
+import codecs
+
+# سقف مطلق حجم فایل .txt؛ سقف واقعی از max_words هم محدودتر می‌شود
+DOC_MAX_BYTES = int(os.getenv("DOC_MAX_BYTES", str(2 * 1024 * 1024)))
+# یک کلمه‌ی فارسی در UTF-8 با فاصله و علائم به‌ندرت از این بیشتر است
+DOC_BYTES_PER_WORD = int(os.getenv("DOC_BYTES_PER_WORD", "24"))
+DOC_CHUNK_SIZE = int(os.getenv("DOC_CHUNK_SIZE", str(64 * 1024)))
+# فایل‌های قدیمی ویندوز فارسی/عربی
+DOC_FALLBACK_ENCODING = os.getenv("DOC_FALLBACK_ENCODING", "cp1256")
+# تشخیص encoding از این تعداد بایت اول
+DETECT_BYTES = 4096
+
+_BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+class DocumentTooLarge(Exception):
+    def __init__(self, words: int, limit: int):
+        super().__init__(f"document has more than {limit} words")
+        self.words = words
+        self.limit = limit
+
+def max_doc_bytes(max_words: int) -> int:
+    return min(DOC_MAX_BYTES, max_words * DOC_BYTES_PER_WORD)
+
+def detect_encoding(head: bytes) -> str:
+    """BOM first, then UTF-8 if the first bytes are valid UTF-8, else the fallback."""
+    for bom, name in _BOMS:
+        if head.startswith(bom):
+            return name
+    try:
+        # ممکن است آخر head وسط یک کاراکتر چندبایتی بریده شده باشد
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return DOC_FALLBACK_ENCODING
+
+class TextAccumulator:
+    """Decodes byte chunks as they arrive and counts words like `len(text.split())`.
+
+    Raises `DocumentTooLarge` as soon as the count passes `max_words`, so the
+    rest of the file is never downloaded.
+    """
+    def __init__(self, max_words: int):
+        self.max_words = max_words
+        self.words = 0
+        self._parts = []
+        self._decoder = None
+        self._head = b""
+        self._in_word = False
+
+    def feed(self, data: bytes, final: bool = False):
+        if self._decoder is None:
+            self._head += data
+            if len(self._head) < DETECT_BYTES and not final:
+                return
+            data, self._head = self._head, b""
+            self._decoder = codecs.getincrementaldecoder(detect_encoding(data))(errors="replace")
+        part = self._decoder.decode(data, final=final)
+        if not part:
+            return
+        n = len(part.split())
+        # کلمه‌ای که بین دو chunk بریده شده دو بار شمرده نشود
+        if n and self._in_word and not part[0].isspace():
+            n -= 1
+        self._in_word = not part[-1].isspace()
+        self.words += n
+        self._parts.append(part)
+        if self.words > self.max_words:
+            raise DocumentTooLarge(self.words, self.max_words)
+
+    def text(self) -> str:
+        self.feed(b"", final=True)
+        text = "".join(self._parts)
+        self._parts = [text]
+        return text
+
+async def _iter_file(bot, file_path: str, chunk_size: int):
+    if bot.session.api.is_local:
+        buffer = await bot.download_file(file_path, io.BytesIO())
+        while chunk := buffer.read(chunk_size):
+            yield chunk
+        return
+    url = bot.session.api.file_url(bot.token, file_path)
+    async for chunk in bot.session.stream_content(url=url, chunk_size=chunk_size, raise_for_status=True):
+        yield chunk
+
+async def read_text_document(bot, file_id: str, max_words: int, chunk_size: int = DOC_CHUNK_SIZE):
+    """Stream a document from Telegram into text; returns (text, word_count)."""
+    file = await bot.get_file(file_id)
+    acc = TextAccumulator(max_words)
+    stream = _iter_file(bot, file.file_path, chunk_size)
+    try:
+        async for chunk in stream:
+            acc.feed(chunk)
+    finally:
+        # با DocumentTooLarge اتصال دانلود همین‌جا بسته می‌شود
+        await stream.aclose()
+    return acc.text(), acc.words
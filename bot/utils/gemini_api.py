@@ -1,7 +1,12 @@
 import os
+import re
+import asyncio
 import logging
-import google.generativeai as genai
-from .key_manager import GEMINI_KEYS
+from google.ai import generativelanguage as glm
+from .key_manager import GEMINI_KEYS, parse_duration
+from .chunker import estimate_tokens
+from .token_estimator import record_usage
+from .client_registry import GEMINI_CLIENTS
 from ..utils.notification import notify_admin
 
 GEMINI_MODEL = os.getenv("GEMINI_MODEL","gemini-1.5-flash")
@@ -17,44 +22,148 @@ def _is_quota_error(msg: str) -> bool:
     m = msg.lower()
     return ("quota" in m) or ("rate limit" in m) or ("resource exhausted" in m) or ("429" in m)
 
-def process_with_gemini(instruction: str, text: str) -> str:
+_RETRY_HINTS = (
+    re.compile(r"retry in ([\d.]+\s*m?s)", re.I),
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)", re.I),
+)
+
+def _retry_after(e) -> float:
+    # ResourceExhausted گاهی RetryInfo یا «Please retry in 30s» دارد
+    msg = str(e)
+    for rx in _RETRY_HINTS:
+        m = rx.search(msg)
+        if m:
+            return parse_duration(m.group(1).replace(" ", ""))
+    return None
+
+def _build_prompt(instruction: str, text: str) -> str:
+    return (
+        "شما یک ویراستار حرفه‌ای فارسی هستید. فقط ویراستاری کنید و محتوا/لحن را تغییر ندهید.\n\n"
+        f"دستورالعمل ویراستاری:\n{instruction}\n\n---\n"
+        f"متن ورودی:\n{text}\n\n"
+        "لطفا خروجی نهایی ویراستاری‌شده را فقط برگردان."
+    )
+
+# مثل google.generativeai: نام کوتاه مدل یعنی models/<name>
+_MODEL_NAME = GEMINI_MODEL if "/" in GEMINI_MODEL else f"models/{GEMINI_MODEL}"
+
+def _request(instruction: str, text: str) -> glm.GenerateContentRequest:
+    return glm.GenerateContentRequest(
+        model=_MODEL_NAME,
+        contents=[glm.Content(role="user", parts=[glm.Part(text=_build_prompt(instruction, text))])],
+    )
+
+def _text(resp) -> str:
+    if not resp.candidates:
+        return ""
+    return "".join(part.text for part in resp.candidates[0].content.parts)
+
+def _record_usage(resp):
+    if "usage_metadata" in resp:
+        meta = resp.usage_metadata
+        record_usage(meta.prompt_token_count, meta.candidates_token_count)
+
+def _call_kwargs(timeout: float = None) -> dict:
+    return {"timeout": timeout} if timeout else {}
+
+async def process_with_gemini(instruction: str, text: str, timeout: float = None) -> str:
     tried = set()
     last_err = None
     total_keys = max(1, GEMINI_KEYS.counts())
+    tokens = estimate_tokens(instruction) + 2 * estimate_tokens(text)
 
     for idx in range(1, total_keys + 1):
-        key = GEMINI_KEYS.next_key()
-        if not key or key in tried:
-            continue
+        key = await GEMINI_KEYS.acquire(tokens, exclude=tried)
+        if not key:
+            break
         tried.add(key)
 
         log_msg = f"🔍 در حال بررسی کلید شماره {idx}"
         logger.info(log_msg)
 
         try:
-            genai.configure(api_key=key)
-            model = genai.GenerativeModel(GEMINI_MODEL)
-            prompt = (
-                "شما یک ویراستار حرفه‌ای فارسی هستید. فقط ویراستاری کنید و محتوا/لحن را تغییر ندهید.\n\n"
-                f"دستورالعمل ویراستاری:\n{instruction}\n\n---\n"
-                f"متن ورودی:\n{text}\n\n"
-                "لطفا خروجی نهایی ویراستاری‌شده را فقط برگردان."
-            )
-            resp = model.generate_content(prompt)
-            out = resp.text or ""
-            return out.strip()
-
+            # کلاینت pooled همین کلید (client_registry)، مستقیم و بدون GenerativeModel
+            resp = await GEMINI_CLIENTS.get(key).generate_content(_request(instruction, text), **_call_kwargs(timeout))
+            if not resp.candidates:
+                raise RuntimeError(f"Gemini returned no candidates: {resp.prompt_feedback.block_reason.name}")
+            out = _text(resp)
+            _record_usage(resp)
+        except asyncio.CancelledError:
+            GEMINI_KEYS.release(key, "cancelled")
+            raise
         except Exception as e:
             msg = str(e)
             last_err = e
             if _is_quota_error(msg):
                 warn_msg = f"❌ کلید شماره {idx} اعتبار ندارد. کلید بعدی را تست می‌کنم."
                 logger.warning(warn_msg)
-                GEMINI_KEYS.mark_cooldown(key, 600)
+                GEMINI_KEYS.release(key, "throttled", _retry_after(e))
                 continue
+            GEMINI_KEYS.release(key, "error")
             raise
+        GEMINI_KEYS.release(key, "ok")
+        return out.strip()
 
+    if not tried and GEMINI_KEYS.counts():
+        # «rate limit» در پیام: queue_manager آن را خطای سهمیه می‌بیند و failover می‌کند
+        raise RuntimeError("rate limit: all Gemini keys are cooling down")
     final_msg = "🚫 هیچیک از کلیدهای جمنای معتبر نیستند."
     logger.error(final_msg)
     
     raise RuntimeError(final_msg)
+
+async def stream_with_gemini(instruction: str, text: str, timeout: float = None):
+    """Like `process_with_gemini`, but yields the output as it is generated."""
+    tried = set()
+    total_keys = max(1, GEMINI_KEYS.counts())
+    tokens = estimate_tokens(instruction) + 2 * estimate_tokens(text)
+
+    for idx in range(1, total_keys + 1):
+        key = await GEMINI_KEYS.acquire(tokens, exclude=tried)
+        if not key:
+            break
+        tried.add(key)
+
+        outcome = "cancelled"
+        try:
+            try:
+                resp = await GEMINI_CLIENTS.get(key).stream_generate_content(
+                    _request(instruction, text), **_call_kwargs(timeout)
+                )
+            except Exception as e:
+                if _is_quota_error(str(e)):
+                    logger.warning(f"❌ کلید شماره {idx} اعتبار ندارد. کلید بعدی را تست می‌کنم.")
+                    GEMINI_KEYS.release(key, "throttled", _retry_after(e))
+                    outcome = None
+                    continue
+                outcome = "error"
+                raise
+
+            outcome = "error"
+            try:
+                last = None
+                async for chunk in resp:
+                    # تکه‌ی بدون متن (مثلا فقط finish_reason) رشته‌ی خالی می‌دهد
+                    delta = _text(chunk)
+                    if delta:
+                        yield delta
+                    if "usage_metadata" in chunk:
+                        last = chunk
+                # usage_metadata کل پاسخ روی آخرین تکه می‌آید
+                if last is not None:
+                    _record_usage(last)
+            except (GeneratorExit, asyncio.CancelledError):
+                outcome = "cancelled"
+                raise
+            outcome = "ok"
+            return
+        finally:
+            if outcome:
+                GEMINI_KEYS.release(key, outcome)
+
+    if not tried and GEMINI_KEYS.counts():
+        # «rate limit» در پیام: queue_manager آن را خطای سهمیه می‌بیند و failover می‌کند
+        raise RuntimeError("rate limit: all Gemini keys are cooling down")
+    final_msg = "🚫 هیچیک از کلیدهای جمنای معتبر نیستند."
+    logger.error(final_msg)
+    raise RuntimeError(final_msg)
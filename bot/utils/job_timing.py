@@ -0,0 +1,54 @@
+import time
+import contextvars
+
+# زمان مراحل هر job (epoch ثانیه) در ستون‌های t_* جدول jobs.
+# t_enqueue را enqueue می‌نویسد و بقیه را QueueManager در همان update آخر job.
+#
+# (نام مرحله، ستون شروع، ستون پایان)
+STAGES = (
+    ("queue", "t_enqueue", "t_dequeue"),
+    ("setup", "t_dequeue", "t_provider_start"),
+    ("first_byte", "t_provider_start", "t_first_byte"),
+    ("provider", "t_provider_start", "t_provider_end"),
+    ("delivery", "t_provider_end", "t_delivered"),
+    ("total", "t_enqueue", "t_delivered"),
+)
+TIMESTAMP_COLUMNS = ("t_enqueue", "t_dequeue", "t_provider_start", "t_first_byte", "t_provider_end", "t_delivered")
+PERCENTILES = (0.5, 0.95, 0.99)
+
+# مثل token_estimator._usage: QueueManager یک dict برای job جاری می‌گذارد و
+# فراخوانی موتورها (حتی در تسک‌های فرزند و hedge) در همان dict علامت می‌زنند
+_trace = contextvars.ContextVar("job_trace", default=None)
+
+def start_trace() -> dict:
+    trace = {"t_dequeue": time.time()}
+    _trace.set(trace)
+    return trace
+
+def mark(column: str, first: bool = False):
+    """Stamp `column` now; with `first`, keep the earliest stamp (e.g. first byte of several chunks)."""
+    trace = _trace.get()
+    if trace is not None and not (first and column in trace):
+        trace[column] = time.time()
+
+def record_key(index: int):
+    trace = _trace.get()
+    if trace is not None:
+        trace["key_index"] = index
+
+def percentile(values, p: float):
+    """Linear interpolation between ranks, like Postgres percentile_cont; `values` sorted."""
+    if not values:
+        return None
+    pos = p * (len(values) - 1)
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+def summarize(rows) -> dict:
+    """rows with the t_* columns -> {stage: (count, p50, p95, p99)}."""
+    out = {}
+    for name, start, end in STAGES:
+        values = sorted(r[end] - r[start] for r in rows if r[start] is not None and r[end] is not None)
+        out[name] = (len(values), *(percentile(values, p) for p in PERCENTILES))
+    return out
@@ -0,0 +1,90 @@
+import os
+import asyncio
+
+# هر چند ثانیه یکبار تغییرات وضعیت jobها در یک تراکنش نوشته می‌شود؛ 0 یعنی مثل قبل، هر update جدا
+JOB_WRITE_INTERVAL = float(os.getenv("JOB_WRITE_INTERVAL", "0.25"))
+# با رسیدن به این تعداد job در بافر زودتر نوشته می‌شود
+JOB_WRITE_BATCH = int(os.getenv("JOB_WRITE_BATCH", "200"))
+
+class JobWriter:
+    """Write-behind buffer for `update_job` calls.
+
+    `update()` only merges the fields into an in-memory dict per job; a
+    background task hands everything buffered to `store.update_jobs()` as one
+    transaction every `interval` seconds, or sooner once `batch` jobs are
+    waiting. Fields of one job are merged in call order and flushes never
+    overlap, so a later update can not be overwritten by an earlier one.
+    A failed flush is put back under any newer fields and retried.
+
+    Up to `interval` seconds of transitions are lost if the process dies;
+    the job's lease then expires and it runs again, as after any crash.
+    """
+    def __init__(self, store, interval: float = JOB_WRITE_INTERVAL, batch: int = JOB_WRITE_BATCH):
+        self.store = store
+        self.interval = interval
+        self.batch = max(1, batch)
+        self.logger = None
+        self.flushes = 0
+        self.written = 0
+        self._pending = {}
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        self._task = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def update(self, job_id: int, **fields):
+        if self.interval <= 0:
+            return await self.store.update_job(job_id, **fields)
+        self._pending.setdefault(job_id, {}).update(fields)
+        if len(self._pending) >= self.batch:
+            self._wakeup.set()
+
+    async def flush(self):
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            try:
+                await self.store.update_jobs(list(batch.items()))
+            except Exception:
+                # فیلدهای جدیدتر که در این فاصله رسیده‌اند روی قبلی‌ها می‌نشینند
+                for job_id, fields in self._pending.items():
+                    batch.setdefault(job_id, {}).update(fields)
+                self._pending = batch
+                raise
+            self.flushes += 1
+            self.written += len(batch)
+
+    async def _loop(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                if self.logger: self.logger.error(f"Job status flush failed ({len(self._pending)} jobs): {e}")
+
+    def start(self, logger=None):
+        self.logger = logger
+        self._closing = False
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            # cancel نه: flush در حال اجرا نباید وسط کار قطع شود
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        # هر چه مانده قبل از خاموش شدن
+        try:
+            await self.flush()
+        except Exception as e:
+            if self.logger: self.logger.error(f"Final job status flush failed, {len(self._pending)} jobs not saved: {e}")
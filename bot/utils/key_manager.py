@@ -1,4 +1,11 @@
-import os, time
+import os, re, time, asyncio
+from .job_timing import record_key
+
+# اگر هیچ کلیدی ظرفیت نداشت، تا این مدت برای پر شدن bucket صبر می‌کنیم
+KEY_MAX_WAIT = float(os.getenv("KEY_MAX_WAIT", "5"))
+# cooldown نمایی وقتی موتور Retry-After نمی‌دهد: 2, 4, 8, ... تا سقف 600 ثانیه
+KEY_BASE_COOLDOWN = float(os.getenv("KEY_BASE_COOLDOWN", "2"))
+KEY_MAX_COOLDOWN = float(os.getenv("KEY_MAX_COOLDOWN", "600"))
 
 def _parse_multi(primary: str, single: str):
     raw = os.getenv(primary, "") or ""
@@ -8,42 +15,162 @@ def _parse_multi(primary: str, single: str):
         if s: keys = [s]
     return keys
 
-class RoundRobinKeys:
-    def __init__(self, primary_env: str, single_env: str):
+_DURATION_PART = re.compile(r"([\d.]+)(ms|h|m|s)")
+
+def parse_duration(value) -> float:
+    """'1.5', '20ms', '6m0s', '1h2m3s' -> seconds (None if unparseable)."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(n) * scale[u] for n, u in parts)
+
+class _Bucket:
+    """Token bucket refilled continuously at `per_minute` tokens per minute."""
+    def __init__(self, per_minute: float):
+        self.capacity = max(1.0, float(per_minute))
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _fill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, n: float, now: float) -> float:
+        self._fill(now)
+        n = min(n, self.capacity)
+        return 0.0 if self.tokens >= n else (n - self.tokens) / self.rate
+
+    def take(self, n: float, now: float):
+        self._fill(now)
+        self.tokens -= min(n, self.capacity)
+
+class KeyState:
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = _Bucket(rpm)
+        self.tokens = _Bucket(tpm)
+        self.in_flight = 0
+        self.successes = 0
+        self.throttles = 0
+        self.errors = 0
+        self.cooldown_until = 0.0
+        self.streak = 0
+
+class KeyScheduler:
+    """Hands out API keys by load instead of strict rotation.
+
+    Each key has RPM/TPM token buckets; `acquire()` picks the key with the
+    fewest in-flight requests among those with headroom, and `release()`
+    records the outcome. Throttled keys rest for the provider's Retry-After
+    when given, otherwise for an exponentially growing cooldown.
+    """
+    def __init__(self, primary_env: str, single_env: str, rpm: int, tpm: int):
         self.primary_env = primary_env
         self.single_env = single_env
+        self.rpm = rpm
+        self.tpm = tpm
         self.keys = _parse_multi(primary_env, single_env)
-        self.index = 0
-        self.cooldown_until = {k: 0 for k in self.keys}
+        self.state = {k: KeyState(rpm, tpm) for k in self.keys}
+        # هر بار که مجموعه کلیدها عوض شود یکی زیاد می‌شود (برای ClientRegistry)
+        self.version = 0
 
     def refresh(self):
         nk = _parse_multi(self.primary_env, self.single_env)
         if nk != self.keys:
             self.keys = nk
-            self.index = 0
-            self.cooldown_until = {k: 0 for k in self.keys}
-        else:
-            for k in self.keys:
-                self.cooldown_until.setdefault(k, 0)
-
-    def mark_cooldown(self, key: str, sec: int = 600):
-        self.cooldown_until[key] = time.time() + sec
-
-    def next_key(self) -> str:
-        self.refresh()
-        if not self.keys:
-            return ""
-        n = len(self.keys)
-        for _ in range(n):
-            k = self.keys[self.index % n]
-            self.index += 1
-            if time.time() >= self.cooldown_until.get(k, 0):
-                return k
-        return self.keys[self.index % n]
+            self.version += 1
+            # آمار کلیدهایی که مانده‌اند حفظ می‌شود
+            self.state = {k: self.state.get(k) or KeyState(self.rpm, self.tpm) for k in nk}
 
     def counts(self):
         self.refresh()
         return len(self.keys)
 
-OPENAI_KEYS = RoundRobinKeys("OPENAI_API_KEYS","OPENAI_API_KEY")
-GEMINI_KEYS = RoundRobinKeys("GEMINI_API_KEYS","GEMINI_API_KEY")
+    def _ready_in(self, st: KeyState, tokens: float, now: float) -> float:
+        return max(st.cooldown_until - now, st.requests.wait_time(1, now), st.tokens.wait_time(tokens, now), 0.0)
+
+    def _pick(self, tokens: float, exclude):
+        now = time.monotonic()
+        candidates = [k for k in self.keys if k not in exclude]
+        if not candidates:
+            return "", 0.0
+        ready = [k for k in candidates if self._ready_in(self.state[k], tokens, now) == 0]
+        if ready:
+            return min(ready, key=lambda k: (self.state[k].in_flight, -self.state[k].requests.tokens)), 0.0
+        key = min(candidates, key=lambda k: self._ready_in(self.state[k], tokens, now))
+        return key, self._ready_in(self.state[key], tokens, now)
+
+    async def acquire(self, tokens: float = 0, exclude=(), max_wait: float = KEY_MAX_WAIT) -> str:
+        """Reserve a key for one request of ~`tokens` tokens.
+
+        "" if none is left, or if even the soonest key is still in its
+        Retry-After/exponential cooldown when `max_wait` runs out.
+        """
+        self.refresh()
+        deadline = time.monotonic() + max_wait
+        while True:
+            key, wait = self._pick(tokens, exclude)
+            if not key:
+                return ""
+            now = time.monotonic()
+            if wait <= 0 or now + wait > deadline:
+                st = self.state[key]
+                # کلید throttle‌شده را زودتر از cooldown نمی‌دهیم؛ caller سراغ موتور دیگر می‌رود یا requeue می‌کند
+                if st.cooldown_until > deadline:
+                    return ""
+                # فقط bucket کم دارد: همانی که زودتر آزاد می‌شود (موتور خودش 429 می‌دهد)
+                st.requests.take(1, now)
+                st.tokens.take(tokens, now)
+                st.in_flight += 1
+                return key
+            await asyncio.sleep(wait)
+
+    def release(self, key: str, outcome: str = "ok", retry_after: float = None):
+        """outcome: ok | throttled | error | cancelled"""
+        st = self.state.get(key)
+        if st is None:
+            return
+        st.in_flight = max(0, st.in_flight - 1)
+        if outcome == "ok":
+            st.successes += 1
+            st.streak = 0
+            # شماره‌ی کلید (نه خود کلید) در ردیف job
+            record_key(self.keys.index(key))
+        elif outcome == "throttled":
+            st.throttles += 1
+            if retry_after is None or retry_after <= 0:
+                retry_after = min(KEY_MAX_COOLDOWN, KEY_BASE_COOLDOWN * (2 ** st.streak))
+            st.streak += 1
+            st.cooldown_until = max(st.cooldown_until, time.monotonic() + retry_after)
+        elif outcome == "error":
+            st.errors += 1
+
+    def stats(self):
+        now = time.monotonic()
+        out = []
+        for k in self.keys:
+            st = self.state[k]
+            out.append({
+                "key": f"…{k[-4:]}",
+                "in_flight": st.in_flight,
+                "successes": st.successes,
+                "throttles": st.throttles,
+                "errors": st.errors,
+                "cooldown": max(0.0, st.cooldown_until - now),
+            })
+        return out
+
+OPENAI_KEYS = KeyScheduler("OPENAI_API_KEYS", "OPENAI_API_KEY",
+                           rpm=int(os.getenv("OPENAI_KEY_RPM", "500")),
+                           tpm=int(os.getenv("OPENAI_KEY_TPM", "200000")))
+GEMINI_KEYS = KeyScheduler("GEMINI_API_KEYS", "GEMINI_API_KEY",
+                           rpm=int(os.getenv("GEMINI_KEY_RPM", "15")),
+                           tpm=int(os.getenv("GEMINI_KEY_TPM", "1000000")))
@@ -0,0 +1,164 @@
+"""In-process metrics in the Prometheus text format, served on /metrics.
+
+No client library: counters, gauges and histograms are plain dicts keyed by
+label values, cheap enough to update on the hot path. Values that already
+live elsewhere (queue depth in the DB, per-key counters in KeyScheduler) are
+read by collectors at scrape time instead.
+"""
+import os
+import time
+import bisect
+from contextlib import contextmanager
+from aiohttp import web
+
+# 0 یعنی بدون سرور metrics
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+REGISTRY = []
+COLLECTORS = []
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._values = {}
+        REGISTRY.append(self)
+
+    def clear(self):
+        self._values.clear()
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self):
+        lines = self._header()
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set(self, value: float, *labels):
+        # برای collectorهایی که شمارنده را از جای دیگری می‌خوانند
+        self._values[labels] = value
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        item = self._values.get(labels)
+        if item is None:
+            # [شمارش هر bucket (غیرتجمعی)، +Inf، sum]
+            item = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        item[bisect.bisect_left(self.buckets, value)] += 1
+        item[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, *labels)
+
+    def render(self):
+        lines = self._header()
+        for key, item in self._values.items():
+            total = 0
+            for bound, n in zip(self.buckets + ("+Inf",), item[:-1]):
+                total += n
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, (le,))} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {item[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {total}")
+        return lines
+
+def add_collector(fn):
+    """`fn` is an async callable run before every scrape to refresh gauges."""
+    COLLECTORS.append(fn)
+    return fn
+
+async def render() -> str:
+    for fn in COLLECTORS:
+        try:
+            await fn()
+        except Exception:
+            # یک collector خراب نباید کل /metrics را خراب کند
+            pass
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+async def _handle(request):
+    return web.Response(text=await render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+def add_metrics_route(app: web.Application, path: str = "/metrics"):
+    app.router.add_get(path, _handle)
+
+_runner = None
+
+async def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST):
+    global _runner
+    if port <= 0 or _runner is not None:
+        return
+    app = web.Application()
+    add_metrics_route(app)
+    _runner = web.AppRunner(app)
+    await _runner.setup()
+    await web.TCPSite(_runner, host, port).start()
+
+async def stop_metrics_server():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
+
+# ---------------- metrics used across the bot ----------------
+QUEUE_DEPTH = Gauge("virastar_queue_jobs", "Jobs in the DB queue by status", ("status",))
+QUEUE_WAIT = Histogram("virastar_queue_wait_seconds", "Time from enqueue to claim", ("provider",))
+JOBS_IN_FLIGHT = Gauge("virastar_jobs_in_flight", "Jobs being processed by this process")
+JOB_LATENCY = Histogram("virastar_job_seconds", "Enqueue to delivery, by final provider/model",
+                        ("provider", "model", "status"))
+PROVIDER_LATENCY = Histogram("virastar_provider_request_seconds", "One LLM call (all chunks separately)",
+                             ("provider", "model", "outcome"))
+KEY_REQUESTS = Counter("virastar_key_requests_total", "Finished requests per API key",
+                       ("provider", "key", "outcome"))
+KEY_IN_FLIGHT = Gauge("virastar_key_in_flight", "Requests in flight per API key", ("provider", "key"))
+KEY_COOLDOWN = Gauge("virastar_key_cooldown_seconds", "Remaining cooldown per API key", ("provider", "key"))
+DB_QUERY = Histogram("virastar_db_query_seconds", "DB call time including pool wait", ("op",))
+TELEGRAM_REQUEST = Histogram("virastar_telegram_request_seconds", "Bot API call time", ("method", "outcome"))
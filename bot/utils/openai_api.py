@@ -1,6 +1,9 @@
 import os
-from openai import OpenAI
-from .key_manager import OPENAI_KEYS
+import asyncio
+from .key_manager import OPENAI_KEYS, parse_duration
+from .client_registry import OPENAI_CLIENTS
+from .chunker import estimate_tokens
+from .token_estimator import record_usage
 
 OPENAI_MODEL = os.getenv("OPENAI_MODEL","gpt-4o-mini")
 
@@ -9,30 +12,112 @@ def _is_quota_error(msg: str) -> bool:
     m = msg.lower()
     return ("rate limit" in m) or ("quota" in m) or ("insufficient_quota" in m) or ("429" in m)
 
-def process_with_openai(instruction: str, text: str) -> str:
+def _retry_after(e) -> float:
+    # Retry-After یا x-ratelimit-reset-* از پاسخ 429
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    if headers.get("retry-after-ms"):
+        ms = parse_duration(headers.get("retry-after-ms"))
+        return ms / 1000 if ms is not None else None
+    for h in ("retry-after", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        sec = parse_duration(headers.get(h))
+        if sec is not None:
+            return sec
+    return None
+
+def _build_messages(instruction: str, text: str):
+    prompt = f"دستورالعمل ویراستاری:\n{instruction}\n\n---\nمتن ورودی:\n{text}\n\nخروجی نهایی ویراستاری‌شده:"
+    return [
+        {"role":"system","content":"شما یک ویراستار حرفه‌ای فارسی هستید. فقط ویراستاری کنید و محتوا/لحن را تغییر ندهید."},
+        {"role":"user","content":prompt}
+    ]
+
+def _expected_tokens(instruction: str, text: str) -> int:
+    # ورودی + خروجی تقریبا هم‌اندازه‌ی متن
+    return estimate_tokens(instruction) + 2 * estimate_tokens(text)
+
+async def process_with_openai(instruction: str, text: str, timeout: float = None) -> str:
     tried = set()
     last_err = None
+    tokens = _expected_tokens(instruction, text)
     for _ in range(max(1, OPENAI_KEYS.counts())):
-        key = OPENAI_KEYS.next_key()
-        if not key or key in tried: continue
+        key = await OPENAI_KEYS.acquire(tokens, exclude=tried)
+        if not key: break
         tried.add(key)
+        client = OPENAI_CLIENTS.get(key)
         try:
-            client = OpenAI(api_key=key)
-            prompt = f"دستورالعمل ویراستاری:\n{instruction}\n\n---\nمتن ورودی:\n{text}\n\nخروجی نهایی ویراستاری‌شده:"
-            resp = client.chat.completions.create(
+            resp = await client.chat.completions.create(
                 model=OPENAI_MODEL,
-                messages=[
-                    {"role":"system","content":"شما یک ویراستار حرفه‌ای فارسی هستید. فقط ویراستاری کنید و محتوا/لحن را تغییر ندهید."},
-                    {"role":"user","content":prompt}
-                ],
-                temperature=0.2
+                messages=_build_messages(instruction, text),
+                temperature=0.2,
+                timeout=timeout,
             )
-            return resp.choices[0].message.content.strip()
+        except asyncio.CancelledError:
+            OPENAI_KEYS.release(key, "cancelled")
+            raise
         except Exception as e:
             msg = str(e); last_err = e
             if _is_quota_error(msg):
-                OPENAI_KEYS.mark_cooldown(key, 600)
+                OPENAI_KEYS.release(key, "throttled", _retry_after(e))
                 continue
+            OPENAI_KEYS.release(key, "error")
             raise
+        OPENAI_KEYS.release(key, "ok")
+        if resp.usage:
+            record_usage(resp.usage.prompt_tokens, resp.usage.completion_tokens)
+        return resp.choices[0].message.content.strip()
+    if last_err: raise last_err
+    if OPENAI_KEYS.counts():
+        # «rate limit» در پیام: queue_manager آن را خطای سهمیه می‌بیند و failover می‌کند
+        raise RuntimeError("rate limit: all OpenAI keys are cooling down")
+    raise RuntimeError("No OPENAI_API_KEYS/OPENAI_API_KEY configured")
+
+async def stream_with_openai(instruction: str, text: str, timeout: float = None):
+    """Like `process_with_openai`, but yields the output as it is generated."""
+    tried = set()
+    last_err = None
+    tokens = _expected_tokens(instruction, text)
+    for _ in range(max(1, OPENAI_KEYS.counts())):
+        key = await OPENAI_KEYS.acquire(tokens, exclude=tried)
+        if not key: break
+        tried.add(key)
+        client = OPENAI_CLIENTS.get(key)
+        outcome = "cancelled"
+        try:
+            try:
+                stream = await client.chat.completions.create(
+                    model=OPENAI_MODEL,
+                    messages=_build_messages(instruction, text),
+                    temperature=0.2,
+                    timeout=timeout,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+            except Exception as e:
+                msg = str(e); last_err = e
+                if _is_quota_error(msg):
+                    OPENAI_KEYS.release(key, "throttled", _retry_after(e))
+                    outcome = None
+                    continue
+                outcome = "error"
+                raise
+            outcome = "error"
+            try:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+                    if chunk.usage:
+                        # آخرین تکه‌ی stream، بدون choices
+                        record_usage(chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+            except (GeneratorExit, asyncio.CancelledError):
+                outcome = "cancelled"
+                raise
+            outcome = "ok"
+            return
+        finally:
+            if outcome:
+                OPENAI_KEYS.release(key, outcome)
     if last_err: raise last_err
+    if OPENAI_KEYS.counts():
+        # «rate limit» در پیام: queue_manager آن را خطای سهمیه می‌بیند و failover می‌کند
+        raise RuntimeError("rate limit: all OpenAI keys are cooling down")
     raise RuntimeError("No OPENAI_API_KEYS/OPENAI_API_KEY configured")
@@ -0,0 +1,64 @@
+import io
+import os
+import asyncio
+from ..database_async import get_profile_pic_uid, set_profile_pic_uid
+from .upload_to_supabase_s3 import upload_fileobj_to_s3
+
+# حداکثر آپلود همزمان به S3
+PROFILE_PHOTO_CONCURRENCY = int(os.getenv("PROFILE_PHOTO_CONCURRENCY", "4"))
+PROFILE_PHOTO_STOP_TIMEOUT = float(os.getenv("PROFILE_PHOTO_STOP_TIMEOUT", "10"))
+
+class ProfilePhotoSync:
+    """Copies users' profile photos to S3 in the background.
+
+    The photo goes Telegram -> BytesIO -> S3 without touching the disk; the
+    boto3 upload runs in a thread. A photo whose `file_unique_id` matches the
+    one stored for the user is skipped.
+    """
+    def __init__(self, concurrency: int = PROFILE_PHOTO_CONCURRENCY):
+        self._sem = asyncio.Semaphore(max(1, concurrency))
+        self._tasks = set()
+        self._pending = set()
+        self.logger = None
+        self.uploaded = 0
+        self.skipped = 0
+
+    def schedule(self, bot, user_id: int):
+        # برای هر کاربر فقط یک sync همزمان
+        if user_id in self._pending:
+            return
+        self._pending.add(user_id)
+        task = asyncio.create_task(self._sync(bot, user_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _sync(self, bot, user_id: int):
+        try:
+            photos = await bot.get_user_profile_photos(user_id, limit=1)
+            if not photos.total_count:
+                return
+            photo = photos.photos[0][-1]
+            if await get_profile_pic_uid(user_id) == photo.file_unique_id:
+                self.skipped += 1
+                return
+            async with self._sem:
+                buffer = io.BytesIO()
+                await bot.download(photo.file_id, destination=buffer)
+                buffer.seek(0)
+                await asyncio.to_thread(upload_fileobj_to_s3, buffer, f"profile_pics/{user_id}.jpg")
+            await set_profile_pic_uid(user_id, photo.file_unique_id)
+            self.uploaded += 1
+        except Exception as e:
+            if self.logger: self.logger.warning(f"Profile photo sync for {user_id} failed: {e}")
+            else: print(f"⚠️ Failed to fetch profile picture: {e}")
+        finally:
+            self._pending.discard(user_id)
+
+    async def stop(self, timeout: float = PROFILE_PHOTO_STOP_TIMEOUT):
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+
+PROFILE_PHOTOS = ProfilePhotoSync()
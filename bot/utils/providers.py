@@ -0,0 +1,100 @@
+import os
+import time
+import asyncio
+from .openai_api import OPENAI_MODEL, process_with_openai, stream_with_openai
+from .gemini_api import GEMINI_MODEL, process_with_gemini, stream_with_gemini
+from .key_manager import OPENAI_KEYS, GEMINI_KEYS
+from .metrics import PROVIDER_LATENCY, KEY_REQUESTS, KEY_IN_FLIGHT, KEY_COOLDOWN, add_collector
+
+# سقف زمان هر درخواست به موتور (ثانیه)
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "120"))
+
+PROVIDERS = {
+    "openai": process_with_openai,
+    "gemini": process_with_gemini,
+}
+
+STREAMERS = {
+    "openai": stream_with_openai,
+    "gemini": stream_with_gemini,
+}
+
+PROVIDER_KEYS = {
+    "openai": OPENAI_KEYS,
+    "gemini": GEMINI_KEYS,
+}
+
+def provider_model(provider: str) -> str:
+    return OPENAI_MODEL if provider == "openai" else GEMINI_MODEL
+
+def key_count(provider: str) -> int:
+    keys = PROVIDER_KEYS.get(provider)
+    return keys.counts() if keys else 0
+
+def _outcome(e) -> str:
+    m = str(e).lower()
+    if "429" in m or "quota" in m or "rate limit" in m or "resource exhausted" in m:
+        return "throttled"
+    return "error"
+
+async def run_provider(provider: str, instruction: str, text: str, timeout: float = None) -> str:
+    """Run one edit on `provider` without blocking the event loop.
+
+    Unknown provider names fall back to gemini, like the old `_run()` did.
+    """
+    fn = PROVIDERS.get(provider, process_with_gemini)
+    timeout = timeout or LLM_TIMEOUT_SECONDS
+    t0 = time.perf_counter()
+    outcome = "cancelled"
+    try:
+        out = await asyncio.wait_for(fn(instruction, text, timeout=timeout), timeout)
+        outcome = "ok"
+        return out
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        raise TimeoutError(f"{provider}: no response within {timeout:.0f}s")
+    except Exception as e:
+        outcome = _outcome(e)
+        raise
+    finally:
+        PROVIDER_LATENCY.observe(time.perf_counter() - t0, provider, provider_model(provider), outcome)
+
+async def stream_provider(provider: str, instruction: str, text: str, timeout: float = None):
+    """Yield output deltas from `provider`; the whole stream shares one deadline."""
+    fn = STREAMERS.get(provider, stream_with_gemini)
+    timeout = timeout or LLM_TIMEOUT_SECONDS
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    agen = fn(instruction, text, timeout=timeout)
+    t0 = time.perf_counter()
+    outcome = "cancelled"
+    try:
+        while True:
+            try:
+                delta = await asyncio.wait_for(agen.__anext__(), max(0.0, deadline - loop.time()))
+            except StopAsyncIteration:
+                outcome = "ok"
+                return
+            yield delta
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        raise TimeoutError(f"{provider}: no response within {timeout:.0f}s")
+    except Exception as e:
+        outcome = _outcome(e)
+        raise
+    finally:
+        PROVIDER_LATENCY.observe(time.perf_counter() - t0, provider, provider_model(provider), outcome)
+        await agen.aclose()
+
+@add_collector
+async def _collect_keys():
+    # شمارنده‌ها همان‌هایی است که KeyScheduler نگه می‌دارد؛ در هر scrape کپی می‌شوند
+    for metric in (KEY_REQUESTS, KEY_IN_FLIGHT, KEY_COOLDOWN):
+        metric.clear()
+    for provider, keys in PROVIDER_KEYS.items():
+        for k in keys.stats():
+            KEY_REQUESTS.set(k["successes"], provider, k["key"], "ok")
+            KEY_REQUESTS.set(k["throttles"], provider, k["key"], "throttled")
+            KEY_REQUESTS.set(k["errors"], provider, k["key"], "error")
+            KEY_IN_FLIGHT.set(k["in_flight"], provider, k["key"])
+            KEY_COOLDOWN.set(round(k["cooldown"], 1), provider, k["key"])
@@ -1,10 +1,55 @@
-from .openai_api import process_with_openai
-from .gemini_api import process_with_gemini
+import os
+import time
+import socket
+import asyncio
+from .. import database_async
+from .providers import PROVIDERS, run_provider, stream_provider, key_count, provider_model
+from .concurrency import ResizableLimiter, ProviderStats, CircuitBreaker, provider_capacity
+from .result_cache import RESULT_CACHE
+from .scheduler import job_cost, LANE_NORMAL
+from .token_estimator import estimate, start_usage
+from .job_timing import start_trace, mark
+from .job_writer import JobWriter
+from .metrics import QUEUE_DEPTH, QUEUE_WAIT, JOBS_IN_FLIGHT, JOB_LATENCY, add_collector
+from .chunker import CHUNK_TOKENS, split_text, join_chunks, split_message
+from .stream_writer import StreamingReply
 from ..utils.notification import notify_admin
 
+# تعداد تلاش دوباره برای هر تکه و حداکثر تکه‌های همزمان در یک job
+CHUNK_RETRIES = int(os.getenv("CHUNK_RETRIES", "1"))
+CHUNK_RETRY_BACKOFF = float(os.getenv("CHUNK_RETRY_BACKOFF", "1.0"))
+CHUNK_CONCURRENCY = int(os.getenv("CHUNK_CONCURRENCY", "4"))
+# lease هر job در DB؛ تا وقتی worker زنده است هر lease/3 ثانیه تمدید می‌شود
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# برای jobهایی که process دیگری در DB گذاشته است
+QUEUE_POLL_SECONDS = float(os.getenv("QUEUE_POLL_SECONDS", "2"))
+# اندازه‌ی pool ورکرها بین این دو حد، بر اساس تعداد کلیدها و سلامت موتورها
+QUEUE_MIN_WORKERS = int(os.getenv("QUEUE_MIN_WORKERS", "1"))
+QUEUE_MAX_WORKERS = int(os.getenv("QUEUE_MAX_WORKERS", "20"))
+AUTOSCALE_INTERVAL = float(os.getenv("AUTOSCALE_INTERVAL", "15"))
+# نمایش تدریجی خروجی با edit پیام (فقط برای متن‌هایی که تکه‌تکه نمی‌شوند)
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "0").lower() in {"1", "true", "yes"}
+# hedging: اگر موتور اول تا p95 خودش جواب نداد، همان تکه به موتور دوم هم فرستاده می‌شود
+HEDGE_REQUESTS = os.getenv("HEDGE_REQUESTS", "0").lower() in {"1", "true", "yes"}
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_SECONDS = float(os.getenv("HEDGE_MIN_SECONDS", "2"))
+
+def _is_quota_like(msg: str) -> bool:
+    if not msg:
+        return False
+    m = msg.lower()
+    return ("rate limit" in m) or ("quota" in m) or ("insufficient_quota" in m) or ("429" in m) or ("resource exhausted" in m)
+
+@add_collector
+async def _collect_queue_depth():
+    depth = await database_async.queue_depth()
+    for status in ("pending", "processing"):
+        QUEUE_DEPTH.set(depth.get(status, 0), status)
+
 class Job:
     def __init__(self, job_id: int, user, text: str, instruction: str,
-                 first_provider: str, bot, chat_id: int, logger, db_update_job):
+                 first_provider: str, bot, chat_id: int, logger, db_update_job, chunk_tokens: int = None):
         self.job_id = job_id
         self.user = user
         self.text = text
@@ -14,93 +59,476 @@ class Job:
         self.chat_id = chat_id
         self.logger = logger
         self.db_update_job = db_update_job
+        self.chunk_tokens = chunk_tokens or CHUNK_TOKENS
 
 class QueueManager:
-    def __init__(self, workers: int = 3):
-        import asyncio
-        self.queue = asyncio.Queue()
-        self.workers = workers
-        self._workers = []
+    """Workers that consume the `jobs` table.
+
+    Jobs are inserted with their payload by `enqueue()` and claimed atomically
+    with a lease, so several processes can share one DB and a restart only
+    delays queued jobs instead of dropping them.
+
+    The pool resizes itself between `min_workers` and `max_workers` from the
+    live key counts and provider health; each provider also has its own
+    concurrency limit so a slow one cannot hold every worker. Passing
+    `workers` pins the pool to a fixed size.
+
+    A circuit breaker per provider sends work straight to the other one
+    while a provider keeps failing; with `hedge` on, a chunk that has not
+    come back by the provider's p95 latency is also sent to the fallback
+    and the first answer wins.
+    """
+    def __init__(self, workers: int = None, runner=None, streamer=None, stream: bool = STREAM_RESPONSES,
+                 cache=RESULT_CACHE, store=None, min_workers: int = QUEUE_MIN_WORKERS,
+                 max_workers: int = QUEUE_MAX_WORKERS, hedge: bool = HEDGE_REQUESTS):
+        if workers is not None:
+            min_workers = max_workers = workers
+        self.min_workers = min_workers
+        self.max_workers = max(min_workers, max_workers)
+        self.workers = min_workers
+        self._workers = set()
+        self._excess = 0
+        self._heartbeat = None
+        self._autoscaler = None
+        self.stats = ProviderStats()
+        self.breaker = CircuitBreaker()
+        self.hedge = hedge
+        self.limits = {p: ResizableLimiter(1) for p in PROVIDERS}
+        self._wakeup = asyncio.Event()
+        self._stopping = False
         self.logger = None
+        self.bot = None
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        # idهای jobهایی که این پروسه همین الان اجرا می‌کند؛ heartbeat فقط lease همین‌ها را تمدید می‌کند
+        self.leased = set()
+        # runner(provider, instruction, text) -> str ; قابل تعویض برای بنچمارک
+        self.runner = runner or run_provider
+        # streamer(provider, instruction, text) -> async iterator of str
+        self.streamer = streamer or stream_provider
+        self.stream = stream
+        # cache=None یعنی بدون کش نتایج
+        self.cache = cache
+        # store: enqueue_job / claim_job / heartbeat_jobs / reclaim_expired_jobs / update_job(s)
+        self.store = store or database_async
+        # وضعیت نهایی jobها با تأخیر کوتاه و دسته‌ای نوشته می‌شود
+        self.writer = JobWriter(self.store)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.leased)
 
     def set_logger(self, logger):
         self.logger = logger
 
-    async def start(self):
-        import asyncio
-        for _ in range(self.workers):
-            self._workers.append(asyncio.create_task(self.worker()))
+    async def start(self, bot):
+        self.bot = bot
+        self._stopping = False
+        self.writer.start(self.logger)
+        await self._reclaim()
+        await self._autoscale()
+        self._spawn(self.workers)
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+        self._autoscaler = asyncio.create_task(self._autoscale_loop())
 
     async def stop(self):
-        for _ in self._workers:
-            await self.queue.put(None)
-        import asyncio
+        # jobهای در حال اجرا تمام می‌شوند؛ بقیه در DB می‌مانند
+        self._stopping = True
+        self._wakeup.set()
+        for task in (self._heartbeat, self._autoscaler):
+            if task is not None:
+                task.cancel()
         await asyncio.gather(*self._workers)
+        for task in (self._heartbeat, self._autoscaler):
+            if task is not None:
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._heartbeat = self._autoscaler = None
+        await self.writer.stop()
 
-    async def enqueue(self, job: Job):
-        await self.queue.put(job)
+    def _spawn(self, n: int):
+        for _ in range(n):
+            task = asyncio.create_task(self.worker())
+            self._workers.add(task)
+            task.add_done_callback(self._workers.discard)
 
-    async def worker(self):
-        while True:
-            job = await self.queue.get()
-            if job is None:
-                break
-            await self.process(job)
-            self.queue.task_done()
+    def _resize(self, target: int):
+        current = len(self._workers) - self._excess
+        if target > current:
+            # اول ورکرهایی که قرار بود بروند را نگه دار
+            keep = min(self._excess, target - current)
+            self._excess -= keep
+            self._spawn(target - current - keep)
+        elif target < current:
+            # ورکرهای اضافه بعد از تمام کردن job فعلی خارج می‌شوند
+            self._excess += current - target
+            self._wakeup.set()
+        self.workers = target
 
-    # ---------------- core logic: send edited text, smart failover ----------------
-    async def process(self, job: Job):
-        def _is_quota_like(msg: str) -> bool:
-            if not msg:
-                return False
-            m = msg.lower()
-            return ("rate limit" in m) or ("quota" in m) or ("insufficient_quota" in m) or ("429" in m) or ("resource exhausted" in m)
-
-        def _run(provider: str) -> str:
-            if provider == "openai":
-                return process_with_openai(job.instruction, job.text)
+    async def _autoscale(self):
+        total = 0
+        for provider, limiter in self.limits.items():
+            cap = provider_capacity(key_count(provider), self.stats.summary(provider))
+            if cap != limiter.limit:
+                if self.logger: self.logger.info(f"{provider} concurrency {limiter.limit} -> {cap}")
+                await limiter.set_limit(cap)
+            total += cap
+        target = max(self.min_workers, min(self.max_workers, total))
+        if target != self.workers:
+            if self.logger: self.logger.info(f"Worker pool {self.workers} -> {target}")
+            if self._workers:
+                self._resize(target)
             else:
-                return process_with_gemini(job.instruction, job.text)
+                self.workers = target
+
+    async def _autoscale_loop(self):
+        while True:
+            await asyncio.sleep(AUTOSCALE_INTERVAL)
+            try:
+                await self._autoscale()
+            except Exception as e:
+                if self.logger: self.logger.error(f"Autoscale failed: {e}")
 
-        # mark processing in DB
+    def describe(self) -> dict:
+        return {
+            "workers": len(self._workers) - self._excess,
+            "target": self.workers,
+            "min": self.min_workers,
+            "max": self.max_workers,
+            "in_flight": self.in_flight,
+            "providers": {p: (l.in_use, l.limit) for p, l in self.limits.items()},
+            "circuits": {p: self.breaker.state(p) for p in self.limits},
+            "pending_writes": len(self.writer),
+        }
+
+    def estimate(self, text: str, instruction: str):
+        """Token estimate with this manager's chunk size and chunk concurrency."""
+        return estimate(text, instruction, CHUNK_TOKENS, CHUNK_CONCURRENCY)
+
+    async def enqueue(self, user_id, chat_id: int, text: str, instruction: str, provider: str,
+                      lane: int = LANE_NORMAL, est=None) -> int:
+        # موتور ناشناخته همان gemini است (مثل run_provider)
+        if provider not in PROVIDERS:
+            provider = "gemini"
+        est = est or self.estimate(text, instruction)
+        job_id = await self.store.enqueue_job(user_id, provider, chat_id, text, instruction,
+                                              lane=lane, cost=job_cost(est.prompt_tokens),
+                                              est_tokens_in=est.prompt_tokens, est_tokens_out=est.output_tokens,
+                                              chunk_tokens=est.chunk_tokens, t_enqueue=time.time())
+        self._wakeup.set()
+        return job_id
+
+    async def _reclaim(self):
+        try:
+            n = await self.store.reclaim_expired_jobs(JOB_MAX_ATTEMPTS)
+            if n and self.logger: self.logger.info(f"Reclaimed {n} jobs with expired leases")
+        except Exception as e:
+            if self.logger: self.logger.error(f"Reclaiming jobs failed: {e}")
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                if self.leased:
+                    await self.store.heartbeat_jobs(self.worker_id, JOB_LEASE_SECONDS, self.leased)
+            except Exception as e:
+                if self.logger: self.logger.error(f"Job heartbeat failed: {e}")
+            # jobهای worker‌هایی که مرده‌اند
+            await self._reclaim()
+
+    async def _claim(self):
+        # فقط jobهای موتورهایی که ظرفیت خالی دارند
+        providers = [p for p, l in self.limits.items() if l.available > 0]
+        if not providers:
+            return None
         try:
-            job.db_update_job(job.job_id, status="processing")
-        except Exception:
-            pass
+            return await self.store.claim_job(self.worker_id, JOB_LEASE_SECONDS, providers)
+        except Exception as e:
+            if self.logger: self.logger.error(f"Claiming job failed: {e}")
+            return None
+
+    async def worker(self):
+        while not self._stopping:
+            if self._excess > 0:
+                self._excess -= 1
+                return
+            row = await self._claim()
+            if row is None:
+                # clear و بعد دوباره claim تا enqueue بین این دو گم نشود
+                self._wakeup.clear()
+                row = await self._claim()
+            if row is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), QUEUE_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
 
+            job = Job(row["id"], None, row["text"], row["instruction"], row["provider"],
+                      self.bot, row["chat_id"], self.logger, self.writer.update, row["chunk_tokens"])
+            waited = float(row["waited"] or 0)
+            QUEUE_WAIT.observe(waited, job.first_provider)
+            status, provider = "error", job.first_provider
+            t0 = time.monotonic()
+            self.leased.add(job.job_id)
+            JOBS_IN_FLIGHT.inc()
+            try:
+                status, provider = await self.process(job)
+            except Exception as e:
+                if self.logger: self.logger.exception(f"Job {job.job_id} crashed: {e}")
+                # وگرنه ردیف در processing می‌ماند و بعد از reclaim دوباره به LLM می‌رود
+                try:
+                    await job.db_update_job(job.job_id, status="error", error_message=str(e))
+                except Exception as e2:
+                    if self.logger: self.logger.error(f"Job {job.job_id}: recording the crash failed: {e2}")
+            finally:
+                self.leased.discard(job.job_id)
+                JOBS_IN_FLIGHT.dec()
+                JOB_LATENCY.observe(waited + time.monotonic() - t0, provider, provider_model(provider), status)
+
+    # ---------------- core logic: send edited text, smart failover ----------------
+    async def process(self, job: Job):
+        """Edit and deliver one claimed job; returns (status, provider that answered)."""
+        # status=processing را claim_job گذاشته است
         primary = job.first_provider
         fallback = "gemini" if primary == "openai" else "openai"
+        tried, used = set(), set()
+        # مصرف واقعی توکن، کنار تخمین est_tokens_* در همان ردیف
+        usage = start_usage()
+        # زمان مراحل برای /latency؛ همراه وضعیت نهایی در یک update نوشته می‌شود
+        trace = start_trace()
+
+        cached = await self._cache_get(job, primary)
+        if cached is not None:
+            if self.logger: self.logger.info(f"Job {job.job_id}: result cache hit")
+            await self._deliver(job, cached)
+            mark("t_delivered")
+            await job.db_update_job(job.job_id, status="done", provider=primary, retry_count=0,
+                                    model=provider_model(primary), **trace)
+            return "done", primary
+
+        chunks = split_text(job.text, job.chunk_tokens)
+        reply = None
 
-        # try primary
         try:
             if self.logger: self.logger.info(f"Processing job {job.job_id} with {primary}")
-            out = _run(primary) or ""
-            # تلگرام حداکثر 4096 کاراکتر پیام؛ ما کمی کمتر می‌فرستیم
-            await job.bot.send_message(job.chat_id, out[:4000] if out.strip() else "✅ پردازش انجام شد.")
-            job.db_update_job(job.job_id, status="done", provider=primary, retry_count=0)
+            if self.stream and len(chunks) == 1:
+                reply = StreamingReply(job.bot, job.chat_id)
+                await self._stream(job, reply, primary, fallback, tried, used)
+            else:
+                out = await self._edit(job, chunks, primary, fallback, tried, used)
+        except Exception as e:
+            msg = str(e)
+            if self.logger: self.logger.error(f"Job {job.job_id} failed: {msg}")
+            if fallback in tried:
+                err = f"❌ پردازش انجام نشد — {msg[:300]}"
+            else:
+                err = f"❌ پردازش با موتور «{primary}» انجام نشد — {msg[:300]}"
+            if reply is not None:
+                await reply.finish(note=f"\n\n{err}" if reply.received else "", empty_text=err)
+            else:
+                await job.bot.send_message(job.chat_id, err)
+            await notify_admin(job.bot, f"Job {job.job_id} failed ({', '.join(sorted(tried))}): {msg}")
+            await job.db_update_job(job.job_id, status="error", error_message=msg,
+                                    tokens_in=usage["prompt"], tokens_out=usage["output"], **trace)
+            return "error", primary
+
+        note = ""
+        if fallback in used:
+            if primary in used:
+                note = f"\n\nℹ️ به‌دلیل محدودیت یا کندی موتور {primary}، بخشی از متن با {fallback} انجام شد."
+            else:
+                note = f"\n\nℹ️ به‌دلیل محدودیت یا کندی موتور {primary}، با {fallback} انجام شد."
+            await notify_admin(job.bot, f"Job {job.job_id} failed over from {primary} to {fallback}")
+        if reply is not None:
+            await reply.finish(note)
+            out = reply.text
+        else:
+            await self._deliver(job, out, note)
+        mark("t_delivered")
+        if len(used) == 1:
+            await self._cache_put(job, next(iter(used)), out)
+        final = primary if primary in used else fallback
+        await job.db_update_job(
+            job.job_id, status="done",
+            provider=final,
+            retry_count=1 if fallback in used else 0,
+            tokens_in=usage["prompt"], tokens_out=usage["output"],
+            model=provider_model(final), **trace,
+        )
+        return "done", final
+
+    async def _cache_get(self, job: Job, provider: str):
+        if self.cache is None:
+            return None
+        try:
+            return await self.cache.get(job.text, job.instruction, provider, provider_model(provider))
+        except Exception as e:
+            if self.logger: self.logger.warning(f"Result cache read failed: {e}")
+            return None
+
+    async def _cache_put(self, job: Job, provider: str, out: str):
+        if self.cache is None:
             return
-        except Exception as e1:
-            msg1 = str(e1)
-            if self.logger: self.logger.error(f"Job {job.job_id} failed on {primary}: {msg1}")
-            await notify_admin(job.bot, f"Job {job.job_id} failed on fallback {primary}: {msg1}")
-
-            # فقط وقتی شبیه خطای سهمیه است، به موتور دوم سوئیچ کن
-            if not _is_quota_like(msg1):
-                await job.bot.send_message(job.chat_id, f"❌ پردازش با موتور «{primary}» انجام نشد — {msg1[:300]}")
-                job.db_update_job(job.job_id, status="error", error_message=msg1)
-                return
+        try:
+            await self.cache.put(job.text, job.instruction, provider, provider_model(provider), out)
+        except Exception as e:
+            if self.logger: self.logger.warning(f"Result cache write failed: {e}")
+
+    async def _edit(self, job: Job, chunks, primary: str, fallback: str, tried: set, used: set) -> str:
+        """Edit `job.text` as `chunks` (from `split_text`) that run concurrently."""
+        if len(chunks) > 1 and self.logger:
+            self.logger.info(f"Job {job.job_id}: {len(chunks)} chunks")
+        sem = asyncio.Semaphore(max(1, min(CHUNK_CONCURRENCY, key_count(primary))))
+
+        async def one(text):
+            async with sem:
+                return await self._edit_chunk(job, text, primary, fallback, tried, used)
 
-            # try fallback
+        tasks = [asyncio.create_task(one(text)) for text, _ in chunks]
+        try:
+            outs = await asyncio.gather(*tasks)
+        except BaseException:
+            for t in tasks:
+                t.cancel()
+            raise
+        return join_chunks(outs, chunks)
+
+    def _skip(self, primary: str, fallback: str) -> bool:
+        # مدار موتور اول باز است و موتور دوم سالم
+        return not self.breaker.allow(primary) and self.breaker.state(fallback) == "closed"
+
+    async def _edit_chunk(self, job: Job, text: str, primary: str, fallback: str, tried: set, used: set) -> str:
+        if self._skip(primary, fallback):
+            if self.logger: self.logger.info(f"Job {job.job_id}: circuit for {primary} is open, using {fallback}")
+        else:
+            # خطاهای گذرا: همین تکه دوباره امتحان می‌شود، نه کل متن
+            for attempt in range(CHUNK_RETRIES + 1):
+                tried.add(primary)
+                try:
+                    provider, out = await self._attempt(job, text, primary, fallback, tried)
+                    used.add(provider)
+                    return out
+                except Exception as e:
+                    msg = str(e)
+                    if self.logger: self.logger.error(f"Job {job.job_id} failed on {primary}: {msg}")
+                    # خطای سهمیه، یا موتوری که مدارش باز شده: سوئیچ به موتور دوم
+                    if _is_quota_like(msg) or self.breaker.state(primary) != "closed":
+                        break
+                    if attempt >= CHUNK_RETRIES:
+                        raise
+                    await asyncio.sleep(CHUNK_RETRY_BACKOFF * (2 ** attempt))
+
+        if self.logger: self.logger.info(f"Failover job {job.job_id} to {fallback}")
+        tried.add(fallback)
+        out = await self._call(fallback, job.instruction, text) or ""
+        used.add(fallback)
+        return out
+
+    def _hedge_delay(self, primary: str, fallback: str):
+        if not self.hedge or self.breaker.state(fallback) != "closed":
+            return None
+        s = self.stats.summary(primary)
+        if s["count"] < HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_SECONDS, s["p95"])
+
+    async def _attempt(self, job: Job, text: str, primary: str, fallback: str, tried: set):
+        """One call on `primary`, hedged on `fallback` if it runs past p95. Returns (provider, out)."""
+        delay = self._hedge_delay(primary, fallback)
+        if delay is None:
+            return primary, await self._call(primary, job.instruction, text) or ""
+        tasks = {asyncio.create_task(self._call(primary, job.instruction, text)): primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                if self.logger: self.logger.info(f"Job {job.job_id}: {primary} slower than {delay:.1f}s, hedging on {fallback}")
+                tried.add(fallback)
+                tasks[asyncio.create_task(self._call(fallback, job.instruction, text))] = fallback
+            pending, errors = set(tasks), {}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    if t.exception() is None:
+                        return tasks[t], t.result() or ""
+                    errors[tasks[t]] = t.exception()
+            raise errors.get(primary) or errors[fallback]
+        finally:
+            for t in tasks:
+                t.cancel()
+
+    def _cancelled(self, provider: str, t0):
+        # قطع در حین انتظار برای limiter هم باید جای probe مدار را آزاد کند
+        if t0 is not None:
+            self.stats.record_censored(provider, time.monotonic() - t0)
+        self.breaker.record(provider, None)
+
+    async def _call(self, provider: str, instruction: str, text: str) -> str:
+        t0 = None
+        try:
+            async with self.limits[provider]:
+                t0 = time.monotonic()
+                mark("t_provider_start", first=True)
+                try:
+                    out = await self.runner(provider, instruction, text)
+                except Exception as e:
+                    mark("t_provider_end")
+                    self.stats.record(provider, time.monotonic() - t0, throttled=_is_quota_like(str(e)))
+                    self.breaker.record(provider, False)
+                    raise
+                # بدون stream اولین بایت همان اولین تکه‌ی برگشته است
+                mark("t_first_byte", first=True)
+                mark("t_provider_end")
+                self.stats.record(provider, time.monotonic() - t0)
+                self.breaker.record(provider, True)
+                return out
+        except asyncio.CancelledError:
+            self._cancelled(provider, t0)
+            raise
+
+    async def _stream(self, job: Job, reply: StreamingReply, primary: str, fallback: str, tried: set, used: set):
+        await reply.start()
+        order = (primary, fallback)
+        if self._skip(primary, fallback):
+            if self.logger: self.logger.info(f"Job {job.job_id}: circuit for {primary} is open, using {fallback}")
+            order = (fallback,)
+        for provider in order:
+            tried.add(provider)
+            t0 = None
             try:
-                if self.logger: self.logger.info(f"Failover job {job.job_id} to {fallback}")
-                out = _run(fallback) or ""
-                note = f"\n\nℹ️ به‌دلیل محدودیت در موتور {primary}، با {fallback} انجام شد."
-                await job.bot.send_message(job.chat_id, (out[:4000] + note) if out.strip() else ("✅ پردازش انجام شد." + note))
-                job.db_update_job(job.job_id, status="done", provider=fallback, retry_count=1)
+                async with self.limits[provider]:
+                    t0 = time.monotonic()
+                    mark("t_provider_start", first=True)
+                    try:
+                        async for delta in self.streamer(provider, job.instruction, job.text):
+                            mark("t_first_byte", first=True)
+                            await reply.feed(delta)
+                    except Exception as e:
+                        mark("t_provider_end")
+                        self.stats.record(provider, time.monotonic() - t0, throttled=_is_quota_like(str(e)))
+                        self.breaker.record(provider, False)
+                        raise
+                    mark("t_provider_end")
+                    self.stats.record(provider, time.monotonic() - t0)
+                    self.breaker.record(provider, True)
+                used.add(provider)
                 return
-            except Exception as e2:
-                msg2 = str(e2)
-                if self.logger: self.logger.error(f"Job {job.job_id} failed on fallback {fallback}: {msg2}")
-                await job.bot.send_message(job.chat_id, f"❌ پردازش انجام نشد — {msg2[:300]}")
-                await notify_admin(job.bot, f"Job {job.job_id} failed on fallback {fallback}: {msg2}")
-                job.db_update_job(job.job_id, status="error", error_message=msg2)
+            except asyncio.CancelledError:
+                self._cancelled(provider, t0)
+                raise
+            except Exception as e:
+                msg = str(e)
+                if self.logger: self.logger.error(f"Job {job.job_id} failed on {provider}: {msg}")
+                # بعد از رسیدن اولین تکه دیگر نمی‌شود موتور را عوض کرد
+                if reply.received or provider == fallback:
+                    raise
+                if not _is_quota_like(msg) and self.breaker.state(provider) == "closed":
+                    raise
+                if self.logger: self.logger.info(f"Failover job {job.job_id} to {fallback}")
+
+    async def _deliver(self, job: Job, out: str, note: str = ""):
+        text = (out if out.strip() else "✅ پردازش انجام شد.") + note
+        # تلگرام حداکثر 4096 کاراکتر پیام؛ متن بلند در چند پیام پشت سر هم
+        for part in split_message(text):
+            await job.bot.send_message(job.chat_id, part)
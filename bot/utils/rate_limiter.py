@@ -0,0 +1,86 @@
+import os
+import time
+from collections import OrderedDict
+from .. import database_async
+
+# memory: هر process جدا (پیش‌فرض) | db: مشترک بین همه‌ی instanceها از جدول rate_limits
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+# چند درخواست پشت سر هم مجاز است قبل از اینکه فاصله‌ی rate_limit_seconds اعمال شود
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "1"))
+# فاصله‌ی ادمین‌ها؛ 0 یعنی بدون محدودیت
+RATE_LIMIT_ADMIN_SECONDS = float(os.getenv("RATE_LIMIT_ADMIN_SECONDS", "0"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "50000"))
+RATE_LIMIT_PRUNE_SECONDS = int(os.getenv("RATE_LIMIT_PRUNE_SECONDS", "600"))
+
+TIER_NORMAL = "normal"
+TIER_ADMIN = "admin"
+
+# هر دو backend الگوریتم GCRA دارند (معادل token bucket با یک عدد برای هر کاربر):
+# tat = زمانی که bucket دوباره پر می‌شود. درخواست مجاز است اگر
+# tat - interval * (burst - 1) <= now و بعد tat = max(tat, now) + interval.
+# کاربری که tat او گذشته هیچ اطلاعاتی ندارد و می‌شود پاکش کرد.
+
+class MemoryRateBackend:
+    """Per-process GCRA state; bounded LRU that drops idle users first."""
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._tat = OrderedDict()
+
+    async def hit(self, key: str, interval: float, burst: int) -> float:
+        now = time.time()
+        tat = max(self._tat.get(key, now), now)
+        wait = tat - interval * (burst - 1) - now
+        if wait > 0:
+            return wait
+        self._tat[key] = tat + interval
+        self._tat.move_to_end(key)
+        if len(self._tat) > self.max_keys:
+            await self.prune()
+            while len(self._tat) > self.max_keys:
+                self._tat.popitem(last=False)
+        return 0.0
+
+    async def prune(self) -> int:
+        now = time.time()
+        idle = [k for k, tat in self._tat.items() if tat <= now]
+        for k in idle:
+            del self._tat[k]
+        return len(idle)
+
+    def __len__(self):
+        return len(self._tat)
+
+class DBRateBackend:
+    """GCRA state in the `rate_limits` table, so the limit holds across processes."""
+    def __init__(self, prune_every: int = RATE_LIMIT_PRUNE_SECONDS):
+        self.prune_every = prune_every
+        self._pruned_at = time.time()
+
+    async def hit(self, key: str, interval: float, burst: int) -> float:
+        wait = await database_async.rate_limit_hit(key, interval, burst)
+        if time.time() - self._pruned_at > self.prune_every:
+            self._pruned_at = time.time()
+            await self.prune()
+        return wait
+
+    async def prune(self) -> int:
+        return await database_async.prune_rate_limits()
+
+class RateLimiter:
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def check(self, user_id, interval: float, tier: str = TIER_NORMAL) -> float:
+        """Take one request from `user_id`'s allowance; returns 0 or the seconds left to wait."""
+        if tier == TIER_ADMIN:
+            interval = RATE_LIMIT_ADMIN_SECONDS
+        if interval <= 0:
+            return 0.0
+        return await self.backend.hit(f"user:{user_id}", interval, max(1, RATE_LIMIT_BURST))
+
+def _make_backend():
+    if RATE_LIMIT_BACKEND == "db":
+        return DBRateBackend()
+    return MemoryRateBackend()
+
+RATE_LIMITER = RateLimiter(_make_backend())
@@ -0,0 +1,129 @@
+import os
+import re
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+# کنار DB اصلی در پوشه‌ی data ذخیره می‌شود
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", os.path.join(BASE_DIR, "data", "result_cache.db"))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "20000"))
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+
+# فقط فاصله‌ی افقی؛ خط‌ها و پاراگراف‌ها بخشی از ساختار متن‌اند و خروجی همان ساختار را دارد
+_HWS = re.compile(r"[^\S\n]+")
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFC", text or "").replace("\r\n", "\n")
+    return "\n".join(_HWS.sub(" ", line).rstrip() for line in text.split("\n"))
+
+def cache_key(text: str, instruction: str, provider: str, model: str) -> str:
+    h = hashlib.sha256()
+    for part in (_normalize(text), _normalize(instruction), provider or "", model or ""):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+class ResultCache:
+    """Persistent cache of edit results keyed by (text, instruction, provider, model).
+
+    Lives in its own SQLite file; entries expire after `ttl` seconds and the
+    least recently used ones are evicted above `max_entries`. Hit/miss
+    counts are kept in the same file, so every process using it (ingress,
+    workers) sees the same totals.
+    """
+    def __init__(self, path: str, max_entries: int, ttl: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._conn = None
+        self._lock = threading.Lock()
+        self._puts = 0
+
+    def _db(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS result_cache (
+                key TEXT PRIMARY KEY,
+                output TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_hit REAL NOT NULL
+            )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_result_cache_last_hit ON result_cache(last_hit)")
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS result_cache_stats (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )""")
+            self._conn = conn
+        return self._conn
+
+    def _get(self, key: str):
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT output, created_at FROM result_cache WHERE key=?", (key,)).fetchone()
+            if row is not None and row[1] < now - self.ttl:
+                db.execute("DELETE FROM result_cache WHERE key=?", (key,))
+                row = None
+            if row is not None:
+                db.execute("UPDATE result_cache SET last_hit=? WHERE key=?", (now, key))
+            db.execute("""
+                INSERT INTO result_cache_stats(name, value) VALUES(?, 1)
+                ON CONFLICT(name) DO UPDATE SET value = value + 1
+            """, ("misses" if row is None else "hits",))
+            return row[0] if row is not None else None
+
+    def _put(self, key: str, output: str):
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO result_cache(key, output, created_at, last_hit) VALUES(?,?,?,?)",
+                (key, output, now, now),
+            )
+            self._puts += 1
+            if self._puts % 100 == 0:
+                self._evict(db, now)
+
+    def _evict(self, db, now: float):
+        db.execute("DELETE FROM result_cache WHERE created_at < ?", (now - self.ttl,))
+        db.execute("""
+            DELETE FROM result_cache WHERE key IN (
+                SELECT key FROM result_cache ORDER BY last_hit DESC LIMIT -1 OFFSET ?
+            )""", (self.max_entries,))
+
+    async def get(self, text: str, instruction: str, provider: str, model: str):
+        return await asyncio.to_thread(self._get, cache_key(text, instruction, provider, model))
+
+    async def put(self, text: str, instruction: str, provider: str, model: str, output: str):
+        if not output or not output.strip():
+            return
+        await asyncio.to_thread(self._put, cache_key(text, instruction, provider, model), output)
+
+    def _stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._db().execute("SELECT name, value FROM result_cache_stats").fetchall())
+        hits, misses = counts.get("hits", 0), counts.get("misses", 0)
+        total = hits + misses
+        return {"hits": hits, "misses": misses, "hit_rate": (hits / total) if total else 0.0}
+
+    async def stats(self) -> dict:
+        """Totals over every process sharing the cache file."""
+        return await asyncio.to_thread(self._stats)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+RESULT_CACHE = ResultCache(RESULT_CACHE_PATH, RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL)
@@ -0,0 +1,20 @@
+import os
+
+# ترتیب jobها در صف: هر کاربر به نوبت (fair queueing) و متن کوتاه زودتر.
+#
+# هر job یک sched_key می‌گیرد = max(سر صف، آخرین job در انتظار همین کاربر) + cost
+# و workerها به ترتیب (lane نزولی، sched_key، id) برمی‌دارند. پس کاربری که ده متن
+# بلند فرستاده فقط سهم خودش را می‌گیرد و متن ۳۰ کلمه‌ای نفر بعدی پشت آن‌ها نمی‌ماند.
+
+# هزینه‌ی ثابت هر job تا متن‌های خیلی کوتاه هم بی‌هزینه نباشند (بر حسب توکن)
+SCHED_BASE_COST = float(os.getenv("SCHED_BASE_COST", "200"))
+
+LANE_NORMAL = 0
+# lane ادمین‌ها؛ همیشه قبل از بقیه برداشته می‌شود
+LANE_ADMIN = 1
+
+def job_cost(prompt_tokens: int) -> float:
+    return SCHED_BASE_COST + prompt_tokens
+
+def lane_for(user_id, admins) -> int:
+    return LANE_ADMIN if user_id in admins else LANE_NORMAL
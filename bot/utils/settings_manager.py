@@ -1,18 +1,78 @@
-from ..database import get_setting
+import os
+import time
+import asyncio
+from ..database_async import get_all_settings, set_setting
+from .token_estimator import max_tokens_for
+
+# هر چند ثانیه یکبار از DB دوباره خوانده شود تا چند instance همگرا شوند
+SETTINGS_TTL_SECONDS = int(os.getenv("SETTINGS_TTL_SECONDS", "300"))
+
+class SettingsCache:
+    """In-memory copy of the `settings` table.
+
+    Loaded once at startup, refreshed every `ttl` seconds in the background and
+    updated in place by `set()` (write-through), so getters never touch the DB.
+    """
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self.values = {}
+        self.loaded_at = 0.0
+        self.logger = None
+        self._task = None
+
+    async def load(self):
+        self.values = await get_all_settings()
+        self.loaded_at = time.time()
+
+    def get(self, key: str, default: str = None):
+        v = self.values.get(key)
+        return v if v is not None else default
+
+    async def set(self, key: str, value: str):
+        await set_setting(key, value)
+        self.values[key] = value
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.ttl)
+            try:
+                await self.load()
+            except Exception as e:
+                if self.logger: self.logger.warning(f"Settings refresh failed: {e}")
+
+    def start(self, logger=None):
+        self.logger = logger
+        if self._task is None and self.ttl > 0:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+SETTINGS = SettingsCache(SETTINGS_TTL_SECONDS)
 
 def get_rate_limit_seconds() -> int:
-    val = get_setting("rate_limit_seconds","30")
+    val = SETTINGS.get("rate_limit_seconds","30")
     try: return int(val)
     except: return 30
 
 def get_max_words() -> int:
-    val = get_setting("max_words","5000")
+    val = SETTINGS.get("max_words","5000")
     try: return int(val)
     except: return 5000
 
+def get_max_tokens() -> int:
+    # سقف واقعی پذیرش؛ اگر max_tokens تنظیم نشده از max_words حساب می‌شود
+    return max_tokens_for(get_max_words(), SETTINGS.get("max_tokens"))
+
 def get_allowed_languages():
-    v = get_setting("allowed_languages","fa,en,ar")
+    v = SETTINGS.get("allowed_languages","fa,en,ar")
     return [x.strip() for x in v.split(",") if x.strip()]
 
 def get_default_provider():
-    return get_setting("default_provider","openai")
+    return SETTINGS.get("default_provider","openai")
@@ -0,0 +1,92 @@
+import os
+import time
+import asyncio
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from .chunker import TELEGRAM_MESSAGE_LIMIT
+
+# فاصله‌ی بین دو edit پشت سر هم روی یک پیام (محدودیت تلگرام ~۱ edit در ثانیه در هر چت)
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+STREAM_CURSOR = " ▌"
+
+class StreamingReply:
+    """A reply that is posted as a placeholder and edited while text streams in.
+
+    Edits are throttled to `interval` seconds; when the current message reaches
+    `limit` characters it is finalised and the rest continues in a new message.
+    """
+    def __init__(self, bot, chat_id: int, interval: float = STREAM_EDIT_INTERVAL,
+                 limit: int = TELEGRAM_MESSAGE_LIMIT):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.interval = interval
+        self.limit = limit
+        self.message_ids = []
+        self.received = False
+        self._buf = ""
+        self._parts = []
+        self._shown = ""
+        self._next_edit = 0.0
+
+    @property
+    def text(self) -> str:
+        # کل خروجی دریافت‌شده، در همه‌ی پیام‌ها
+        return "".join(self._parts).strip()
+
+    async def start(self, placeholder: str = "✍️ در حال ویرایش..."):
+        await self._new_message(placeholder)
+
+    async def _new_message(self, text: str):
+        msg = await self.bot.send_message(self.chat_id, text, parse_mode=None)
+        self.message_ids.append(msg.message_id)
+        self._shown = text
+
+    async def _edit(self, text: str, force: bool = False):
+        now = time.monotonic()
+        if text == self._shown or (not force and now < self._next_edit):
+            return
+        try:
+            await self.bot.edit_message_text(
+                text=text, chat_id=self.chat_id, message_id=self.message_ids[-1], parse_mode=None
+            )
+            self._shown = text
+        except TelegramRetryAfter as e:
+            self._next_edit = now + e.retry_after
+            if not force:
+                return
+            # پیام نهایی باید برسد، حتی با تاخیر
+            await asyncio.sleep(e.retry_after)
+            return await self._edit(text, force=True)
+        except TelegramBadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+        self._next_edit = max(self._next_edit, now + self.interval)
+
+    def _cut(self, text: str) -> int:
+        cut = text.rfind("\n", 0, self.limit)
+        if cut < self.limit // 2:
+            cut = text.rfind(" ", 0, self.limit)
+        if cut < self.limit // 2:
+            cut = self.limit
+        return cut
+
+    async def feed(self, delta: str):
+        if not delta:
+            return
+        self.received = True
+        self._parts.append(delta)
+        self._buf += delta
+        while len(self._buf) + len(STREAM_CURSOR) > self.limit:
+            cut = self._cut(self._buf)
+            head, self._buf = self._buf[:cut].rstrip(), self._buf[cut:].lstrip()
+            await self._edit(head, force=True)
+            await self._new_message(self._buf + STREAM_CURSOR if self._buf else "…")
+        await self._edit(self._buf + STREAM_CURSOR)
+
+    async def finish(self, note: str = "", empty_text: str = "✅ پردازش انجام شد."):
+        text = (self._buf.strip() if self.received else empty_text) + note
+        while len(text) > self.limit:
+            cut = self._cut(text)
+            await self._edit(text[:cut].rstrip(), force=True)
+            text = text[cut:].lstrip()
+            await self._new_message(text[:self.limit])
+        await self._edit(text, force=True)
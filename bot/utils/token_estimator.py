@@ -0,0 +1,110 @@
+import os
+import math
+import contextvars
+from typing import NamedTuple
+
+try:
+    # اختیاری؛ بدون آن تخمین سرانگشتی پایین استفاده می‌شود
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# چند کاراکتر به ازای هر توکن، جدا برای هر خط؛ با مقایسه‌ی est_tokens_* و tokens_* در جدول jobs تنظیم شود
+CHARS_PER_TOKEN_ARABIC = float(os.getenv("CHARS_PER_TOKEN_ARABIC", "2.5"))
+CHARS_PER_TOKEN_LATIN = float(os.getenv("CHARS_PER_TOKEN_LATIN", "4.0"))
+CHARS_PER_TOKEN_OTHER = float(os.getenv("CHARS_PER_TOKEN_OTHER", "1.5"))
+# خروجی ویراستاری تقریبا هم‌اندازه‌ی ورودی است
+OUTPUT_RATIO = float(os.getenv("OUTPUT_RATIO", "1.1"))
+# پیش‌فرض سقف توکن وقتی max_tokens در settings نیست: max_words × این عدد
+TOKENS_PER_WORD = float(os.getenv("TOKENS_PER_WORD", "2.0"))
+# برای ETA: سرعت تولید خروجی و سربار هر درخواست
+OUTPUT_TOKENS_PER_SECOND = float(os.getenv("OUTPUT_TOKENS_PER_SECOND", "60"))
+REQUEST_OVERHEAD_SECONDS = float(os.getenv("REQUEST_OVERHEAD_SECONDS", "1.5"))
+TIKTOKEN_ENCODING = os.getenv("TIKTOKEN_ENCODING", "o200k_base")
+
+_encoding = None
+
+class Estimate(NamedTuple):
+    prompt_tokens: int
+    output_tokens: int
+    chunk_tokens: int
+    chunks: int
+    eta_seconds: float
+
+def _is_arabic(ch: str) -> bool:
+    o = ord(ch)
+    return 0x0600 <= o <= 0x06FF or 0x0750 <= o <= 0x077F or 0xFB50 <= o <= 0xFEFF
+
+def heuristic_tokens(text: str) -> int:
+    """Per-script character ratio; whitespace is mostly merged into tokens."""
+    arabic = latin = other = 0
+    for ch in text:
+        if ch.isspace():
+            continue
+        if ch.isascii():
+            latin += 1
+        elif _is_arabic(ch):
+            arabic += 1
+        else:
+            other += 1
+    return max(1, math.ceil(arabic / CHARS_PER_TOKEN_ARABIC + latin / CHARS_PER_TOKEN_LATIN
+                            + other / CHARS_PER_TOKEN_OTHER))
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+        except Exception:
+            # فایل encoding دانلود نشد (آفلاین)؛ تخمین سرانگشتی
+            _encoding = False
+    return _encoding or None
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    enc = _get_encoding()
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return heuristic_tokens(text)
+
+def chunk_budget(prompt_tokens: int, max_chunk: int) -> int:
+    """Even chunk size: n = ceil(total / max_chunk) chunks of about total / n tokens."""
+    n = math.ceil(prompt_tokens / max_chunk)
+    if n <= 1:
+        return max_chunk
+    # کمی جا برای گرد شدن تخمین هر پاراگراف
+    return min(max_chunk, math.ceil(prompt_tokens / n * 1.1))
+
+def estimate(text: str, instruction: str, max_chunk: int, concurrency: int) -> Estimate:
+    """Token cost of one edit request; computed once in the handler and stored on the job."""
+    text_tokens = count_tokens(text)
+    chunk_tokens = chunk_budget(text_tokens, max_chunk)
+    chunks = max(1, math.ceil(text_tokens / chunk_tokens))
+    prompt = text_tokens + chunks * count_tokens(instruction)
+    output = math.ceil(text_tokens * OUTPUT_RATIO)
+    # تکه‌ها موازی اجرا می‌شوند؛ هر موج به اندازه‌ی یک تکه طول می‌کشد
+    waves = math.ceil(chunks / max(1, concurrency))
+    per_chunk = REQUEST_OVERHEAD_SECONDS + output / chunks / OUTPUT_TOKENS_PER_SECOND
+    return Estimate(prompt, output, chunk_tokens, chunks, round(waves * per_chunk, 1))
+
+def max_tokens_for(max_words: int, setting: str = None) -> int:
+    try:
+        return int(setting)
+    except (TypeError, ValueError):
+        return int(max_words * TOKENS_PER_WORD)
+
+# مصرف واقعی توکن در job جاری؛ QueueManager قبل از پردازش یک dict می‌گذارد و
+# توابع موتورها بعد از هر پاسخ به آن اضافه می‌کنند (تسک‌های فرزند همان dict را می‌بینند)
+_usage = contextvars.ContextVar("token_usage", default=None)
+
+def start_usage() -> dict:
+    usage = {"prompt": 0, "output": 0}
+    _usage.set(usage)
+    return usage
+
+def record_usage(prompt_tokens, output_tokens):
+    usage = _usage.get()
+    if usage is not None:
+        usage["prompt"] += prompt_tokens or 0
+        usage["output"] += output_tokens or 0
@@ -4,21 +4,31 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-s3 = boto3.client(
-    "s3",
-    endpoint_url=os.getenv("S3_ENDPOINT"),
-    aws_access_key_id=os.getenv("S3_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("S3_SECRET_ACCESS_KEY"),
-    region_name=os.getenv("S3_REGION", "auto"),
-)
+_s3 = None
 
-def upload_file_to_s3(local_path, remote_key):
+def get_s3():
+    # client فقط وقتی اولین آپلود لازم شد ساخته می‌شود، نه موقع import
+    global _s3
+    if _s3 is None:
+        _s3 = boto3.client(
+            "s3",
+            endpoint_url=os.getenv("S3_ENDPOINT"),
+            aws_access_key_id=os.getenv("S3_ACCESS_KEY_ID"),
+            aws_secret_access_key=os.getenv("S3_SECRET_ACCESS_KEY"),
+            region_name=os.getenv("S3_REGION", "auto"),
+        )
+    return _s3
+
+def upload_fileobj_to_s3(fileobj, remote_key, content_type="image/jpeg"):
     bucket = os.getenv("S3_BUCKET")
-    with open(local_path, "rb") as f:
-        s3.upload_fileobj(f, bucket, remote_key, ExtraArgs={"ContentType": "image/jpeg"})
+    get_s3().upload_fileobj(fileobj, bucket, remote_key, ExtraArgs={"ContentType": content_type})
     return f"{bucket}/{remote_key}"
 
+def upload_file_to_s3(local_path, remote_key):
+    with open(local_path, "rb") as f:
+        return upload_fileobj_to_s3(f, remote_key)
+
 def download_file_from_s3(remote_key, local_path):
     bucket = os.getenv("S3_BUCKET")
     with open(local_path, "wb") as f:
-        s3.download_fileobj(bucket, remote_key, f)
+        get_s3().download_fileobj(bucket, remote_key, f)
@@ -0,0 +1,75 @@
+import os
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "5000"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "600"))
+
+class UserProfile(NamedTuple):
+    telegram_id: int
+    full_name: Optional[str]
+    username: Optional[str]
+    preferred_language: Optional[str]
+    instructions: Optional[str]
+    preferred_provider: Optional[str]
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(
+            telegram_id=row["telegram_id"],
+            full_name=row["full_name"],
+            username=row["username"],
+            preferred_language=row["preferred_language"],
+            instructions=row["instructions"],
+            preferred_provider=row["preferred_provider"],
+        )
+
+class UserCache:
+    """Bounded LRU of `UserProfile` records with a per-entry TTL."""
+    def __init__(self, size: int, ttl: int):
+        self.size = size
+        self.ttl = ttl
+        self._data = OrderedDict()   # telegram_id -> (expires_at, UserProfile)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, telegram_id: int):
+        item = self._data.get(telegram_id)
+        if item is None or item[0] < time.time():
+            if item is not None:
+                del self._data[telegram_id]
+            self.misses += 1
+            return None
+        self._data.move_to_end(telegram_id)
+        self.hits += 1
+        return item[1]
+
+    def put(self, profile: UserProfile):
+        if self.size <= 0:
+            return
+        self._data[profile.telegram_id] = (time.time() + self.ttl, profile)
+        self._data.move_to_end(profile.telegram_id)
+        while len(self._data) > self.size:
+            self._data.popitem(last=False)
+
+    def patch(self, telegram_id: int, **fields):
+        # فقط اگر در cache هست؛ وگرنه خواندن بعدی از DB پر می‌کند
+        item = self._data.get(telegram_id)
+        if item is not None:
+            self.put(item[1]._replace(**fields))
+
+    def invalidate(self, telegram_id: int):
+        self._data.pop(telegram_id, None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+USER_CACHE = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
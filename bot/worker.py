@@ -0,0 +1,40 @@
+"""Queue consumer only: claims jobs from the DB and replies via its own Bot.
+
+Any number of these can run against the same DB as `python -m bot.ingress`.
+"""
+import asyncio
+from dotenv import load_dotenv
+
+from .app import create_bot, open_resources, close_resources, wait_for_signal
+from .utils.logger_util import setup_logger
+from .utils.queue_manager import QueueManager
+
+async def main():
+    load_dotenv()
+    logger = setup_logger()
+    await open_resources(logger)
+
+    bot = create_bot()
+    queue_manager = QueueManager()
+    queue_manager.set_logger(logger)
+
+    # handlerهای سیگنال پیش از start نصب می‌شوند
+    stop = asyncio.create_task(wait_for_signal())
+    await asyncio.sleep(0)
+
+    await queue_manager.start(bot)
+    logger.info(f"Worker {queue_manager.worker_id} is up ({queue_manager.workers} workers).")
+    try:
+        await stop
+    finally:
+        logger.info("Stopping workers...")
+        await queue_manager.stop()
+        await close_resources()
+        await bot.session.close()
+        logger.info("Bye.")
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+os.environ.setdefault("ADMIN_IDs", "")
+# bot.storage یک backend را در زمان import انتخاب می‌کند؛ تست‌ها خودشان database_async.db را عوض می‌کنند.
+# مقدار خالی (نه حذف) تا load_dotenv مقدار .env را رویش ننویسد.
+if os.getenv("DATABASE_URL"):
+    os.environ["DB_TYPE"] = "postgres"
+    os.environ["DB_URL"] = ""
+else:
+    os.environ["DB_TYPE"] = "sqlite"
+    os.environ["DATABASE_URL"] = ""
+    os.environ["DB_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="tests_"), "import.db")
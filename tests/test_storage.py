@@ -0,0 +1,244 @@
+"""The same checks against both storage backends, through `database_async` like the bot.
+
+    pytest tests/test_storage.py                                 # SQLite only
+    DATABASE_URL=postgresql://.../throwaway pytest tests/test_storage.py
+
+Postgres writes users, jobs and settings rows, so use a throwaway database.
+Every test gets fresh telegram ids and a provider name of its own, so rows
+left by earlier runs do not interfere.
+"""
+import os
+import time
+import uuid
+import asyncio
+
+import pytest
+
+
+class Ctx:
+    def __init__(self, adb, db):
+        self.adb = adb
+        self.db = db
+        self.nonce = uuid.uuid4().hex[:8]
+        self.provider = f"test-{self.nonce}"
+        self.worker = f"test-worker-{self.nonce}"
+        self.base_tid = 7_000_000_000 + int(self.nonce, 16) % 1_000_000_000
+
+    def tid(self, i: int) -> int:
+        return self.base_tid + i
+
+    async def user(self, i: int):
+        await self.adb.upsert_user(self.tid(i), f"user {i}", f"u{i}", None)
+        return self.tid(i)
+
+    async def claim(self):
+        return await self.adb.claim_job(self.worker, 60, [self.provider])
+
+    async def user_row(self, tid: int):
+        # مستقیم از DB، نه USER_CACHE
+        return await self.adb._run(self.db.get_user_by_tid, tid)
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def c(request, tmp_path, monkeypatch):
+    if request.param == "sqlite":
+        from bot import database_sqlite as db
+        db.close_pool()
+        monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "test.db"))
+    else:
+        if not os.getenv("DATABASE_URL"):
+            pytest.skip("DATABASE_URL not set")
+        from bot import database as db
+    from bot import database_async as adb
+    monkeypatch.setattr(adb, "db", db)
+    adb.open_pool()
+    db.init_db()
+    yield Ctx(adb, db)
+    adb.close_pool()
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_init_db_is_idempotent(c):
+    c.db.init_db()
+    c.db.init_db()
+
+
+def test_upsert_user_reports_creation(c):
+    async def body():
+        tid = c.tid(1)
+        assert await c.adb.upsert_user(tid, "Ali", "ali", None) is True
+        assert await c.adb.upsert_user(tid, "Ali", "ali", None) is False
+        row = await c.user_row(tid)
+        assert row["telegram_id"] == tid and row["full_name"] == "Ali" and row["username"] == "ali"
+        assert row["preferred_language"] == "fa"
+        assert row["instructions"] is None and row["preferred_provider"] is None
+        assert await c.user_row(c.tid(999)) is None
+    run(body())
+
+
+def test_user_preferences_round_trip(c):
+    async def body():
+        tid = await c.user(2)
+        await c.adb.set_user_language(tid, "en")
+        await c.adb.set_user_instruction(tid, "رسمی")
+        await c.adb.set_user_provider(tid, "gemini")
+        row = await c.user_row(tid)
+        assert (row["preferred_language"], row["instructions"], row["preferred_provider"]) == ("en", "رسمی", "gemini")
+        assert await c.adb.get_user_provider(tid) == "gemini"
+        assert await c.adb.get_user_provider(c.tid(998)) is None
+    run(body())
+
+
+def test_profile_pic_uid(c):
+    async def body():
+        tid = await c.user(3)
+        assert await c.adb.get_profile_pic_uid(tid) is None
+        await c.adb.set_profile_pic_uid(tid, "uid-1")
+        assert await c.adb.get_profile_pic_uid(tid) == "uid-1"
+    run(body())
+
+
+def test_settings(c):
+    async def body():
+        key = f"test_{c.nonce}"
+        assert await c.adb.get_setting(key, "dflt") == "dflt"
+        await c.adb.set_setting(key, "1")
+        await c.adb.set_setting(key, "2")
+        assert await c.adb.get_setting(key) == "2"
+        everything = await c.adb.get_all_settings()
+        assert everything[key] == "2"
+        assert {"rate_limit_seconds", "max_words", "allowed_languages", "default_provider"} <= set(everything)
+    run(body())
+
+
+def test_fair_claim_order(c):
+    async def body():
+        a, b = await c.user(10), await c.user(11)
+        a1, a2, a3 = [await c.adb.enqueue_job(a, c.provider, a, f"a{i}", None) for i in range(3)]
+        b1 = await c.adb.enqueue_job(b, c.provider, b, "b1", None)
+        urgent = await c.adb.enqueue_job(b, c.provider, b, "urgent", None, lane=1)
+        assert await c.adb.queue_position(urgent) == 1
+        assert await c.adb.queue_position(a1) == 2
+        # b1 پشت سر صف شروع می‌کند، نه پشت هر سه job کاربر a
+        assert await c.adb.queue_position(b1) == 4
+        order = [(await c.claim())["id"] for _ in range(5)]
+        assert order == [urgent, a1, a2, b1, a3]
+        assert await c.claim() is None
+        assert await c.adb.queue_position(a1) == 0
+        await c.adb.update_jobs([(job_id, {"status": "done"}) for job_id in order])
+    run(body())
+
+
+def test_claimed_job_fields_and_latency(c):
+    async def body():
+        tid = await c.user(12)
+        t0 = time.time()
+        job_id = await c.adb.enqueue_job(tid, c.provider, 555, "متن", "ویرایش", chunk_tokens=42, t_enqueue=t0)
+        job = await c.claim()
+        assert job["id"] == job_id and job["user_id"] == tid and job["chat_id"] == 555
+        assert (job["text"], job["instruction"], job["provider"]) == ("متن", "ویرایش", c.provider)
+        assert job["attempts"] == 1 and job["chunk_tokens"] == 42
+        assert float(job["waited"]) >= 0
+        assert await c.adb.claim_job(c.worker, 60, [f"other-{c.nonce}"]) is None
+        assert await c.adb.heartbeat_jobs(c.worker, 60, [job_id]) == 1
+        await c.adb.update_job(job_id, status="done", provider="openai", tokens_in=3, tokens_out=4,
+                               t_dequeue=t0 + 1, t_provider_start=t0 + 1.5, t_first_byte=t0 + 2,
+                               t_provider_end=t0 + 3, t_delivered=t0 + 3.5, model=c.nonce, key_index=0)
+        assert await c.adb.heartbeat_jobs(c.worker, 60, [job_id]) == 0
+        stages = await c.adb.job_latency(t0 - 0.001, c.nonce)
+        assert set(stages) == {"queue", "setup", "first_byte", "provider", "delivery", "total"}
+        n, p50, p95, p99 = stages["total"]
+        assert n == 1 and p50 == pytest.approx(3.5) and p99 == pytest.approx(3.5)
+        assert (await c.adb.job_latency(t0 - 0.001, f"none-{c.nonce}"))["total"][0] == 0
+    run(body())
+
+
+def test_batched_updates(c):
+    async def body():
+        tid = await c.user(13)
+        ids = [await c.adb.enqueue_job(tid, c.provider, tid, f"t{i}", None) for i in range(3)]
+        for _ in ids:
+            await c.claim()
+        await c.adb.update_jobs([(ids[0], {"status": "done"}),
+                                 (ids[1], {"status": "error", "error_message": "x"}),
+                                 (ids[2], {"retry_count": 2})])
+        assert await c.adb.heartbeat_jobs(c.worker, 60, ids) == 1
+        assert set(await c.adb.queue_depth()) <= {"pending", "processing"}
+        stats = await c.adb.stats_counts()
+        assert set(stats) == {"users", "jobs", "pending", "processing", "done", "error"}
+        assert stats["done"] >= 1 and stats["error"] >= 1 and stats["processing"] >= 1
+    run(body())
+
+
+def test_heartbeat_renews_only_given_jobs(c):
+    async def body():
+        tid = await c.user(15)
+        live, dead = [await c.adb.enqueue_job(tid, c.provider, tid, f"h{i}", None) for i in range(2)]
+        for _ in range(2):
+            await c.adb.claim_job(c.worker, 0, [c.provider])
+        assert await c.adb.heartbeat_jobs(c.worker, 60, []) == 0
+        assert await c.adb.heartbeat_jobs(f"other-{c.nonce}", 60, [live]) == 0
+        assert await c.adb.heartbeat_jobs(c.worker, 60, [live]) == 1
+        await asyncio.sleep(1.1)
+        # فقط lease job رهاشده منقضی شده است
+        assert await c.adb.reclaim_expired_jobs(5) >= 1
+        job = await c.claim()
+        assert job["id"] == dead and job["attempts"] == 2
+        assert await c.claim() is None
+        await c.adb.update_jobs([(live, {"status": "done"}), (dead, {"status": "done"})])
+    run(body())
+
+
+def test_expired_lease_is_reclaimed(c):
+    async def body():
+        tid = await c.user(14)
+        job_id = await c.adb.enqueue_job(tid, c.provider, tid, "دوباره", None)
+        assert (await c.adb.claim_job(c.worker, 0, [c.provider]))["id"] == job_id
+        # دقت datetime در SQLite یک ثانیه است
+        await asyncio.sleep(1.1)
+        assert await c.adb.reclaim_expired_jobs(5) >= 1
+        job = await c.claim()
+        assert job["id"] == job_id and job["attempts"] == 2
+        await c.adb.update_job(job_id, status="done")
+    run(body())
+
+
+def test_rate_limit(c):
+    async def body():
+        key = f"test:{c.nonce}"
+        assert await c.adb.rate_limit_hit(key, 30, 2) == 0
+        assert await c.adb.rate_limit_hit(key, 30, 2) == 0
+        assert 0 < await c.adb.rate_limit_hit(key, 30, 2) <= 30
+        assert await c.adb.prune_rate_limits() >= 0
+    run(body())
+
+
+def _import_storage(**env):
+    import subprocess
+    import sys
+    full = {**os.environ, "DB_TYPE": "", "DB_URL": "", "DATABASE_URL": "", **env}
+    return subprocess.run([sys.executable, "-c", "from bot import storage; print(storage.DB_TYPE)"],
+                          cwd=os.path.join(os.path.dirname(__file__), ".."), env=full,
+                          capture_output=True, text=True)
+
+
+@pytest.mark.parametrize("env", [
+    {"DB_TYPE": "sqlite", "DATABASE_URL": "postgresql://u:p@localhost/x"},
+    {"DB_TYPE": "postgres", "DB_URL": "sqlite:///x.db", "DATABASE_URL": ""},
+    {"DB_URL": "sqlite:///x.db", "DATABASE_URL": "postgresql://u:p@localhost/x"},
+    {"DB_TYPE": "postgres"},
+    {"DB_TYPE": "mysql"},
+])
+def test_bad_storage_settings_stop_startup(env):
+    proc = _import_storage(**env)
+    assert proc.returncode != 0
+    assert "RuntimeError" in proc.stderr
+
+
+def test_storage_defaults_to_sqlite(tmp_path):
+    proc = _import_storage(DB_URL=f"sqlite:///{tmp_path}/x.db")
+    assert proc.returncode == 0, proc.stderr
+    assert proc.stdout.strip() == "sqlite"